@@ -1,65 +1,157 @@
 """
 This is the blocking scheme used to make Entity Resolution computationally scalable.
+The blocking row of the header selects the blocking key functions of each feature, see blocking_keys.py
 """
 import numpy as np
 from itertools import izip
+from columnar import ColumnarRecords
+from inverted_index import build_inverted_index
+from blocking_keys import parse_blocking, is_offset, is_sorted, is_canopy, canopy_thresholds
+from canopy import canopies
+from blocking_statistics import BlockingStatistics, max_block_size_for_budget
+from dnf_blocking import predicate_index, conjunction_index
+from meta_blocking import meta_block, WEIGHTING_SCHEMES, PRUNING_SCHEMES
 __author__ = 'mbarnes1'
 
 
 class BlockingScheme(object):
-    def __init__(self, database, max_block_size=np.Inf, single_block=False):
+    def __init__(self, database, max_block_size=np.Inf, single_block=False, cores=1, window=5, meta_blocking=None,
+                 weighting='CBS', k=None, comparison_budget=None, split_oversized=False, dnf=None,
+                 offset_blocking=False):
         """
         :param database: RecordDatabase object
-        :param max_block_size: Integer. Blocks larger than this are thrown away (not informative & slow to process))
+        :param max_block_size: Integer. Blocks larger than this are thrown away (not informative & slow to process)), or
+                               split, see split_oversized
         :param single_block: Boolean, if True puts all records into a single weak block
+        :param cores: Int, number of processes used to build the inverted index
+        :param window: Int >= 2, sorted neighborhood window size. Records less than window positions apart in the sorted
+                       order of a 'sorted' blocking directive share a block
+        :param meta_blocking: String, pruning scheme ('WNP' or 'CNP', see meta_blocking.py). If given, the weak blocks
+                              are restructured into blocks of record pairs, keeping only the best weighted pairs of
+                              each record. Strong, sorted neighborhood and canopy blocks are unchanged
+        :param weighting: String, meta-blocking weighting scheme of record pairs ('CBS', 'JS' or 'ECBS')
+        :param k: Int, number of pairs kept by each record for CNP. If None, the average number of pairs per record
+        :param comparison_budget: Int, maximum number of candidate comparisons of the index blocks. If given, overrides
+                                  max_block_size with the largest cutoff which fits the budget
+        :param split_oversized: Boolean, if True blocks larger than max_block_size are split recursively by
+                                intersecting them with the keys of other features, instead of being thrown away
+        :param dnf: List of conjunctions, each a tuple of (feature index, directive) predicates, e.g. learned by
+                    dnf_blocking.learn_dnf_blocking. If given, records are blocked by the key combinations of each
+                    conjunction instead of by the blocking row of the header
+        :param offset_blocking: Boolean, if True header cells with offset directives (e.g. 'block;block+1') are blocked.
+                                Otherwise these cells are not blocked
         """
+        if window < 2:
+            raise Exception('Sorted neighborhood window must be at least 2')
+        if meta_blocking is not None and meta_blocking not in PRUNING_SCHEMES:
+            raise Exception('Invalid pruning scheme: ' + meta_blocking)
+        if weighting not in WEIGHTING_SCHEMES:
+            raise Exception('Invalid weighting scheme: ' + weighting)
         self._max_block_size = max_block_size
+        self._window = window
+        self._offset_blocking = offset_blocking
         self.strong_blocks = dict()
         self.weak_blocks = dict()
-        if not single_block:
-            self._generate_strong_blocks(database)
-            self._generate_weak_blocks(database)
-            self._clean_blocks()
-            self._complete_blocks(database.records.keys())
+        self.index = None  # InvertedIndex object of all blocking keys (including thrown away blocks)
+        if dnf:
+            self._add_dnf_blocks(database, dnf, cores)
+        elif not single_block:
+            self._generate_blocks(database, cores)
+            if comparison_budget is not None:
+                sizes = self.index.sizes()
+                sizes[self._regrouped_keys()] = 0  # windows and canopies are not cut by max_block_size
+                self._max_block_size = max_block_size_for_budget(sizes, comparison_budget)
+            keep = self._clean_blocks()
+            covered = list()  # records in blocks which are not keys of the index
+            if split_oversized:
+                covered.append(self._add_sub_blocks(database.feature_descriptor, keep))
+            if meta_blocking:
+                weak = self._meta_blocked_keys(database.feature_descriptor, keep)
+                keep &= ~weak
+                covered.append(self._add_pair_blocks(weak, meta_blocking, weighting, k))
+            self._add_blocks(database.feature_descriptor, keep)
+            self._add_sorted_neighborhood_blocks(database.feature_descriptor)
+            self._add_canopy_blocks(database.feature_descriptor)
+            self._complete_blocks(_record_ids(database.records), keep, np.concatenate(covered + [np.zeros(0)]))
         else:
             self._max_block_size = np.Inf
             self.weak_blocks['All'] = set(database.records.keys())
 
-    def _complete_blocks(self, keys):
+    def _complete_blocks(self, record_ids, keep, covered=None):
         """
         Finds ads missing from blocking scheme (due to sparse features), and ads them as single ads to weak blocks
-        :param keys: List of all the record identifiers that should be in the clustering
-        """
-        used_ads = set()
-        for _, ads in self.strong_blocks.iteritems():
-            used_ads.update(ads)
-        for _, ads in self.weak_blocks.iteritems():
-            used_ads.update(ads)
-        missing_ads = set(keys)
-        missing_ads.difference_update(used_ads)
-        for ad in missing_ads:
+        :param record_ids: 1D numpy array of all the record identifiers that should be in the clustering
+        :param keep: 1D boolean numpy array, which keys of the index are kept as blocks
+        :param covered: 1D int numpy array of record identifiers in blocks which are not keys of the index, or None
+        """
+        uncovered = self.index.uncovered(record_ids, keep)
+        if covered is not None:
+            uncovered = np.setdiff1d(uncovered, covered)
+        for ad in uncovered.tolist():
             block = 'singular_ad_' + str(ad)
             self.weak_blocks[block] = {ad}
 
     def _clean_blocks(self):
         """
-        Removed blocks larger than max_block_size
+        Removes blocks larger than max_block_size. Sorted neighborhood and canopy keys are always kept, they are
+        regrouped into windows of a fixed size or canopies of close values
+        :return keep: 1D boolean numpy array, which keys of the index are kept (as blocks, in windows or in canopies)
+        """
+        keep = self.index.sizes() <= self._max_block_size
+        keep[self._regrouped_keys()] = True
+        return keep
+
+    def dropped_keys(self):
+        """
+        :return keys: List of (feature index, label, key) of the index keys thrown away for being too frequent
+                      (blocks larger than max_block_size), most frequent first
+        """
+        if self.index is None:
+            return list()
+        sizes = self.index.sizes()
+        dropped = np.flatnonzero(~self._clean_blocks())
+        return [self.index.keys[k] for k in dropped[np.argsort(-sizes[dropped], kind='mergesort')]]
+
+    def blocks(self):
+        """
+        :return blocks: List of sets of record identifiers, the strong blocks followed by the weak blocks
+        """
+        return self.strong_blocks.values() + self.weak_blocks.values()
+
+    def candidate_pairs(self):
+        """
+        The distinct pairs of records sharing at least one block. Pairs of records sharing several blocks are only
+        generated once
+        :return pairs: 2D int64 numpy array of shape (number of pairs, 2), record identifiers of each pair (first <
+                       second), sorted
+        """
+        return distinct_pairs(self.blocks())
+
+    def statistics(self, labels=None):
+        """
+        Cost (and quality, given labels) of the blocks, before any pairs are scored
+        :param labels: True cluster label of each record, dictionary of form [ad id, cluster label]. Optional
+        :return statistics: BlockingStatistics object
         """
-        toremove = list()
-        for block, ads in self.strong_blocks.iteritems():
-            blocksize = len(ads)
-            if blocksize > self._max_block_size:
-                toremove.append(block)
-        for remove in toremove:
-            del self.strong_blocks[remove]
+        return BlockingStatistics(self, labels)
 
-        toremove = list()
-        for block, ads in self.weak_blocks.iteritems():
-            blocksize = len(ads)
-            if blocksize > self._max_block_size:
-                toremove.append(block)
-        for remove in toremove:
-            del self.weak_blocks[remove]
+    def _sorted_keys(self):
+        """
+        :return keys: 1D int numpy array, the codes of index keys with a sorted neighborhood directive
+        """
+        return np.array([k for k, (_, label, _) in enumerate(self.index.keys) if is_sorted(label)], dtype=int)
+
+    def _canopy_keys(self):
+        """
+        :return keys: 1D int numpy array, the codes of index keys with a canopy directive
+        """
+        return np.array([k for k, (_, label, _) in enumerate(self.index.keys) if is_canopy(label)], dtype=int)
+
+    def _regrouped_keys(self):
+        """
+        :return keys: 1D int numpy array, the codes of index keys which are regrouped instead of blocked by exact key
+        """
+        return np.concatenate([self._sorted_keys(), self._canopy_keys()])
 
     def number_of_blocks(self):
         """
@@ -69,32 +161,222 @@ class BlockingScheme(object):
         num_blocks = len(self.weak_blocks) + len(self.strong_blocks)
         return num_blocks
 
-    def _generate_strong_blocks(self, database):
-        self._generate_blocks('strong', self.strong_blocks, database)
+    def _generate_blocks(self, database, cores):
+        """
+        Builds the inverted index of all the strong and weak blocked features, in a single pass over the records
+        :param database: RecordDatabase object
+        :param cores: Int, number of processes
+        """
+        feature_descriptor = database.feature_descriptor
+        to_block = list()
+        for index, (strength, blocking, feature_type) in enumerate(izip(feature_descriptor.strengths,
+                                                                        feature_descriptor.blocking,
+                                                                        feature_descriptor.types)):
+            if strength in ('strong', 'weak'):
+                directives = parse_blocking(blocking, feature_type)  # did user specify blocking?
+                if not self._offset_blocking and any(is_offset(directive) for _, directive in directives):
+                    continue  # opt-in, see offset_blocking
+                for label, directive in directives:
+                    to_block.append((index, label, directive))
+        self.index = build_inverted_index(database.records, to_block, cores=cores)
 
-    def _generate_weak_blocks(self, database):
-        self._generate_blocks('weak', self.weak_blocks, database)
+    def _add_blocks(self, feature_descriptor, keep):
+        """
+        Adds the kept keys of the index to the strong and weak blocks [block_name, set of ad indices in block]
+        :param feature_descriptor: FeatureDescriptor object
+        :param keep: 1D boolean numpy array, which keys of the index are kept as blocks
+        """
+        for k in np.flatnonzero(keep):
+            index, label, key = self.index.keys[k]
+            if is_sorted(label) or is_canopy(label):
+                continue
+            feature = self._block_name(feature_descriptor, k)
+            if feature_descriptor.strengths[index] == 'strong':
+                self.strong_blocks[feature] = set(self.index.block(k).tolist())
+            else:
+                self.weak_blocks[feature] = set(self.index.block(k).tolist())
 
-    @staticmethod
-    def _generate_blocks(block_strength, blocks_pointer, database):
+    def _add_dnf_blocks(self, database, dnf, cores):
         """
-        Generates the blocking scheme [block_name, set of ad indices in block]
-        :param block_strength: String 'weak' or 'strong'
-        :param blocks_pointer: Blocks to mutate, either self.strong_blocks or self.weak_blocks
+        Blocks of a DNF blocking scheme. Each conjunction blocks the records sharing a key of all its predicates, and
+        blocks larger than max_block_size are thrown away. A block is strong if any of its features is strong. Blocks
+        are named by their keys joined with '&', e.g. 'City_seattle&Age_25'
         :param database: RecordDatabase object
+        :param dnf: List of conjunctions, each a tuple of (feature index, directive) predicates
+        :param cores: Int, number of processes used to build the inverted index
         """
-        to_block = list()
-        for index, (strength, blocking) in enumerate(izip(database.feature_descriptor.strengths,
-                                                          database.feature_descriptor.blocking)):
-                if (strength == block_strength) & (blocking == 'block'):  # did user specify blocking for this feature?
-                    to_block.append(index)
-        for record_id, record in database.records.iteritems():  # loop through all the records
-            print block_strength, 'blocking ad', record_id
-            for index in to_block:
-                feature_name = database.feature_descriptor.names[index]
-                for subfeature in record.features[index]:
-                    feature = feature_name + '_' + str(subfeature)
-                    if feature in blocks_pointer:
-                        blocks_pointer[feature].add(record_id)
-                    else:
-                        blocks_pointer[feature] = {record_id}
\ No newline at end of file
+        feature_descriptor = database.feature_descriptor
+        predicates = sorted(set(predicate for conjunction in dnf for predicate in conjunction))
+        self.index, key_predicates = predicate_index(database.records, predicates, cores)
+        covered = list()
+        for conjunction in dnf:
+            blocks = conjunction_index(self.index, key_predicates, [predicates.index(p) for p in conjunction])
+            sizes = blocks.sizes()
+            for k in np.flatnonzero(sizes <= self._max_block_size):
+                codes = blocks.keys[k]
+                feature = '&'.join(self._block_name(feature_descriptor, code) for code in codes)
+                strong = any(feature_descriptor.strengths[self.index.keys[code][0]] == 'strong' for code in codes)
+                (self.strong_blocks if strong else self.weak_blocks)[feature] = set(blocks.block(k).tolist())
+            covered.append(blocks.record_ids[np.repeat(sizes <= self._max_block_size, sizes)])
+        self._complete_blocks(_record_ids(database.records), np.zeros(len(self.index), dtype=bool),
+                              np.concatenate(covered + [np.zeros(0, dtype=np.int64)]))
+
+    def _block_name(self, feature_descriptor, k):
+        """
+        :param feature_descriptor: FeatureDescriptor object
+        :param k: Int, key code
+        :return name: String, the block name of the key, e.g. 'City_seattle' or 'Name_soundex_S530'
+        """
+        index, label, key = self.index.keys[k]
+        if label == 'block':
+            return feature_descriptor.names[index] + '_' + str(key)
+        return feature_descriptor.names[index] + '_' + label + '_' + str(key)
+
+    def _add_sub_blocks(self, feature_descriptor, keep):
+        """
+        Adaptive sub-blocking. Each block larger than max_block_size is intersected with the keys of the other blocked
+        features of its records. Sub-blocks still larger than max_block_size are intersected again with the keys of
+        further features, until they fit or no features are left (then they are thrown away). A sub-block is strong if
+        any of its keys is strong. Sub-blocks are named by their keys joined with '&', e.g. 'City_seattle&Age_25'
+        :param feature_descriptor: FeatureDescriptor object
+        :param keep: 1D boolean numpy array, which keys of the index are kept
+        :return covered: 1D int64 numpy array, the record identifiers in any sub-block
+        """
+        sizes = self.index.sizes()
+        key_features = np.array([index for index, _, _ in self.index.keys], dtype=int)
+        splitting = np.ones(len(self.index), dtype=bool)  # keys used to split, not regrouped into windows or canopies
+        splitting[self._regrouped_keys()] = False
+        order = np.argsort(self.index.record_ids, kind='mergesort')  # transposed index, record id -> key codes
+        entry_records = self.index.record_ids[order]
+        entry_keys = np.repeat(np.arange(len(self.index)), sizes)[order]
+        seen = set()
+        covered = list()
+
+        def split(name, record_ids, features, last, strong):
+            starts = np.searchsorted(entry_records, record_ids, side='left')
+            ends = np.searchsorted(entry_records, record_ids, side='right')
+            lengths = ends - starts
+            entries = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+            keys = entry_keys[entries]
+            candidates = splitting[keys] & ~np.in1d(key_features[keys], list(features)) & (key_features[keys] > last)
+            keys = keys[candidates]
+            ids = entry_records[entries][candidates]
+            by_key = np.argsort(keys, kind='mergesort')
+            distinct, key_starts, counts = np.unique(keys[by_key], return_index=True, return_counts=True)
+            for k, start, count in izip(distinct.tolist(), key_starts.tolist(), counts.tolist()):
+                if count < 2:
+                    continue
+                sub_block = ids[by_key[start:start + count]]
+                sub_name = name + '&' + self._block_name(feature_descriptor, k)
+                sub_strong = strong or feature_descriptor.strengths[key_features[k]] == 'strong'
+                if count <= self._max_block_size:
+                    members = frozenset(sub_block.tolist())
+                    if members not in seen:
+                        seen.add(members)
+                        (self.strong_blocks if sub_strong else self.weak_blocks)[sub_name] = set(members)
+                        covered.append(sub_block)
+                else:  # only split further by later features, so each combination of features is tried once
+                    split(sub_name, sub_block, features | {key_features[k]}, key_features[k], sub_strong)
+
+        for k in np.flatnonzero(~keep & splitting):
+            split(self._block_name(feature_descriptor, k), self.index.block(k), {key_features[k]}, -1,
+                  feature_descriptor.strengths[key_features[k]] == 'strong')
+        return np.concatenate(covered + [np.zeros(0, dtype=np.int64)])
+
+    def _meta_blocked_keys(self, feature_descriptor, keep):
+        """
+        :param feature_descriptor: FeatureDescriptor object
+        :param keep: 1D boolean numpy array, which keys of the index are kept
+        :return weak: 1D boolean numpy array, the kept keys of the index which are restructured by meta-blocking (weak,
+                      and not sorted neighborhood or canopy keys)
+        """
+        weak = np.array([feature_descriptor.strengths[index] == 'weak' and not is_sorted(label) and not is_canopy(label)
+                         for index, label, _ in self.index.keys], dtype=bool)
+        return keep & weak
+
+    def _add_pair_blocks(self, weak, pruning, weighting, k):
+        """
+        Meta-blocking of the weak blocks. Each kept pair of records is added as a weak block
+        :param weak: 1D boolean numpy array, which keys of the index are restructured
+        :param pruning: String, pruning scheme
+        :param weighting: String, weighting scheme
+        :param k: Int, number of pairs kept by each record for CNP
+        :return covered: 1D int64 numpy array, the record identifiers of all kept pairs
+        """
+        pairs, _ = meta_block(self.index, weak, weighting, pruning, k)
+        for first, second in pairs.tolist():
+            self.weak_blocks['pair_' + str(first) + '_' + str(second)] = {first, second}
+        return pairs.ravel()
+
+    def _add_sorted_neighborhood_blocks(self, feature_descriptor):
+        """
+        Sorted neighborhood blocking. For each sorted directive, records are ordered by their keys, and each record is
+        paired with the next window-1 records of this sequence. Every pair becomes a block of two records (as in
+        _add_pair_blocks), so exactly the pairs less than window positions apart are compared, at most n*(window-1)
+        :param feature_descriptor: FeatureDescriptor object
+        """
+        passes = dict()  # [(feature index, label), list of (key, key code)]
+        for k in self._sorted_keys():
+            index, label, key = self.index.keys[k]
+            passes.setdefault((index, label), list()).append((key, k))
+        for (index, label), keys in passes.iteritems():
+            keys.sort()
+            sequence = np.concatenate([self.index.block(k) for _, k in keys]).astype(np.int64)
+            offsets = range(1, min(self._window, len(sequence)))
+            first = np.concatenate([sequence[:-offset] for offset in offsets] + [np.zeros(0, dtype=np.int64)])
+            second = np.concatenate([sequence[offset:] for offset in offsets] + [np.zeros(0, dtype=np.int64)])
+            distinct = first != second  # a record with several keys may neighbor itself
+            pairs = np.unique((np.minimum(first, second)[distinct] << 32) | np.maximum(first, second)[distinct])
+            blocks = self.strong_blocks if feature_descriptor.strengths[index] == 'strong' else self.weak_blocks
+            prefix = feature_descriptor.names[index] + '_' + label + '_'
+            for first, second in izip((pairs >> 32).tolist(), (pairs & (2**32 - 1)).tolist()):
+                blocks[prefix + str(first) + '_' + str(second)] = {first, second}
+
+    def _add_canopy_blocks(self, feature_descriptor):
+        """
+        Canopy blocking. For each canopy directive, the distinct values are clustered into overlapping canopies (see
+        canopy.py), and the records of the values of each canopy share a block
+        :param feature_descriptor: FeatureDescriptor object
+        """
+        passes = dict()  # [(feature index, label), list of (key, key code)]
+        for k in self._canopy_keys():
+            index, label, key = self.index.keys[k]
+            passes.setdefault((index, label), list()).append((key, k))
+        for (index, label), keys in passes.iteritems():
+            keys.sort()
+            loose, tight = canopy_thresholds(label)
+            numeric = feature_descriptor.types[index] in ('int', 'float', 'date')
+            blocks = self.strong_blocks if feature_descriptor.strengths[index] == 'strong' else self.weak_blocks
+            for number, members in enumerate(canopies([key for key, _ in keys], loose, tight, numeric)):
+                feature = feature_descriptor.names[index] + '_' + label + '_' + str(number)
+                blocks[feature] = set(np.concatenate([self.index.block(keys[m][1]) for m in members]).tolist())
+
+
+def distinct_pairs(blocks):
+    """
+    Enumerates the distinct record pairs of overlapping blocks. Pairs are encoded as int64 keys over the dense positions
+    of the blocked records, so duplicates are removed by a single sort
+    :param blocks: List of sets of record identifiers
+    :return pairs: 2D int64 numpy array of shape (number of pairs, 2), record identifiers of each pair (first < second),
+                   sorted
+    """
+    blocks = [np.fromiter(ads, dtype=np.int64, count=len(ads)) for ads in blocks if len(ads) > 1]
+    empty = np.zeros(0, dtype=np.int64)
+    nodes = np.unique(np.concatenate(blocks + [empty]))
+    pair_keys = list()
+    for block in blocks:
+        positions = np.searchsorted(nodes, np.sort(block))
+        i, j = np.triu_indices(len(block), 1)
+        pair_keys.append(positions[i]*len(nodes) + positions[j])
+    pair_keys = np.unique(np.concatenate(pair_keys + [empty]))
+    return np.column_stack([nodes[pair_keys // max(len(nodes), 1)], nodes[pair_keys % max(len(nodes), 1)]])
+
+
+def _record_ids(records):
+    """
+    :param records: Dictionary-like [record id, Record object]
+    :return ids: 1D int64 numpy array of all record identifiers
+    """
+    if isinstance(records, ColumnarRecords):
+        return records.key_array()
+    return np.fromiter(records.iterkeys(), dtype=np.int64, count=len(records))
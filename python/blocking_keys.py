@@ -0,0 +1,409 @@
+"""
+Blocking key functions, selected per feature in the blocking row of the header. Used by BlockingScheme
+A blocking cell holds one or more directives separated by semicolons, e.g. 'block;block+1' or 'prefix:4;soundex':
+    block           The exact subfeature value
+    block+N         The subfeature value plus N (numeric features), so values within N of each other share a block.
+                    Cells with an offset directive are only blocked with BlockingScheme(offset_blocking=True)
+    prefix:N        The first N characters of the normalized value
+    token           Each word of the normalized value
+    sorted_tokens   The distinct words of the normalized value in sorted order (robust to word order)
+    soundex         The Soundex code of each word
+    metaphone       The Metaphone code of each word
+    digits          The digits of the value (e.g. phone numbers with inconsistent formatting)
+    normalize       The value in lower case, without punctuation or repeated whitespace
+    sorted          Sorted neighborhood: records are sorted by the value, and each record is paired with its
+                    neighboring records (see BlockingScheme window). 'sorted:<directive>' sorts by the keys of another
+                    directive, e.g. 'sorted:normalize'. Several sorted directives give a multi-pass sorted neighborhood
+    minhash:T       MinHash LSH on the words of the value, for a target Jaccard similarity threshold T. Each LSH band of
+                    the signature is a key, so text with Jaccard similarity above T is likely to share a block.
+                    'minhash:T:Q' shingles the normalized value into character Q-grams instead of words
+    canopy:L:T      Canopy clustering of the distinct values, with loose and tight distance thresholds L >= T (see
+                    canopy.py). Distance is the absolute difference of numeric features, and the TF-IDF cosine
+                    distance of the words of other features. Each canopy is a block
+Each key function maps one subfeature to a list of keys. Cells with 'noblock' (or empty cells) are not blocked.
+"""
+import re
+import zlib
+import hashlib
+import numpy as np
+__author__ = 'mbarnes1'
+
+
+NO_BLOCKING = ('', 'noblock', 'no block')
+_NON_ALPHANUMERIC = re.compile('[^0-9a-z]+')
+_NON_DIGIT = re.compile('[^0-9]+')
+NUMBER_PERMUTATIONS = 100  # length of MinHash signatures
+_MERSENNE_PRIME = 2**31 - 1
+_permutations = None  # (a, b) of the MinHash hash functions (a*x + b) mod prime, see _minhash_permutations()
+
+
+def parse_blocking(blocking, feature_type):
+    """
+    Parses the blocking cell of a single feature
+    :param blocking: String, the blocking cell of the header
+    :param feature_type: String, the feature type
+    :return directives: List of (label, directive) string pairs. Keys of directives with the same label share blocks
+    """
+    directives = list()
+    for directive in blocking.split(';'):
+        directive = directive.strip()
+        if directive in NO_BLOCKING:
+            continue
+        name, argument = _split_directive(directive)
+        if name not in KEY_FUNCTIONS:
+            raise Exception('Invalid blocking directive: ' + directive)
+        if name == 'block' and argument is not None and feature_type not in ('int', 'float', 'date'):
+            raise Exception('Offset blocking requires a numeric feature: ' + directive)
+        key_function(directive)  # validates the argument
+        if name == 'sorted' and argument is not None:
+            parse_blocking(argument, feature_type)
+        directives.append(('block' if name == 'block' else directive, directive))
+    return directives
+
+
+def key_function(directive):
+    """
+    :param directive: String, a single blocking directive, e.g. 'prefix:4'
+    :return function: Function handle f(subfeature) returning a list of keys
+    """
+    name, argument = _split_directive(directive)
+    if name not in KEY_FUNCTIONS:
+        raise Exception('Invalid blocking directive: ' + directive)
+    try:
+        if name == 'block':
+            offset = int(argument) if argument is not None else 0
+            return lambda value: [value + offset] if offset else [value]
+        if name == 'prefix':
+            length = int(argument)
+            return lambda value: prefix(value, length)
+        if name == 'sorted':
+            return key_function(argument) if argument is not None else KEY_FUNCTIONS['block']
+        if name == 'minhash':
+            arguments = argument.split(':')
+            threshold = float(arguments[0])
+            q = int(arguments[1]) if len(arguments) > 1 else None
+            if not 0 < threshold < 1 or len(arguments) > 2 or (q is not None and q < 1):
+                raise ValueError
+            rows = lsh_bandwidth(NUMBER_PERMUTATIONS, threshold)
+            return lambda value: minhash_bands(value, rows, q)
+        if name == 'canopy':
+            canopy_thresholds(directive)
+            return KEY_FUNCTIONS['block']
+    except ValueError:
+        raise Exception('Invalid blocking directive: ' + directive)
+    return KEY_FUNCTIONS[name]
+
+
+def canopy_thresholds(directive):
+    """
+    :param directive: String, a canopy directive 'canopy:L:T'
+    :return loose: Float, loose distance threshold L, values closer than this to a canopy center are in its canopy
+    :return tight: Float, tight distance threshold T <= L, values closer than this can not be canopy centers
+    """
+    _, argument = _split_directive(directive)
+    try:
+        loose, tight = [float(threshold) for threshold in argument.split(':')]
+    except (ValueError, AttributeError):
+        raise Exception('Invalid blocking directive: ' + directive)
+    if not 0 <= tight <= loose:
+        raise Exception('Invalid blocking directive: ' + directive)
+    return loose, tight
+
+
+def _split_directive(directive):
+    """
+    :param directive: String, e.g. 'block', 'block+1' or 'prefix:4'
+    :return name: String, e.g. 'block' or 'prefix'
+    :return argument: String, e.g. '+1' or '4', or None
+    """
+    if directive.startswith('block') and directive[5:6] in ('+', '-'):
+        return 'block', directive[5:]
+    if ':' in directive:
+        name, argument = directive.split(':', 1)
+        return name, argument
+    return directive, None
+
+
+def normalize(value):
+    """
+    :param value: Subfeature value
+    :return keys: List with the lower case value, where runs of punctuation and whitespace become a single space
+    """
+    normalized = _normalize(value)
+    return [normalized] if normalized else []
+
+
+def _normalize(value):
+    return _NON_ALPHANUMERIC.sub(' ', str(value).lower()).strip()
+
+
+def prefix(value, length):
+    """
+    :param value: Subfeature value
+    :param length: Int, number of characters
+    :return keys: List with the first length characters of the normalized value
+    """
+    normalized = _normalize(value)
+    return [normalized[:length]] if normalized else []
+
+
+def tokens(value):
+    """
+    :param value: Subfeature value
+    :return keys: List of the distinct words of the normalized value
+    """
+    return list(set(_normalize(value).split()))
+
+
+def sorted_tokens(value):
+    """
+    :param value: Subfeature value
+    :return keys: List with the sorted distinct words of the normalized value, joined by spaces
+    """
+    words = sorted(set(_normalize(value).split()))
+    return [' '.join(words)] if words else []
+
+
+def digits(value):
+    """
+    :param value: Subfeature value
+    :return keys: List with the digits of the value
+    """
+    value_digits = _NON_DIGIT.sub('', str(value))
+    return [value_digits] if value_digits else []
+
+
+def soundex_tokens(value):
+    """
+    :param value: Subfeature value
+    :return keys: List of the distinct Soundex codes of the words of the value
+    """
+    return list(set(code for code in (soundex(word) for word in _normalize(value).split()) if code))
+
+
+def metaphone_tokens(value):
+    """
+    :param value: Subfeature value
+    :return keys: List of the distinct Metaphone codes of the words of the value
+    """
+    return list(set(code for code in (metaphone(word) for word in _normalize(value).split()) if code))
+
+
+_SOUNDEX_CODES = dict(zip('ABCDEFGHIJKLMNOPQRSTUVWXYZ', '01230120022455012623010202'))
+
+
+def soundex(word):
+    """
+    American Soundex code of a word, e.g. 'Robert' --> 'R163'
+    :param word: String
+    :return code: String of a letter and three digits, or None if the word has no letters
+    """
+    letters = [c for c in word.upper() if 'A' <= c <= 'Z']
+    if not letters:
+        return None
+    last = _SOUNDEX_CODES[letters[0]]
+    code = [letters[0]]
+    for letter in letters[1:]:
+        if letter in 'HW':  # does not separate letters with the same code
+            continue
+        digit = _SOUNDEX_CODES[letter]
+        if digit != '0' and digit != last:
+            code.append(digit)
+        last = digit
+    return (''.join(code) + '000')[:4]
+
+
+_VOWELS = 'AEIOU'
+_FRONT_VOWELS = 'EIY'
+
+
+def metaphone(word):
+    """
+    Metaphone code of a word (Philips, 1990), e.g. 'Knight' --> 'NT'
+    :param word: String
+    :return code: String, or None if the word has no letters
+    """
+    w = ''.join(c for c in word.upper() if 'A' <= c <= 'Z')
+    if not w:
+        return None
+    if w[:2] in ('AE', 'GN', 'KN', 'PN', 'WR'):
+        w = w[1:]
+    elif w[0] == 'X':
+        w = 'S' + w[1:]
+    elif w[:2] == 'WH':
+        w = 'W' + w[2:]
+    code = list()
+    length = len(w)
+    for i, c in enumerate(w):
+        previous = w[i-1] if i > 0 else ''
+        following = w[i+1] if i + 1 < length else ''
+        after = w[i+2] if i + 2 < length else ''
+        if c == previous and c != 'C':
+            continue
+        if c in _VOWELS:
+            if i == 0:
+                code.append(c)
+        elif c == 'B':
+            if not (previous == 'M' and i == length - 1):
+                code.append('B')
+        elif c == 'C':
+            if following == 'I' and after == 'A':
+                code.append('X')
+            elif following == 'H':
+                code.append('K' if previous == 'S' else 'X')
+            elif following in _FRONT_VOWELS and following:
+                if previous != 'S':
+                    code.append('S')
+            else:
+                code.append('K')
+        elif c == 'D':
+            code.append('J' if following == 'G' and after in _FRONT_VOWELS and after else 'T')
+        elif c == 'G':
+            if following == 'H' and not (i + 2 >= length or after in _VOWELS):
+                continue
+            if following == 'N' and (i + 2 == length or w[i+1:] == 'NED'):
+                continue
+            if previous == 'D' and following in _FRONT_VOWELS and following:
+                continue
+            code.append('J' if following in _FRONT_VOWELS and following and previous != 'G' else 'K')
+        elif c == 'H':
+            if previous in 'CSPTG' and previous:
+                continue
+            if previous in _VOWELS and previous and (not following or following not in _VOWELS):
+                continue
+            code.append('H')
+        elif c == 'K':
+            if previous != 'C':
+                code.append('K')
+        elif c == 'P':
+            code.append('F' if following == 'H' else 'P')
+        elif c == 'Q':
+            code.append('K')
+        elif c == 'S':
+            if following == 'H' or (following == 'I' and after in ('O', 'A')):
+                code.append('X')
+            else:
+                code.append('S')
+        elif c == 'T':
+            if following == 'I' and after in ('O', 'A'):
+                code.append('X')
+            elif following == 'H':
+                code.append('0')
+            elif not (following == 'C' and after == 'H'):
+                code.append('T')
+        elif c == 'V':
+            code.append('F')
+        elif c in 'WY':
+            if following in _VOWELS and following:
+                code.append(c)
+        elif c == 'X':
+            code.append('KS')
+        elif c == 'Z':
+            code.append('S')
+        else:  # F, J, L, M, N, R
+            code.append(c)
+    return ''.join(code)
+
+
+KEY_FUNCTIONS = {
+    'block': lambda value: [value],
+    'prefix': None,  # parametrized, see key_function()
+    'token': tokens,
+    'sorted_tokens': sorted_tokens,
+    'soundex': soundex_tokens,
+    'metaphone': metaphone_tokens,
+    'digits': digits,
+    'normalize': normalize,
+    'sorted': None,  # parametrized, see key_function()
+    'minhash': None,  # parametrized, see key_function()
+    'canopy': None,  # parametrized, see key_function()
+}
+
+
+def lsh_bandwidth(number_permutations, threshold):
+    """
+    Number of signature rows per LSH band, such that the threshold (1/b)**(1/r) of b bands of r rows is closest to the
+    target Jaccard threshold. Only the b = n // r full bands are used (see minhash_bands)
+    :param number_permutations: Int, signature length n >= b * r
+    :param threshold: Float in (0, 1), target Jaccard similarity
+    :return rows: Int, number of rows per band r
+    """
+    best = 1
+    minimum_error = float('inf')
+    for rows in xrange(1, number_permutations + 1):
+        bands = 1. / (threshold ** rows)
+        error = abs(number_permutations - bands * rows)
+        if error < minimum_error:
+            best = rows
+            minimum_error = error
+    return best
+
+
+def _minhash_permutations():
+    """
+    :return a, b: 1D int64 numpy arrays, the coefficients of the hash functions. Seeded, so signatures are identical
+                  in every process
+    """
+    global _permutations
+    if _permutations is None:
+        random_state = np.random.RandomState(0)
+        _permutations = (random_state.randint(1, _MERSENNE_PRIME, NUMBER_PERMUTATIONS).astype(np.int64),
+                         random_state.randint(0, _MERSENNE_PRIME, NUMBER_PERMUTATIONS).astype(np.int64))
+    return _permutations
+
+
+def minhash_signature(shingles):
+    """
+    :param shingles: Iterable of strings
+    :return signature: 1D int64 numpy array of length NUMBER_PERMUTATIONS, or None if there are no shingles
+    """
+    hashes = np.array([zlib.crc32(shingle) & 0xffffffff for shingle in set(shingles)], dtype=np.int64)
+    if not len(hashes):
+        return None
+    a, b = _minhash_permutations()
+    hashes %= _MERSENNE_PRIME
+    return ((np.outer(a, hashes) + b[:, np.newaxis]) % _MERSENNE_PRIME).min(axis=1)
+
+
+def minhash_bands(value, rows, q=None):
+    """
+    :param value: Subfeature value
+    :param rows: Int, number of signature rows per LSH band
+    :param q: Int, character q-gram length, or None for word shingles
+    :return keys: List of strings, one per full band of the MinHash signature. The leftover rows of the signature are
+                  not used, as a shorter band would make pairs candidates far below the target threshold
+    """
+    normalized = _normalize(value)
+    if q is None:
+        shingles = normalized.split()
+    else:
+        shingles = [normalized[i:i+q] for i in xrange(max(len(normalized) - q + 1, 1))] if normalized else []
+    signature = minhash_signature(shingles)
+    if signature is None:
+        return []
+    return [str(band) + '_' + hashlib.sha1(signature[start:start+rows].tostring()).hexdigest()[:16]
+            for band, start in enumerate(xrange(0, len(signature) - rows + 1, rows))]
+
+
+def is_offset(directive):
+    """
+    :param directive: String, a single blocking directive (see parse_blocking)
+    :return: Boolean, True if the directive blocks on the value plus an offset, e.g. 'block+1'
+    """
+    return _split_directive(directive) != ('block', None) and directive.startswith('block')
+
+
+def is_sorted(label):
+    """
+    :param label: String, directive label (see parse_blocking)
+    :return: Boolean, True if keys with this label are blocked by sorted neighborhood instead of by exact key
+    """
+    return label == 'sorted' or label.startswith('sorted:')
+
+
+def is_canopy(label):
+    """
+    :param label: String, directive label (see parse_blocking)
+    :return: Boolean, True if keys with this label are blocked by canopy clustering instead of by exact key
+    """
+    return label.startswith('canopy:')
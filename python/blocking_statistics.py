@@ -0,0 +1,88 @@
+"""
+Cost and quality statistics of a blocking scheme, available before any pairs are scored. Used by BlockingScheme
+The cost of entity resolution is dominated by the number of candidate comparisons, sum n*(n-1)/2 over blocks. Records
+sharing several blocks are compared redundantly. With labels, pair completeness (recall of the true matching pairs)
+and reduction ratio (fraction of all pairs which are not candidates) measure the quality of the blocks.
+"""
+import numpy as np
+__author__ = 'mbarnes1'
+
+
+class BlockingStatistics(object):
+    def __init__(self, blocking_scheme, labels=None, number_keys=10):
+        """
+        :param blocking_scheme: BlockingScheme object
+        :param labels: True cluster label of each record, dictionary of form [ad id, cluster label]. Optional
+        :param number_keys: Int, number of the largest blocks reported
+        """
+        blocks = blocking_scheme.strong_blocks.items() + blocking_scheme.weak_blocks.items()
+        sizes = np.array([len(ads) for _, ads in blocks], dtype=np.int64)
+        self.number_blocks = len(blocks)
+        self.comparisons = int(np.sum(sizes*(sizes - 1)//2))
+        pairs = blocking_scheme.candidate_pairs()
+        self.number_records = len(set().union(*[ads for _, ads in blocks]))
+        self.distinct_comparisons = len(pairs)
+        self.redundancy = float(self.comparisons)/self.distinct_comparisons if self.distinct_comparisons else 1.0
+        self.size_histogram = dict(zip(*[values.tolist() for values in np.unique(sizes, return_counts=True)]))
+        order = np.argsort(-sizes, kind='mergesort')[:number_keys]
+        self.largest_blocks = [(blocks[position][0], int(sizes[position])) for position in order]
+        self.dropped_keys = blocking_scheme.dropped_keys()
+        self.pair_completeness = None
+        self.reduction_ratio = None
+        if labels is not None:
+            self.pair_completeness, self.reduction_ratio = self._quality(pairs, labels)
+
+    def _quality(self, pairs, labels):
+        """
+        :param pairs: 2D int64 numpy array, the record identifiers of each candidate pair
+        :param labels: Dictionary [ad id, cluster label]
+        :return pair_completeness: Float, fraction of the true matching pairs which are candidates
+        :return reduction_ratio: Float, fraction of all record pairs which are not candidates
+        """
+        codes = dict((label, code) for code, label in enumerate(set(labels.itervalues())))
+        cluster_sizes = np.bincount([codes[label] for label in labels.itervalues()],
+                                    minlength=len(codes)).astype(np.int64)
+        true_pairs = np.sum(cluster_sizes*(cluster_sizes - 1)//2)
+        pair_clusters = np.array([codes[labels[ad]] for ad in pairs.ravel().tolist()], dtype=np.int64).reshape(-1, 2)
+        found = np.count_nonzero(pair_clusters[:, 0] == pair_clusters[:, 1])
+        pair_completeness = float(found)/true_pairs if true_pairs else 1.0
+        total_pairs = len(labels)*(len(labels) - 1)/2.0
+        reduction_ratio = 1.0 - self.distinct_comparisons/total_pairs if total_pairs else 0.0
+        return pair_completeness, reduction_ratio
+
+    def display(self):
+        """
+        Prints statistics to console
+        """
+        print 'Number of blocks:', self.number_blocks
+        print 'Number of blocked records:', self.number_records
+        print 'Candidate comparisons:', self.comparisons
+        print 'Distinct candidate comparisons:', self.distinct_comparisons
+        print 'Redundancy:', self.redundancy, '\n'
+        print 'Block size histogram [size: number of blocks]:'
+        for size, count in sorted(self.size_histogram.iteritems()):
+            print '    ' + str(size) + ': ' + str(count)
+        print 'Largest blocks:'
+        for name, size in self.largest_blocks:
+            print '    ' + name + ': ' + str(size)
+        print 'Number of dropped (too frequent) keys:', len(self.dropped_keys)
+        for key in self.dropped_keys[:len(self.largest_blocks)]:
+            print '    ' + str(key)
+        if self.pair_completeness is not None:
+            print '\nPair completeness:', self.pair_completeness
+            print 'Reduction ratio:', self.reduction_ratio
+
+
+def max_block_size_for_budget(sizes, budget):
+    """
+    Finds the largest block size cutoff whose blocks fit a comparison budget. Blocks larger than the cutoff (the most
+    frequent keys, e.g. stop words) are dropped
+    :param sizes: 1D int numpy array, the size of each candidate block
+    :param budget: Int, maximum number of candidate comparisons, sum n*(n-1)/2 over the kept blocks
+    :return max_block_size: Int, the cutoff. At least 1, so singleton blocks are always kept
+    """
+    sizes = np.asarray(sizes, dtype=np.int64)
+    distinct, counts = np.unique(sizes, return_counts=True)
+    cumulative = np.cumsum(counts*(distinct*(distinct - 1)//2))
+    affordable = distinct[cumulative <= budget]
+    return int(max(affordable[-1] if len(affordable) else 1, 1))
@@ -0,0 +1,108 @@
+"""
+Canopy clustering with a cheap distance (McCallum et al. 2000). Used by BlockingScheme for 'canopy:L:T' directives
+Canopy centers are drawn at random from the values which are not yet tightly covered. Each center forms a canopy of
+the remaining values within the loose distance L, and values within the tight distance T <= L can no longer be
+centers. Canopies overlap, so records near a canopy boundary are still blocked with their neighbors.
+"""
+import numpy as np
+from blocking_keys import tokens
+__author__ = 'mbarnes1'
+
+
+def canopies(values, loose, tight, numeric, seed=0):
+    """
+    :param values: List of distinct values
+    :param loose: Float, loose distance threshold
+    :param tight: Float, tight distance threshold (tight <= loose)
+    :param numeric: Boolean, if True the distance is the absolute difference of the values, otherwise the TF-IDF cosine
+                    distance of their words
+    :param seed: Int, seed of the random order of canopy centers
+    :return canopies: List of 1D int numpy arrays, the positions (into values) of the members of each canopy, ascending
+    """
+    neighbors = _numeric_neighbors(values, loose) if numeric else _cosine_neighbors(values, loose)
+    remaining = np.ones(len(values), dtype=bool)
+    members = list()
+    for center in np.random.RandomState(seed).permutation(len(values)):
+        if not remaining[center]:
+            continue
+        positions, distances = neighbors(center)
+        available = remaining[positions]
+        positions = positions[available]
+        distances = distances[available]
+        members.append(np.union1d(positions, [center]))
+        remaining[positions[distances <= tight]] = False
+        remaining[center] = False
+    return members
+
+
+def _numeric_neighbors(values, loose):
+    """
+    :param values: List of distinct numbers
+    :param loose: Float, loose distance threshold
+    :return neighbors: Function f(position) returning the positions of the values within loose of values[position],
+                       and their absolute differences
+    """
+    values = np.asarray(values, dtype=np.float64)
+    order = np.argsort(values, kind='mergesort')
+    ordered = values[order]
+
+    def neighbors(position):
+        value = values[position]
+        start = np.searchsorted(ordered, value - loose, side='left')
+        end = np.searchsorted(ordered, value + loose, side='right')
+        return order[start:end], np.abs(ordered[start:end] - value)
+    return neighbors
+
+
+def _cosine_neighbors(values, loose):
+    """
+    :param values: List of distinct strings
+    :param loose: Float, loose distance threshold
+    :return neighbors: Function f(position) returning the positions of the values within loose TF-IDF cosine distance
+                       of values[position], and their distances. Only values sharing a word can be closer than 1
+    """
+    indptr, words, weights = tfidf_vectors(values)
+    order = np.argsort(words, kind='mergesort')  # word -> value postings, as CSC
+    posting_values = np.repeat(np.arange(len(values)), np.diff(indptr))[order]
+    posting_weights = weights[order]
+    posting_indptr = np.zeros(words.max() + 2 if len(words) else 1, dtype=np.int64)
+    np.cumsum(np.bincount(words, minlength=len(posting_indptr) - 1), out=posting_indptr[1:])
+
+    def neighbors(position):
+        start, end = indptr[position], indptr[position + 1]
+        lengths = posting_indptr[words[start:end] + 1] - posting_indptr[words[start:end]]
+        entries = np.repeat(posting_indptr[words[start:end]], lengths) + \
+            np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        candidates, inverse = np.unique(posting_values[entries], return_inverse=True)
+        similarities = np.bincount(inverse, posting_weights[entries]*np.repeat(weights[start:end], lengths),
+                                   minlength=len(candidates))
+        distances = 1.0 - similarities
+        close = distances <= loose
+        return candidates[close], distances[close]
+    return neighbors
+
+
+def tfidf_vectors(values):
+    """
+    L2-normalized TF-IDF vectors of the distinct words of each value (binary term frequencies)
+    :param values: List of strings
+    :return indptr: 1D int64 numpy array of length len(values) + 1, CSR row pointers
+    :return words: 1D int64 numpy array, the word codes of each row, ascending within rows
+    :return weights: 1D float64 numpy array, the TF-IDF weight of each word of each row
+    """
+    rows = [tokens(value) for value in values]
+    vocabulary, codes = np.unique(np.array([word for row in rows for word in row] + [''], dtype=object),
+                                  return_inverse=True)
+    codes = codes[:-1]
+    counts = np.array([len(row) for row in rows], dtype=np.int64)
+    row_of = np.repeat(np.arange(len(values)), counts)
+    pairs = np.unique(row_of*len(vocabulary) + codes)
+    rows_of_pairs = pairs // len(vocabulary)
+    words = pairs % len(vocabulary)
+    document_frequencies = np.bincount(words, minlength=len(vocabulary))
+    weights = np.log(float(len(values))/document_frequencies[words]) + 1.0
+    norms = np.sqrt(np.bincount(rows_of_pairs, weights**2, minlength=len(values)))
+    weights /= norms[rows_of_pairs]
+    indptr = np.zeros(len(values) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows_of_pairs, minlength=len(values)), out=indptr[1:])
+    return indptr, words.astype(np.int64), weights
@@ -0,0 +1,468 @@
+"""
+Columnar, array backed storage of records. Used by Database when storage='columnar'
+Each feature is stored as a single value array, with CSR style offsets for multi-valued (semicolon separated) features.
+String features are dictionary encoded: the value array holds int32 codes into a sorted per-feature vocabulary, so each
+distinct string is stored (and hashed) once, and records built from the store share the vocabulary's string objects.
+"""
+import numpy as np
+from record import Record, split_subfeatures, convert_column, same_record_features
+__author__ = 'mbarnes1'
+
+
+_TYPE_TO_DTYPE = {
+    'int': np.int64,
+    'float': np.float64,
+    'date': np.int64,
+    'string': object,
+}
+
+
+class FeatureColumn(object):
+    """
+    All the values of a single feature, for every row in a ColumnarStore
+    The subfeatures of row i are values[offsets[i]:offsets[i+1]], or vocabulary[values[offsets[i]:offsets[i+1]]] for
+    dictionary encoded columns
+    """
+    def __init__(self, feature_type, values, offsets, vocabulary=None):
+        """
+        :param feature_type: String, the feature type (e.g. 'int', 'float', 'date', 'string')
+        :param values: 1D numpy array of all subfeature values (or int32 codes), ordered by row
+        :param offsets: 1D int64 numpy array of length number_rows + 1
+        :param vocabulary: 1D object numpy array of distinct values in ascending order, or None if values are not codes
+        """
+        self.type = feature_type
+        self.values = values
+        self.offsets = offsets
+        self.vocabulary = vocabulary
+
+    def row(self, row):
+        """
+        :param row: Int, row number (not record identifier)
+        :return values: 1D numpy array, the (decoded) subfeatures of this row
+        """
+        values = self.values[self.offsets[row]:self.offsets[row+1]]
+        if self.vocabulary is not None:
+            return self.vocabulary[values]
+        return values
+
+    def decoded(self):
+        """
+        :return values: 1D numpy array of all (decoded) subfeature values, ordered by row
+        """
+        if self.vocabulary is not None:
+            return self.vocabulary[self.values]
+        return self.values
+
+    def counts(self):
+        """
+        :return counts: 1D numpy array, the number of subfeatures in each row
+        """
+        return np.diff(self.offsets)
+
+    def take(self, rows):
+        """
+        Creates a new column from a subset of rows
+        :param rows: 1D numpy array of row numbers
+        :return column: FeatureColumn object
+        """
+        starts = self.offsets[rows]
+        counts = self.offsets[rows+1] - starts
+        offsets = np.zeros(len(rows)+1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        positions = np.repeat(starts - offsets[:-1], counts) + np.arange(offsets[-1])
+        return FeatureColumn(self.type, self.values[positions], offsets, self.vocabulary)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __eq__(self, other):
+        return self.type == other.type and np.array_equal(self.offsets, other.offsets) and \
+            np.array_equal(self.decoded(), other.decoded())
+
+
+class ColumnarStore(object):
+    """
+    Immutable column storage for a set of records, with int32 record identifiers in ascending order
+    """
+    def __init__(self, feature_descriptor, ids, columns):
+        """
+        :param feature_descriptor: FeatureDescriptor object
+        :param ids: 1D int32 numpy array of record identifiers, ascending
+        :param columns: List of FeatureColumn objects, one per feature
+        """
+        self.feature_descriptor = feature_descriptor
+        self.ids = ids
+        self.columns = columns
+
+    def row_of(self, record_id):
+        """
+        Finds the row of a record identifier
+        :param record_id: Int, the record identifier
+        :return row: Int row number, or None if record_id is not in the store
+        """
+        row = np.searchsorted(self.ids, record_id)
+        if row < len(self.ids) and self.ids[row] == record_id:
+            return int(row)
+        return None
+
+    def build_record(self, row):
+        """
+        Materializes a single row as a Record object
+        :param row: Int, row number
+        :return r: Record object
+        """
+        r = Record(int(self.ids[row]), self.feature_descriptor)
+        for feature, column in zip(r.features, self.columns):
+            feature.update(column.row(row).tolist())
+        return r
+
+    def take(self, rows):
+        """
+        Creates a new store from a subset of rows
+        :param rows: 1D numpy array of row numbers, ascending
+        :return store: ColumnarStore object
+        """
+        return ColumnarStore(self.feature_descriptor, self.ids[rows], [column.take(rows) for column in self.columns])
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def concatenate_stores(feature_descriptor, stores):
+    """
+    Concatenates stores row-wise. Record identifiers must remain ascending across stores
+    :param feature_descriptor: FeatureDescriptor object, shared by all stores
+    :param stores: List of ColumnarStore objects
+    :return store: ColumnarStore object
+    """
+    if len(stores) == 1:
+        return stores[0]
+    if not stores:
+        return ColumnarBuilder(feature_descriptor).build()
+    ids = np.concatenate([store.ids for store in stores])
+    columns = list()
+    for index, feature_type in enumerate(feature_descriptor.types):
+        parts = [store.columns[index] for store in stores]
+        bases = np.cumsum([0] + [part.offsets[-1] for part in parts[:-1]])
+        offsets = np.concatenate([[0]] + [part.offsets[1:] + base for part, base in zip(parts, bases)])
+        if parts[0].vocabulary is not None:  # merge the vocabularies, and translate the codes of each part
+            vocabulary = np.unique(np.concatenate([part.vocabulary for part in parts]))
+            values = np.concatenate([np.searchsorted(vocabulary, part.vocabulary).astype(np.int32)[part.values]
+                                     for part in parts])
+        else:
+            vocabulary = None
+            values = np.concatenate([part.values for part in parts])
+        columns.append(FeatureColumn(feature_type, values, offsets.astype(np.int64), vocabulary))
+    return ColumnarStore(feature_descriptor, ids, columns)
+
+
+def store_from_records(feature_descriptor, records):
+    """
+    Builds a ColumnarStore from unmerged records
+    :param feature_descriptor: FeatureDescriptor object
+    :param records: Dictionary-like [record id, Record object]
+    :return store: ColumnarStore object
+    """
+    builder = ColumnarBuilder(feature_descriptor)
+    for record_id, record in sorted(records.iteritems(), key=lambda item: item[0]):
+        if record.line_indices != {record_id}:
+            raise Exception('Can only store unmerged records, with record id equal to its line index')
+        builder.add_converted(record_id, record.features)
+    return builder.build()
+
+
+def build_column(feature_type, subfeatures, counts, converted=False):
+    """
+    Converts the subfeature strings of a whole feature in a single batch, and removes duplicates within each row
+    :param feature_type: String, the feature type
+    :param subfeatures: List of subfeature strings of all rows, in row order. String subfeatures must already be unique
+                        and sorted within each row
+    :param counts: List of ints, the number of subfeatures of each row
+    :param converted: Boolean, True if subfeatures are already converted to feature_type
+    :return column: FeatureColumn object
+    :return failed_rows: List of row numbers with an unparsable subfeature. Their feature is left empty
+    """
+    counts = np.array(counts, dtype=np.int64)
+    failed_rows = list()
+    if converted:
+        values = np.empty(len(subfeatures), dtype=_TYPE_TO_DTYPE.get(feature_type, object))
+        values[:] = subfeatures
+    else:
+        try:
+            values = convert_column(subfeatures, feature_type)
+        except ValueError:  # convert row by row, to find the unparsable rows
+            parts = list()
+            position = 0
+            for row, count in enumerate(counts):
+                try:
+                    parts.append(convert_column(subfeatures[position:position+count], feature_type))
+                except ValueError:
+                    failed_rows.append(row)
+                    counts[row] = 0
+                position += count
+            values = np.concatenate(parts) if parts else convert_column([], feature_type)
+    if feature_type in ('int', 'float', 'date') and len(values):  # sort and remove duplicates within each row
+        rows = np.repeat(np.arange(len(counts)), counts)
+        order = np.lexsort((values, rows))
+        values = values[order]
+        rows = rows[order]
+        keep = np.ones(len(values), dtype=bool)
+        keep[1:] = (values[1:] != values[:-1]) | (rows[1:] != rows[:-1])
+        values = values[keep]
+        counts = np.bincount(rows[keep], minlength=len(counts))
+    offsets = np.zeros(len(counts)+1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    vocabulary = None
+    if values.dtype == object:
+        values, vocabulary = encode_values(values)
+    return FeatureColumn(feature_type, values, offsets, vocabulary), failed_rows
+
+
+def encode_values(values):
+    """
+    Dictionary encodes an array of values. Codes follow the sort order of the values, so rows of unique sorted values
+    remain sorted
+    :param values: 1D object numpy array
+    :return codes: 1D int32 numpy array, such that vocabulary[codes] == values
+    :return vocabulary: 1D object numpy array of the distinct values, ascending
+    """
+    if not len(values):
+        return np.zeros(0, dtype=np.int32), np.empty(0, dtype=object)
+    vocabulary, codes = np.unique(values, return_inverse=True)
+    return codes.astype(np.int32), vocabulary
+
+
+class ColumnarBuilder(object):
+    """
+    Accumulates annotation lines, and converts them to a ColumnarStore. The subfeature strings of each feature are
+    collected while adding lines, and converted in a single batch per feature when the store is built.
+    """
+    def __init__(self, feature_descriptor):
+        """
+        :param feature_descriptor: FeatureDescriptor object
+        """
+        self._feature_descriptor = feature_descriptor
+        self._ids = list()
+        self._subfeatures = [list() for _ in range(feature_descriptor.number)]
+        self._counts = [list() for _ in range(feature_descriptor.number)]
+        self._converted = False
+        self.failed_rows = list()  # rows which could not be fully parsed, available after build()
+
+    def add(self, record_id, features):
+        """
+        Adds a single annotation line. Unparsable subfeatures are only detected in build()
+        :param record_id: Int, the record identifier. Must be larger than all previously added identifiers
+        :param features: List of strings, one per feature
+        :return success: Boolean, False if the line has the wrong number of features (all features are left empty)
+        """
+        row = len(self._ids)
+        self._ids.append(record_id)
+        if len(features) != self._feature_descriptor.number:
+            self.failed_rows.append(row)
+            for counts in self._counts:
+                counts.append(0)
+            return False
+        for feature, feature_type, converter, subfeatures, counts in zip(features, self._feature_descriptor.types,
+                                                                         self._feature_descriptor.converters,
+                                                                         self._subfeatures, self._counts):
+            split = split_subfeatures(feature) if converter else []
+            if feature_type == 'string':
+                split = sorted(set(split))
+            subfeatures.extend(split)
+            counts.append(len(split))
+        return True
+
+    def add_converted(self, record_id, features):
+        """
+        Adds a single record, whose features are already converted to their types. Can not be mixed with add()
+        :param record_id: Int, the record identifier. Must be larger than all previously added identifiers
+        :param features: List of iterables of subfeatures, one per feature
+        """
+        self._converted = True
+        self._ids.append(record_id)
+        for feature, subfeatures, counts in zip(features, self._subfeatures, self._counts):
+            subfeatures.extend(sorted(feature))
+            counts.append(len(feature))
+
+    def build(self):
+        """
+        :return store: ColumnarStore object
+        """
+        ids = np.array(self._ids, dtype=np.int32)
+        columns = list()
+        failed_rows = set(self.failed_rows)
+        for feature_type, subfeatures, counts in zip(self._feature_descriptor.types, self._subfeatures, self._counts):
+            column, failed = build_column(feature_type, subfeatures, counts, converted=self._converted)
+            columns.append(column)
+            failed_rows.update(failed)
+        self.failed_rows = sorted(failed_rows)
+        return ColumnarStore(self._feature_descriptor, ids, columns)
+
+
+class ColumnarRecords(object):
+    """
+    Dictionary-like [record id, Record object] view over a ColumnarStore, so existing code using Database.records
+    keeps working. Records are materialized when accessed, and not kept, so reading never holds the corpus as Python
+    objects. Only assigned records (records[id] = record) are kept in an overlay: to modify a record in place (e.g.
+    Record.merge), assign it back afterwards.
+    Hot paths can read the underlying arrays directly with column(), for all records where modified(id) is False.
+    """
+    def __init__(self, store):
+        """
+        :param store: ColumnarStore object
+        """
+        self.store = store
+        self._alive = np.ones(len(store), dtype=bool)
+        self._overlay = dict()  # [record id, Record object], assigned records
+        self._number_extra = 0  # records in overlay which are not alive in the store
+
+    def column(self, index):
+        """
+        :param index: Int, feature index
+        :return column: FeatureColumn of the underlying store (including removed rows, see alive_rows())
+        """
+        return self.store.columns[index]
+
+    def alive_rows(self):
+        """
+        :return rows: 1D numpy array, the store rows of records which have not been removed
+        """
+        return np.flatnonzero(self._alive)
+
+    def pristine(self):
+        """
+        :return: Boolean, True if no record was assigned, added or removed since the store was built
+        """
+        return not self._overlay and bool(self._alive.all())
+
+    def modified(self, record_id):
+        """
+        :param record_id: Int, record identifier
+        :return: Boolean, True if the record may differ from the underlying store
+        """
+        return record_id in self._overlay
+
+    def modified_keys(self):
+        """
+        :return ids: List of identifiers of records which may differ from the underlying store, or are not in it
+        """
+        return self._overlay.keys()
+
+    def extra_items(self):
+        """
+        :return items: List of (record id, Record object) for records which are not backed by the store
+        """
+        return [(record_id, record) for record_id, record in self._overlay.iteritems()
+                if self.store.row_of(record_id) is None]
+
+    def split(self, record_ids):
+        """
+        Removes records, and returns them as a new ColumnarRecords object
+        :param record_ids: Iterable of record identifiers
+        :return records: ColumnarRecords object
+        """
+        record_ids = np.asarray(record_ids, dtype=np.int64)
+        in_overlay = np.array([record_id in self._overlay for record_id in record_ids.tolist()], dtype=bool)
+        overlay = dict((record_id, self.pop(record_id)) for record_id in record_ids[in_overlay].tolist())
+        base_ids = record_ids[~in_overlay]
+        base_rows = np.searchsorted(self.store.ids, base_ids)
+        valid = base_rows < len(self.store.ids)
+        valid[valid] = self.store.ids[base_rows[valid]] == base_ids[valid]
+        valid[valid] = self._alive[base_rows[valid]]
+        if not valid.all():
+            raise KeyError(base_ids[~valid][0])
+        base_rows = np.unique(base_rows)
+        self._alive[base_rows] = False
+        records = ColumnarRecords(self.store.take(base_rows))
+        for record_id, record in overlay.iteritems():
+            records[record_id] = record
+        return records
+
+    def __getitem__(self, record_id):
+        if record_id in self._overlay:
+            return self._overlay[record_id]
+        row = self.store.row_of(record_id)
+        if row is None or not self._alive[row]:
+            raise KeyError(record_id)
+        return self.store.build_record(row)
+
+    def __setitem__(self, record_id, record):
+        if record_id not in self:
+            row = self.store.row_of(record_id)
+            if row is None:
+                self._number_extra += 1
+            else:
+                self._alive[row] = True
+        self._overlay[record_id] = record
+
+    def __delitem__(self, record_id):
+        self.pop(record_id)
+
+    def pop(self, record_id, *default):
+        if record_id not in self:
+            if default:
+                return default[0]
+            raise KeyError(record_id)
+        record = self[record_id]
+        self._overlay.pop(record_id, None)
+        row = self.store.row_of(record_id)
+        if row is None:
+            self._number_extra -= 1
+        else:
+            self._alive[row] = False
+        return record
+
+    def __contains__(self, record_id):
+        if record_id in self._overlay:
+            return True
+        row = self.store.row_of(record_id)
+        return row is not None and bool(self._alive[row])
+
+    has_key = __contains__
+
+    def __len__(self):
+        return int(np.count_nonzero(self._alive)) + self._number_extra
+
+    def iterkeys(self):
+        for record_id in self.store.ids[self._alive]:
+            yield int(record_id)
+        for record_id, _ in self.extra_items():
+            yield record_id
+
+    __iter__ = iterkeys
+
+    def iteritems(self):
+        for row in self.alive_rows():
+            record_id = int(self.store.ids[row])
+            if record_id in self._overlay:
+                yield record_id, self._overlay[record_id]
+            else:
+                yield record_id, self.store.build_record(row)
+        for item in self.extra_items():
+            yield item
+
+    def itervalues(self):
+        for _, record in self.iteritems():
+            yield record
+
+    def key_array(self):
+        """
+        :return ids: 1D numpy array of all record identifiers
+        """
+        extra = [record_id for record_id, _ in self.extra_items()]
+        return np.concatenate([self.store.ids[self._alive].astype(np.int64), np.array(extra, dtype=np.int64)])
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def values(self):
+        return list(self.itervalues())
+
+    def items(self):
+        return list(self.iteritems())
+
+    def __eq__(self, other):
+        return same_record_features(self, other)
+
+    def __ne__(self, other):
+        return not self == other
@@ -1,4 +1,11 @@
-from record import Record, FeatureDescriptor
+from record import FeatureDescriptor, format_epoch_seconds, same_record_features
+from columnar import ColumnarRecords, ColumnarBuilder, ColumnarStore, FeatureColumn, store_from_records, \
+    concatenate_stores
+from ingest import annotation_paths, read_headers, load_shards
+from snapshot import snapshot_key, save_store, load_store
+from lazy import LazyStore
+from overlay import OverlayRecords
+import os
 import numpy as np
 from numpy.random import choice
 try:
@@ -12,14 +19,18 @@ __author__ = 'mbarnes1'
 class SyntheticDatabase(object):
     """
     Create and corrupt synthetic databases
+    Features and labels are generated as numpy arrays, so databases of millions of records can be created quickly
+    (especially with storage='columnar', which never builds per-record objects)
     """
-    def __init__(self, number_entities, records_per_entity, number_features=2):
+    def __init__(self, number_entities, records_per_entity, number_features=2, storage='dict'):
         """
         Initializes synthetic database
         No initial corruption, so records from the same cluster have exact same features
         :param number_entities:
-        :param records_per_entity: Number of records per entity
+        :param records_per_entity: Number of records per entity. Either an int, or a list of the size of each entity
+                                   (e.g. from zipf_cluster_sizes for a realistic cluster size distribution)
         :param number_features:
+        :param storage: String, 'dict' or 'columnar'. See Database
         """
         indices = range(0, number_features)
         names = ['Name_{0}'.format(s) for s in indices]
@@ -31,44 +42,50 @@ class SyntheticDatabase(object):
         self.database = Database()
         feature_descriptor = FeatureDescriptor(names, types, strengths, blocking, pairwise_uses)
         self.database.feature_descriptor = feature_descriptor
-        record_index = 0
-        for entity_index in range(0, number_entities):
-            features = np.random.rand(feature_descriptor.number)
-            features = features.astype(str)
-            number_records = records_per_entity
-            for _ in range(number_records):
-                r = Record(record_index, feature_descriptor)
-                r.initialize_from_annotation(features)
-                self.database.records[record_index] = r
-                self.labels[record_index] = entity_index
-                record_index += 1
+        self._storage = storage
+        self._next_record_id = 0
+        self._next_entity_id = 0
+        if storage == 'columnar':
+            self.database.records = ColumnarRecords(ColumnarBuilder(feature_descriptor).build())
+        self.add(number_entities, records_per_entity)
 
     def add(self, number_entities, records_per_entity):
         """
         Adds additional entities to the database
         :param number_entities:
-        :param records_per_entity:
+        :param records_per_entity: Number of records per entity, int or list (see __init__)
         """
         if len(self.labels) != len(self.database.records):
             raise Exception('Number of records and labels do not match')
-        current_max_record_id = 0
-        current_max_entity_id = 0
-        for (record_id, _), (__, entity_id) in izip(self.database.records.iteritems(), self.labels.iteritems()):
-            if record_id > current_max_record_id:
-                current_max_record_id = record_id
-            if entity_id > current_max_entity_id:
-                current_max_entity_id = entity_id
-        record_index = current_max_record_id+1
-        for entity_index in range(current_max_entity_id+1, current_max_entity_id+1+number_entities):
-            features = np.random.rand(self.database.feature_descriptor.number)
-            features = features.astype(str)
-            number_records = records_per_entity
-            for _ in range(number_records):
-                r = Record(record_index, self.database.feature_descriptor)
-                r.initialize_from_annotation(features)
-                self.database.records[record_index] = r
-                self.labels[record_index] = entity_index
-                record_index += 1
+        sizes = np.empty(number_entities, dtype=np.int64)
+        sizes[:] = records_per_entity
+        number_records = int(sizes.sum())
+        ids = np.arange(self._next_record_id, self._next_record_id + number_records, dtype=np.int32)
+        entities = np.repeat(np.arange(self._next_entity_id, self._next_entity_id + number_entities), sizes)
+        features = np.repeat(np.random.rand(number_entities, self.database.feature_descriptor.number), sizes, axis=0)
+        offsets = np.arange(number_records + 1, dtype=np.int64)
+        columns = [FeatureColumn('float', feature, offsets) for feature in features.T.copy()]
+        store = ColumnarStore(self.database.feature_descriptor, ids, columns)
+        records = self.database.records
+        if isinstance(records, ColumnarRecords) and records.pristine():
+            self.database.records = ColumnarRecords(concatenate_stores(store.feature_descriptor, [records.store, store]))
+        else:
+            for row in xrange(number_records):
+                records[int(ids[row])] = store.build_record(row)
+        self.labels.update(izip(ids.tolist(), entities.tolist()))
+        self._next_record_id += number_records
+        self._next_entity_id += number_entities
+
+    def _empty_copy(self):
+        """
+        :return new_synthetic: Empty Synthetic object, which continues this object's record and entity numbering
+        """
+        new_synthetic = SyntheticDatabase(0, 0)  # empty
+        new_synthetic.database.feature_descriptor = self.database.feature_descriptor
+        new_synthetic._storage = self._storage
+        new_synthetic._next_record_id = self._next_record_id
+        new_synthetic._next_entity_id = self._next_entity_id
+        return new_synthetic
 
     def sample_and_remove(self, number_samples):
         """
@@ -76,22 +93,46 @@ class SyntheticDatabase(object):
         :param number_samples: The number of samples to take
         :return new_synthetic: New Synthetic object (includes database and labels)
         """
-        new_synthetic = SyntheticDatabase(0, 0)  # empty
+        new_synthetic = self._empty_copy()
         new_synthetic.database = self.database.sample_and_remove(number_samples)
         for key, _ in new_synthetic.database.records.iteritems():
             new_synthetic.labels[key] = self.labels.pop(key)
         return new_synthetic
 
+    def fork(self):
+        """
+        Copy-on-write copy of the database and labels, see Database.fork()
+        :return new_synthetic: New Synthetic object
+        """
+        new_synthetic = self._empty_copy()
+        new_synthetic.database = self.database.fork()
+        new_synthetic.labels = dict(self.labels)
+        return new_synthetic
+
     def corrupt(self, corruption):
         """
-        Added corruption to features
-        :param corruption: List of feature corruption vectors for each record
+        Added corruption to features, as a single array operation
+        :param corruption: List of feature corruption vectors for each record (in records.keys() order), or 2D array.
+                           Records beyond the length of corruption are not corrupted
         """
-        for corrupt, (_, record) in izip(corruption, self.database.records.iteritems()):
-            features = np.array([feature.pop() for feature in record.features])
-            features += corrupt
-            feature_set = [{feature} for feature in features]
-            record.features = feature_set
+        records = self.database.records
+        record_ids = records.keys()
+        corruption = np.asarray(corruption, dtype=np.float64)[:len(record_ids)]
+        if isinstance(records, ColumnarRecords) and records.pristine():  # keys() is in row order
+            padded = np.zeros((len(record_ids), self.database.feature_descriptor.number))
+            padded[:len(corruption)] = corruption
+            store = records.store
+            columns = [FeatureColumn(column.type, column.values + shift, column.offsets)
+                       for column, shift in izip(store.columns, padded.T)]
+            self.database.records = ColumnarRecords(ColumnarStore(store.feature_descriptor, store.ids, columns))
+            return
+        corrupted = [records[record_id] for record_id in record_ids[:len(corruption)]]  # indexing, so copy-on-write
+                                                                                        # records are copied first
+        features = np.array([[next(iter(feature)) for feature in record.features] for record in corrupted])
+        features = features.reshape(corruption.shape) + corruption
+        for record_id, record, row in izip(record_ids, corrupted, features.tolist()):
+            record.features = [{feature} for feature in row]
+            records[record_id] = record
 
     def plot(self, labels, title='Feature Distribution', color_seed=None, ax=None):
         """
@@ -134,6 +175,21 @@ class SyntheticDatabase(object):
         ax.axis([-0.2, 1.2, -0.2, 1.2])
 
 
+def zipf_cluster_sizes(number_entities, exponent=2.0, max_size=None):
+    """
+    Draws entity (cluster) sizes from a Zipf distribution: most entities have a single record, and a few are very large,
+    as in real ad data. For the records_per_entity argument of SyntheticDatabase
+    :param number_entities: Int
+    :param exponent: Float > 1, the Zipf exponent. Smaller values give larger clusters
+    :param max_size: Int, sizes are clipped to this value (None for no limit)
+    :return sizes: 1D int64 numpy array, the number of records of each entity
+    """
+    sizes = np.random.zipf(exponent, number_entities).astype(np.int64)
+    if max_size is not None:
+        np.minimum(sizes, max_size, out=sizes)
+    return sizes
+
+
 class Database(object):
     """
     A collection of record objects, using a dictionary with [index, record object]
@@ -148,60 +204,115 @@ class Database(object):
     AdM_Feature1, AdM_Feature2, ..., AdM_FeatureN
     
     where M is the number of ads and N is the number of features
+
+    Records are stored either as a dictionary of Record objects (storage='dict'), in columnar arrays
+    (storage='columnar'), or parsed on demand from the annotation file (storage='lazy'). The latter two sit behind the
+    same dictionary-like records API. See columnar.py and lazy.py
     """
-    def __init__(self, annotation_path=None, header_path=None, max_records=np.Inf, precomputed_x2=None):
+    def __init__(self, annotation_path=None, header_path=None, max_records=np.Inf, precomputed_x2=None,
+                 storage='dict', cores=1, progress=None, snapshot_dir=None):
         """
-        :param annotation_path: String, path to annotation file
+        :param annotation_path: String, path to annotation file. Can also be a list of paths or a glob pattern of several
+                                annotation files (shards) with the same header, which are loaded as one database.
+                                Record identifiers are line indices in the concatenated shards, in sorted path order
+                                for a glob pattern
         :param header_path: String, path to header info (if not included in the annotations file)
-        :param max_records: Int, number of records to load from annotation file
-        :param precomputed_x2: Precomputed weak features (smaller valued feature is better)
-                               A dict[(id1, id2)] = 1D vector, where id2 >= id1
+        :param max_records: Int, number of records to load from annotation file(s)
+        :param precomputed_x2: PairwiseFeatureStore object of precomputed weak features (smaller valued feature is
+                               better), see feature_store.py. Features of pairs which are not yet stored are computed
+                               and added to the store by get_pairwise_features
+        :param storage: String, 'dict' (a Record object per record), 'columnar' (one array per feature) or 'lazy'
+                        (records and feature columns are parsed from a memory-mapped annotation file when accessed)
+        :param cores: Int, number of processes used to parse the annotation file(s)
+        :param progress: Function handle progress(number_lines, bytes_parsed, total_bytes), called as chunks of the
+                         annotation file finish parsing
+        :param snapshot_dir: String, directory of binary snapshots. If given, the parsed database is loaded from the
+                             snapshot of the same annotation file, header file and max_records if one exists, and
+                             saved as a new snapshot otherwise
         """
+        if storage not in ('dict', 'columnar', 'lazy'):
+            raise Exception('Invalid storage type: ' + storage)
         self.records = dict()
-        if annotation_path:
-            ins = open(annotation_path, 'r')
-            if header_path:
-                header_ins = open(header_path, 'r')
-                feature_names = next(header_ins).strip('\n').split(',')  # skip the first line, its a header
-                feature_types = next(header_ins).strip('\n').split(',')  # variable type (e.g. int, string, date)
-                feature_strengths = next(header_ins).strip('\n').split(',')
-                blocking = next(header_ins).strip('\n').split(',')
-                pairwise_uses = next(header_ins).strip('\n').split(',')
-                feature_names_check = next(ins).strip('\n').split(',')
-                if feature_names != feature_names_check:
-                    raise Exception('Header feature names and annotation feature names do not match')
-                header_ins.close()
+        self._precomputed_x2 = precomputed_x2
+        if annotation_path and storage == 'lazy':
+            if len(annotation_paths(annotation_path)) != 1:
+                raise Exception('Lazy storage requires a single annotation file')
+            (annotation_path,) = annotation_paths(annotation_path)
+            store = LazyStore(annotation_path, header_path=header_path, max_records=max_records)
+            self._set_store(store, 'columnar')
+        elif annotation_path:
+            snapshot_path = None
+            if snapshot_dir:
+                snapshot_path = os.path.join(snapshot_dir, snapshot_key(annotation_path, header_path, max_records))
+            if snapshot_path and os.path.isdir(snapshot_path):
+                store = load_store(snapshot_path)
             else:
-                feature_names = next(ins).strip('\n').split(',')  # skip the first line, its a header
-                feature_types = next(ins).strip('\n').split(',')  # variable type (e.g. int, string, date)
-                feature_strengths = next(ins).strip('\n').split(',')
-                blocking = next(ins).strip('\n').split(',')
-                pairwise_uses = next(ins).strip('\n').split(',')
-            ignore_indices = find_in_list(feature_types, 'ignore')
-            feature_names = remove_indices(ignore_indices, feature_names)
-            feature_types = remove_indices(ignore_indices, feature_types)
-            feature_strengths = remove_indices(ignore_indices, feature_strengths)
-            blocking = remove_indices(ignore_indices, blocking)
-            pairwise_uses = remove_indices(ignore_indices, pairwise_uses)
-
-            self.feature_descriptor = FeatureDescriptor(feature_names, feature_types, feature_strengths, blocking,
-                                                        pairwise_uses)
-            # Loop through all the records
-            for line_index, sample in enumerate(ins):
-                print 'Extracting sample', line_index
-                r = Record(line_index, self.feature_descriptor)  # record object from utils
-                features = remove_indices(ignore_indices, sample.rstrip('\n').split(','))
-                try:
-                    r.initialize_from_annotation(features)
-                except:
-                    print 'Unable to parse:', sample
-                self.records[line_index] = r
-                if line_index >= max_records-1:
-                    break
-            ins.close()
+                paths = annotation_paths(annotation_path)
+                feature_descriptor, ignore_indices, data_starts = read_headers(paths, header_path)
+                store = load_shards(paths, feature_descriptor, ignore_indices, data_starts, max_records=max_records,
+                                    cores=cores, progress=progress)
+                if snapshot_path:
+                    save_store(store, snapshot_path)
+            self._set_store(store, storage)
         else:
             self.feature_descriptor = None
-        self._precomputed_x2 = precomputed_x2
+
+    def _set_store(self, store, storage):
+        """
+        Sets the records and feature descriptor from a ColumnarStore
+        :param store: ColumnarStore object
+        :param storage: String, 'dict' or 'columnar'
+        """
+        self.feature_descriptor = store.feature_descriptor
+        if self._precomputed_x2 is not None and \
+                self._precomputed_x2.number_features != self.feature_descriptor.number_weak:
+            raise Exception('Feature store does not match the number of weak features')
+        if storage == 'columnar':
+            self.records = ColumnarRecords(store)
+        else:
+            self.records = dict()
+            for row in xrange(len(store)):
+                self.records[int(store.ids[row])] = store.build_record(row)
+
+    def save_snapshot(self, path):
+        """
+        Saves the records to a binary snapshot directory, see snapshot.py
+        :param path: String, snapshot directory to create
+        """
+        if isinstance(self.records, ColumnarRecords) and self.records.pristine():
+            store = self.records.store
+        else:
+            store = store_from_records(self.feature_descriptor, self.records)
+        save_store(store, path)
+
+    @staticmethod
+    def load_snapshot(path, storage='columnar', precomputed_x2=None):
+        """
+        Loads a database from a binary snapshot directory. Numeric arrays are memory-mapped
+        :param path: String, snapshot directory
+        :param storage: String, 'dict' or 'columnar'
+        :param precomputed_x2: Precomputed weak features, see Database.__init__
+        :return database: Database object
+        """
+        database = Database(precomputed_x2=precomputed_x2)
+        database._set_store(load_store(path), storage)
+        return database
+
+    def fork(self):
+        """
+        Copy-on-write copy of the database, a cheap alternative to deepcopy. The current records become a shared base of
+        both databases, and later merges, removals and additions are only recorded in the database that makes them.
+        :return new_database: Database object
+        """
+        new_database = Database(precomputed_x2=self._precomputed_x2)
+        new_database.feature_descriptor = self.feature_descriptor
+        if isinstance(self.records, OverlayRecords):  # fork onto the same root base, instead of nesting views
+            new_database.records = self.records.fork()
+        else:
+            base = self.records
+            self.records = OverlayRecords(base)
+            new_database.records = OverlayRecords(base)
+        return new_database
 
     def sample_and_remove(self, number_samples):
         """
@@ -209,11 +320,17 @@ class Database(object):
         :param number_samples: The number of samples to take
         :return new_database: Database created from samples
         """
-        line_indices = choice(self.records.keys(), size=number_samples, replace=False)
+        if isinstance(self.records, ColumnarRecords):
+            line_indices = choice(self.records.key_array(), size=number_samples, replace=False)
+        else:
+            line_indices = choice(self.records.keys(), size=number_samples, replace=False)
         new_database = Database()
         new_database.feature_descriptor = self.feature_descriptor
-        for line_index in line_indices:
-            new_database.records[line_index] = self.records.pop(line_index)
+        if isinstance(self.records, ColumnarRecords):
+            new_database.records = self.records.split(line_indices)
+        else:
+            for line_index in line_indices:
+                new_database.records[line_index] = self.records.pop(line_index)
         return new_database
 
     def merge(self, labels):
@@ -229,11 +346,15 @@ class Database(object):
                 cluster_to_records[cluster_id] = [record_id]
         for _, record_ids in cluster_to_records.iteritems():
             merged_record = None
+            merged_id = None
             for record_id in record_ids:
                 if record_id in self.records and merged_record is None:
                     merged_record = self.records[record_id]
+                    merged_id = record_id
                 elif record_id in self.records:
                     merged_record.merge(self.records.pop(record_id))
+            if merged_record is not None:
+                self.records[merged_id] = merged_record  # assigned, so columnar and forked records keep the merge
 
     def dump(self, out_file):
         """
@@ -252,7 +373,9 @@ class Database(object):
         ins_header.close()
         for counter, (_, r) in enumerate(self.records.iteritems()):
             feature_list = list()
-            for subfeatures in r.features:
+            for subfeatures, feature_type in izip(r.features, self.feature_descriptor.types):
+                if feature_type == 'date':
+                    subfeatures = [format_epoch_seconds(subfeature) for subfeature in subfeatures]
                 feature_list.append(';'.join(map(str, subfeatures)))
             ins.write(','.join(feature_list))
             if counter < len(self.records):  # no line break on final line
@@ -260,25 +383,8 @@ class Database(object):
         ins.close()
 
     def __eq__(self, other):
-        return self.__dict__ == other.__dict__
-
+        return self.feature_descriptor == other.feature_descriptor and \
+            same_record_features(self.records, other.records)
 
-def remove_indices(remove, lst):
-    """
-    Removes indices from a list
-    :param remove: A list of indices to remove from lst
-    :param lst: List to remove entries from
-    :return new_lst: A new list with entries from lst removed
-    """
-    new_lst = [item for i, item in enumerate(lst) if i not in remove]
-    return new_lst
-
-
-def find_in_list(lst, field):
-    """
-    Finds all occurences of field in list and returns their indicies
-    :param field: The entry to find in list
-    :param lst: List to search
-    :return i: Indices of entries in lst
-    """
-    return [i for i, x in enumerate(lst) if x == field]
+    def __ne__(self, other):
+        return not self == other
@@ -5,7 +5,7 @@ Satisfies ICAR properties
 from sklearn import tree
 import numpy as np
 from roc import RocCurve
-from pairwise_features import get_weak_pairwise_features, get_pairwise_features, generate_pair_seed
+from pairwise_features import get_match_features, get_pairwise_features, generate_pair_seed
 __author__ = 'mbarnes1'
 
 
@@ -97,18 +97,19 @@ class TreeMatchFunction(object):
             database_test.records[pair[1]].display(indent='     ')
         return roc
 
-    def match(self, r1, r2):
+    def match(self, r1, r2, precomputed_x2=None):
         """
         Determines if two records match
         :param r1: Record object
         :param r2: Record object
+        :param precomputed_x2: PairwiseFeatureStore object of precomputed weak features, or None
         :return: False or True, whether r1 and r2 match
         :return p_x1: Probability of weak match
         """
         # x1 = get_x1(r1, r2)
         # if np.isnan(x1):
         #     x1 = False
-        x2 = get_weak_pairwise_features(r1, r2)
+        x2 = get_match_features([r1], [r2], precomputed_x2)[0]
         np.copyto(x2, self._x_mean, where=np.isnan(x2))  # mean imputation
         p_x1 = self._classifier.predict_proba(x2)[0, 1]
         x1_hat = p_x1 > self._decision_threshold
@@ -0,0 +1,193 @@
+"""
+Learned blocking scheme in disjunctive normal form (Bilenko et al. 2006, Michelson & Knoblock 2006)
+A predicate is a (feature index, directive) pair, e.g. (4, 'soundex'), and holds for two records sharing a key of the
+directive on that feature (see blocking_keys.py). A conjunction of predicates holds if all of them hold, and blocks
+records by the combinations of their keys. A DNF blocking scheme is a list of conjunctions, any of which makes a pair
+of records a candidate. The learner greedily adds the conjunction covering the most uncovered matching pairs of a pair
+seed per candidate comparison, until the comparison budget is spent. Use the learned rules with BlockingScheme(dnf=...)
+"""
+import numpy as np
+from itertools import izip
+from inverted_index import InvertedIndex, build_inverted_index
+__author__ = 'mbarnes1'
+
+
+CANDIDATE_DIRECTIVES = {
+    'string': ('block', 'normalize', 'token', 'prefix:3', 'soundex', 'metaphone', 'digits'),
+    'int': ('block',),
+    'float': ('block',),
+    'date': ('block',),
+}
+
+
+def candidate_predicates(feature_descriptor):
+    """
+    :param feature_descriptor: FeatureDescriptor object
+    :return predicates: List of (feature index, directive) of the strong and weak features, see CANDIDATE_DIRECTIVES
+    """
+    predicates = list()
+    for index, (strength, feature_type) in enumerate(izip(feature_descriptor.strengths, feature_descriptor.types)):
+        if strength in ('strong', 'weak'):
+            for directive in CANDIDATE_DIRECTIVES.get(feature_type, ()):
+                predicates.append((index, directive))
+    return predicates
+
+
+def predicate_index(records, predicates, cores=1):
+    """
+    Indexes records by the keys of every predicate. Keys are labeled by their directive, so each predicate has its own
+    keys (unlike 'block;block+1' header cells, whose keys are shared)
+    :param records: Dictionary-like [record id, Record object], e.g. Database.records
+    :param predicates: List of (feature index, directive)
+    :param cores: Int, number of processes
+    :return index: InvertedIndex object, with keys (feature index, directive, key)
+    :return key_predicates: 1D int numpy array, the position (into predicates) of the predicate of each key
+    """
+    index = build_inverted_index(records, [(feature, directive, directive) for feature, directive in predicates],
+                                 cores=cores)
+    codes = dict((predicate, code) for code, predicate in enumerate(predicates))
+    key_predicates = np.array([codes[(feature, directive)] for feature, directive, _ in index.keys], dtype=int)
+    return index, key_predicates
+
+
+def conjunction_index(index, key_predicates, conjunction):
+    """
+    Blocks of a conjunction of predicates, records sharing a key of every predicate
+    :param index: InvertedIndex object, see predicate_index
+    :param key_predicates: 1D int numpy array, the predicate of each key of index
+    :param conjunction: List of predicate positions
+    :return index: InvertedIndex object, whose keys are tuples of key codes of index (one per predicate)
+    """
+    records, codes = _predicate_entries(index, key_predicates, conjunction[0])
+    distinct, codes = np.unique(codes, return_inverse=True)
+    keys = [(k,) for k in distinct.tolist()]
+    for predicate in conjunction[1:]:
+        other_records, other_codes = _predicate_entries(index, key_predicates, predicate)
+        records, combined = _join(records, codes, other_records, other_codes, len(index))
+        distinct, codes = np.unique(combined, return_inverse=True)
+        keys = [keys[c // len(index)] + (c % len(index),) for c in distinct.tolist()]
+    return InvertedIndex.from_pairs(keys, codes, records)
+
+
+def _predicate_entries(index, key_predicates, predicate):
+    """
+    :param index: InvertedIndex object
+    :param key_predicates: 1D int numpy array, the predicate of each key of index
+    :param predicate: Int, predicate position
+    :return records: 1D int64 numpy array, the record identifier of each (record, key) entry of the predicate, ascending
+    :return codes: 1D int64 numpy array, the key code of each entry
+    """
+    mask = np.repeat(key_predicates == predicate, index.sizes())
+    codes = np.repeat(np.arange(len(index), dtype=np.int64), index.sizes())[mask]
+    records = index.record_ids[mask]
+    order = np.lexsort((codes, records))
+    return records[order], codes[order]
+
+
+def _join(records_a, codes_a, records_b, codes_b, number_b):
+    """
+    Joins two tables of (record, key) entries on the record, combining the keys of every pair of entries
+    :param records_a: 1D int numpy array, ascending
+    :param codes_a: 1D int numpy array
+    :param records_b: 1D int numpy array, ascending
+    :param codes_b: 1D int numpy array, values less than number_b
+    :param number_b: Int
+    :return records: 1D int64 numpy array, ascending
+    :return codes: 1D int64 numpy array, combined keys code_a*number_b + code_b
+    """
+    shared = np.intersect1d(records_a, records_b)
+    starts_a = np.searchsorted(records_a, shared, side='left')
+    counts_a = np.searchsorted(records_a, shared, side='right') - starts_a
+    starts_b = np.searchsorted(records_b, shared, side='left')
+    counts_b = np.searchsorted(records_b, shared, side='right') - starts_b
+    counts = counts_a*counts_b
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    repeated_b = np.repeat(counts_b, counts)
+    entries_a = np.repeat(starts_a, counts) + offsets // repeated_b
+    entries_b = np.repeat(starts_b, counts) + offsets % repeated_b
+    return np.repeat(shared, counts).astype(np.int64), codes_a[entries_a].astype(np.int64)*number_b + codes_b[entries_b]
+
+
+def covered_pairs(index, first, second):
+    """
+    :param index: InvertedIndex object
+    :param first: 1D int numpy array, record identifier of the first record of each pair
+    :param second: 1D int numpy array, record identifier of the second record of each pair
+    :return covered: 1D boolean numpy array, whether each pair of records shares a key of index
+    """
+    entry_keys = np.repeat(np.arange(len(index), dtype=np.int64), index.sizes())
+    order = np.argsort(index.record_ids, kind='mergesort')  # transposed index, record id -> key codes
+    records = index.record_ids[order]
+    keys = entry_keys[order]
+    starts = np.searchsorted(records, first, side='left')
+    lengths = np.searchsorted(records, first, side='right') - starts
+    pairs = np.repeat(np.arange(len(first)), lengths)
+    entries = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+    modulus = int(max(records.max() if len(records) else 0, second.max() if len(second) else 0)) + 1
+    hits = np.in1d(keys[entries]*modulus + second[pairs], entry_keys*modulus + index.record_ids)
+    covered = np.zeros(len(first), dtype=bool)
+    covered[pairs[hits]] = True
+    return covered
+
+
+def comparisons(index):
+    """
+    :param index: InvertedIndex object
+    :return comparisons: Int, the number of candidate comparisons of its blocks, sum n*(n-1)/2
+    """
+    sizes = index.sizes()
+    return int(np.sum(sizes*(sizes - 1)//2))
+
+
+def learn_dnf_blocking(database, labels, pair_seed, budget, max_conjuncts=2, beam=10, cores=1):
+    """
+    Greedily learns a DNF blocking scheme with the highest pair completeness of the matching pairs of the seed, under a
+    comparison budget
+    :param database: Database object, the training records
+    :param labels: Cluster labels of database. Dictionary [identifier, cluster label]
+    :param pair_seed: List of pairs (identifierA, identifierB), e.g. from pairwise_features.generate_pair_seed
+    :param budget: Int, maximum number of candidate comparisons of the rules on database
+    :param max_conjuncts: Int, maximum number of predicates per conjunction
+    :param beam: Int, number of the best conjunctions of each length extended with another predicate
+    :param cores: Int, number of processes used to build the inverted index
+    :return rules: List of conjunctions, each a tuple of (feature index, directive) predicates
+    """
+    print 'Learning DNF blocking scheme with a budget of', budget, 'comparisons'
+    predicates = candidate_predicates(database.feature_descriptor)
+    index, key_predicates = predicate_index(database.records, predicates, cores)
+    positives = [(a, b) for a, b in pair_seed if labels[a] == labels[b]]
+    if not positives:
+        raise Exception('No positive matches in pair seed')
+    first = np.array([a for a, _ in positives], dtype=np.int64)
+    second = np.array([b for _, b in positives], dtype=np.int64)
+
+    candidates = dict()  # [conjunction of predicate positions, (covered positives, comparisons)]
+    level = [(p,) for p in range(len(predicates))]
+    for length in range(1, max_conjuncts + 1):
+        for conjunction in level:
+            conjunction_blocks = conjunction_index(index, key_predicates, conjunction)
+            candidates[conjunction] = (covered_pairs(conjunction_blocks, first, second),
+                                       comparisons(conjunction_blocks))
+        best = sorted(level, key=lambda c: -np.count_nonzero(candidates[c][0]))[:beam]
+        level = [conjunction + (p,) for conjunction in best for p in range(conjunction[-1] + 1, len(predicates))
+                 if predicates[p][0] not in [predicates[q][0] for q in conjunction]]
+
+    rules = list()
+    covered = np.zeros(len(first), dtype=bool)
+    spent = 0
+    while True:
+        best = None
+        best_score = 0.0
+        for conjunction, (conjunction_covered, cost) in candidates.iteritems():
+            gain = np.count_nonzero(conjunction_covered & ~covered)
+            if gain and spent + cost <= budget and float(gain)/max(cost, 1) > best_score:
+                best = conjunction
+                best_score = float(gain)/max(cost, 1)
+        if best is None:
+            break
+        rules.append(tuple(predicates[p] for p in best))
+        covered |= candidates[best][0]
+        spent += candidates[best][1]
+        print '     Rule', rules[-1], 'pair completeness:', float(np.count_nonzero(covered))/len(covered), \
+            'comparisons:', spent
+    return [rule for rule in rules if not any(set(other) < set(rule) for other in rules)]  # remove subsumed rules
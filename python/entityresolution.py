@@ -7,8 +7,7 @@ import traceback
 import os
 from itertools import combinations_with_replacement, izip
 import networkx
-from copy import deepcopy, copy
-import sys
+import numpy as np
 __author__ = 'mbarnes1'
 
 
@@ -25,11 +24,11 @@ class EntityResolution(object):
         def __init__(self, pipeline, jobqueue, resultsqueue):
             """
             :param pipeline: Pipeline object that created this worker
-            :param jobqueue: Multiprocessing.Queue() of blocks of records to Swoosh
+            :param jobqueue: Multiprocessing.Queue() of (block number, block of records) to Swoosh
             :param resultsqueue: Multiprocessing.Queue() of tuples.
                                  tuple[0] = Swoosh results, as set of records
-                                 tuple[1] = Decision probabilities, as list of floats in [0, 1]
-                                 tuple[2] = Decision type, as list of strings 'strong', 'weak', 'both', or 'none'
+                                 tuple[1] = Features of the pairs of ads missing from the store of precomputed
+                                            features, as (first, second, features) arrays, or None without a store
             """
             super(EntityResolution.Worker, self).__init__()
             self.jobqueue = jobqueue
@@ -44,17 +43,23 @@ class EntityResolution(object):
 
         def run_subfunction(self):
             print 'Worker started'
-            for block in iter(self.jobqueue.get, None):
-                swooshed = self._pipeline.rswoosh(block)
-                self.resultsqueue.put(swooshed)
+            precomputed_x2 = self._pipeline._precomputed_x2
+            if precomputed_x2 is not None:
+                precomputed_x2.defer()  # the store files are shared, the parent adds the computed pairs
+            for block_number, block in iter(self.jobqueue.get, None):
+                swooshed = self._pipeline.rswoosh(block, block_number)
+                computed = precomputed_x2.take_deferred() if precomputed_x2 is not None else None
+                self.resultsqueue.put((swooshed, computed))
             print 'Worker exiting'
 
     def __init__(self):
+        self._precomputed_x2 = None  # PairwiseFeatureStore object of the database being resolved, see run()
         print 'Entity resolution initialized'
 
     def run(self, database_test, match_function, blocking_scheme, cores=1):
         """
         This function performs Entity Resolution on all the blocks and merges results to output entities
+        A pair of records sharing several blocks is only compared in the first block they share (see _first_block)
         :param database_test: Database object to run on. Will modify in place.
         :param match_function: Handle to surrogate match function object. Must have field decision_threshold and
                                function match(r1, r2, match_type)
@@ -65,6 +70,9 @@ class EntityResolution(object):
         if match_function.ICAR is False:
             raise Exception('Match function must satsify ICAR properties for R-Swoosh')
         self._match_function = match_function
+        self._precomputed_x2 = database_test._precomputed_x2  # match-time features are read from the store
+        blocks = blocking_scheme.blocks()
+        self._record_blocks = record_to_blocks(blocks)  # before starting workers, so they share it
         # Multiprocessing code
         if cores > 1:  # large job, use memory bufffer
             this_path = os.path.dirname(os.path.realpath(__file__))
@@ -86,28 +94,28 @@ class EntityResolution(object):
         records = database_test.records
 
         # Create block jobs for workers
-        for blockname, indices in blocking_scheme.strong_blocks.iteritems():
+        for block_number, indices in enumerate(blocks):
             index_block = set()
             for identifier in indices:
                 index_block.add(records[identifier])
-            job_queue.put(index_block)
-        for blockname, indices in blocking_scheme.weak_blocks.iteritems():
-            index_block = set()
-            for identifier in indices:
-                index_block.add(records[identifier])
-            job_queue.put(index_block)
+            job_queue.put((block_number, index_block))
         for _ in workerpool:
             job_queue.put(None)  # Sentinel objects to allow clean shutdown: 1 per worker.
 
         # Capture the results
         results_list = list()
+        computed_list = list()
         while len(results_list) < blocking_scheme.number_of_blocks():
-            results = results_queue.get()
+            results, computed = results_queue.get()
             results_list.append(results)
+            if computed is not None:
+                computed_list.append(computed)
             print 'Finished', len(results_list), 'of', blocking_scheme.number_of_blocks()
         print 'Joining workers'
         for worker in workerpool:
             worker.join()
+        if computed_list:  # match-time features computed by the workers, added in one batch
+            self._precomputed_x2.add(*[np.concatenate(columns) for columns in zip(*computed_list)])
 
         # Convert list of sets to dictionary for final merge
         print 'Converting to dictionary'
@@ -159,11 +167,13 @@ class EntityResolution(object):
         print 'entities merged.'
         return identifier_to_cluster
 
-    def rswoosh(self, I):
+    def rswoosh(self, I, block_number=None):
         """
         RSwoosh - Benjelloun et al. 2009
         Performs entity resolution on any set of records using merge and match functions
         :param I: Set of input records
+        :param block_number: Int, position of this block in BlockingScheme.blocks(). If given, pairs of records whose
+                             first common block is another block are not compared here
         :return Inew: Set of resolved entities (records)
         """
         Inew = set()  # initialize the resolved entities
@@ -171,7 +181,9 @@ class EntityResolution(object):
             currentrecord = I.pop()  # an arbitrary record
             buddy = False
             for rnew in Inew:  # iterate over Inew
-                match, prob = self._match_function.match(currentrecord, rnew)
+                if block_number is not None and not self._first_block(currentrecord, rnew, block_number):
+                    continue  # compared in an earlier block
+                match, prob = self._match_function.match(currentrecord, rnew, self._precomputed_x2)
                 if match:
                     buddy = rnew
                     break  # Found a match!
@@ -188,6 +200,43 @@ class EntityResolution(object):
                 Inew.add(currentrecord)
         return Inew
 
+    def _first_block(self, r1, r2, block_number):
+        """
+        Least common block condition. Merged records are compared if any pair of their record identifiers is first
+        shared in this block
+        :param r1: Record object
+        :param r2: Record object
+        :param block_number: Int, position of the current block in BlockingScheme.blocks()
+        :return: Boolean, True if r1 and r2 should be compared in this block
+        """
+        for i in r1.line_indices:
+            blocks_i = self._record_blocks.get(i)
+            if blocks_i is None:
+                continue
+            for j in r2.line_indices:
+                blocks_j = self._record_blocks.get(j)
+                if blocks_j is None:
+                    continue
+                common = blocks_i & blocks_j
+                if common and min(common) == block_number:
+                    return True
+        return False
+
+
+def record_to_blocks(blocks):
+    """
+    :param blocks: List of sets of record identifiers
+    :return record_blocks: Dictionary [record id, set of the positions (into blocks) of its blocks]
+    """
+    record_blocks = dict()
+    for block_number, record_ids in enumerate(blocks):
+        for record_id in record_ids:
+            if record_id in record_blocks:
+                record_blocks[record_id].add(block_number)
+            else:
+                record_blocks[record_id] = {block_number}
+    return record_blocks
+
 
 def merge_duped_records(tomerge):
     """
@@ -339,49 +388,41 @@ def faster_strong_cluster(database):
 def weak_connected_components(database, match_function, blocking_scheme):
     """
     Match and merge function operating on sets of records is equivalent to connected components.
-    Direct implementation of this graphical approach.
+    Direct implementation of this graphical approach. Each distinct candidate pair of the blocking scheme is scored at
+    most once, no matter how many blocks the records share
     :param database: Database object to run ER on
     :param match_function: The trained match function
     :param blocking_scheme: BlockingScheme object
     :return identifier_to_cluster: Predicted labels, of dictionary form [record id, cluster label]:
     """
     print 'Finding weakly connected components.'
-    print 'Building dual hash tables (forward) ...'
-    block_to_records = deepcopy(blocking_scheme.weak_blocks)
-    block_to_records.update(blocking_scheme.strong_blocks)
-    record_to_blocks = dict()
-    for i, (block, record_ids) in enumerate(block_to_records.iteritems()):
-        sys.stdout.write("\rBuilding dual hash tables (reverse), %i" % i)
-        sys.stdout.flush()
-        for idx in record_ids:
-            if idx in record_to_blocks:
-                record_to_blocks[idx].add(block)
-            else:
-                record_to_blocks[idx] = {block}
-    print(' ')
+    print 'Building candidate pair graph ...'
+    nodes = np.unique(np.concatenate([np.fromiter(ads, dtype=np.int64, count=len(ads))
+                                      for ads in blocking_scheme.blocks()] + [np.zeros(0, dtype=np.int64)]))
+    indptr, neighbors = candidate_graph(nodes, blocking_scheme.candidate_pairs())
+    explored = np.zeros(len(nodes), dtype=bool)
 
     connected_components = list()
-    while record_to_blocks:
-        central_node, blocks = record_to_blocks.popitem()
-        print 'Starting new exploration at record', central_node, '. ', len(record_to_blocks), ' records remain'
-        record_to_blocks[central_node] = blocks
+    for central_node in xrange(len(nodes)):
+        if explored[central_node]:
+            continue
+        print 'Starting new exploration at record', nodes[central_node], '. ', len(nodes) - explored.sum(), \
+            ' records remain'
         component = set()
         to_explore = {central_node}
         while to_explore:
             current_node = to_explore.pop()
-            print '     Exploring node', current_node
-            r1 = database.records[current_node]
-            record_pairs = set()
-            for block in record_to_blocks[current_node]:
-                for idx in block_to_records[block].difference(to_explore | {current_node}):
-                    r2 = database.records[idx]
-                    record_pairs.add((r1, r2, idx))
-            record_pairs = list(record_pairs)
-            matches, _ = match_function.batch_match(record_pairs)
+            print '     Exploring node', nodes[current_node]
+            r1 = database.records[nodes[current_node]]
+            record_pairs = list()
+            for idx in neighbors[indptr[current_node]:indptr[current_node+1]].tolist():
+                if not explored[idx] and idx not in to_explore:
+                    record_pairs.append((r1, database.records[nodes[idx]], idx))
+            matches, _ = match_function.batch_match(record_pairs, database._precomputed_x2)
             idx = [idx[2] for match, idx in izip(matches, record_pairs) if match]
             to_explore.update(set(idx))
-            remove_node(current_node, record_to_blocks, block_to_records)
-            component.add(current_node)
+            explored[current_node] = True
+            component.add(int(nodes[current_node]))
         connected_components.append(component)
 
     record_to_cluster = dict()
@@ -393,7 +434,19 @@ def weak_connected_components(database, match_function, blocking_scheme):
     return record_to_cluster
 
 
-def remove_node(node, record_to_blocks, block_to_records):
-    blocks = record_to_blocks.pop(node)
-    for block in blocks:
-        block_to_records[block].remove(node)
+def candidate_graph(nodes, pairs):
+    """
+    Adjacency lists of the candidate pair graph, in CSR form
+    :param nodes: 1D int64 numpy array of record identifiers, ascending
+    :param pairs: 2D int numpy array of shape (number of pairs, 2), record identifiers of each candidate pair
+    :return indptr: 1D int64 numpy array of length len(nodes) + 1
+    :return neighbors: 1D int64 numpy array, the neighbors of node position p are neighbors[indptr[p]:indptr[p+1]],
+                       as positions into nodes
+    """
+    positions = np.searchsorted(nodes, pairs)
+    sources = np.concatenate([positions[:, 0], positions[:, 1]])
+    targets = np.concatenate([positions[:, 1], positions[:, 0]])
+    order = np.lexsort((targets, sources))
+    indptr = np.zeros(len(nodes) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=len(nodes)), out=indptr[1:])
+    return indptr, targets[order].astype(np.int64)
@@ -1,6 +1,5 @@
 __author__ = 'mbarnes1'
 from database import Database, SyntheticDatabase
-from copy import deepcopy
 from entityresolution import EntityResolution, weak_connected_components, fast_strong_cluster
 from pairwise_features import generate_pair_seed
 from logistic_match import LogisticMatchFunction
@@ -304,14 +303,14 @@ def synthetic_sizes():
 
     databases = list()
     db = SyntheticDatabase(number_entities[0], records_per_entity, number_features=number_features)
-    databases.append(deepcopy(db))
+    databases.append(db.fork())
     add_entities = [x - number_entities[i - 1] for i, x in enumerate(number_entities)][1:]
     for add in add_entities:
         db.add(add, records_per_entity)
-        databases.append(deepcopy(db))
+        databases.append(db.fork())
     corruption = np.random.normal(loc=0.0, scale=1.0, size=[number_entities[-1]*records_per_entity, number_features])
-    train = deepcopy(databases[0])
-    validation = deepcopy(databases[0])
+    train = databases[0].fork()
+    validation = databases[0].fork()
     train.corrupt(corruption_multiplier*np.random.normal(loc=0.0, scale=1.0, size=[len(train.database.records), number_features]))
     validation.corrupt(corruption_multiplier*np.random.normal(loc=0.0, scale=1.0, size=[len(train.database.records), number_features]))
     for db in databases:
@@ -331,7 +330,7 @@ def synthetic_sizes():
     pairwise_f1 = list()
     for threshold in thresholds:
         weak_match_function.set_decision_threshold(threshold)
-        labels_pred = er.run(deepcopy(databases[0].database), weak_match_function, single_block=True,
+        labels_pred = er.run(databases[0].database.fork(), weak_match_function, single_block=True,
                              max_block_size=np.Inf, cores=1)
         met = Metrics(databases[0].labels, labels_pred)
         metrics_list.append(met)
@@ -364,7 +363,7 @@ def synthetic_sizes():
     f1_lower_bound = list()
     for threshold in thresholds_largedataset:
         weak_match_function.set_decision_threshold(threshold)
-        labels_pred = er.run(deepcopy(databases[-1].database), weak_match_function, single_block=True,
+        labels_pred = er.run(databases[-1].database.fork(), weak_match_function, single_block=True,
                              max_block_size=np.Inf, cores=1)
         met = Metrics(databases[-1].labels, labels_pred)
         metrics_list.append(met)
@@ -521,9 +520,9 @@ def experiment_wrapper(dataset_name):
         #     else:
         #         raise Exception('Record identifier ' + str(identifier) + ' not in either database')
         ###
-        database_train = Database('../data/trafficking/cluster_subsample0_10000.csv', header_path='../data/trafficking/cluster_subsample_header_LM.csv', max_records=5000)
-        database_validation = Database('../data/trafficking/cluster_subsample1_10000.csv', header_path='../data/trafficking/cluster_subsample_header_LM.csv', max_records=5000)
-        database_test = Database('../data/trafficking/cluster_subsample2_10000.csv', header_path='../data/trafficking/cluster_subsample_header_LM.csv', max_records=1000)
+        database_train = Database('../data/trafficking/cluster_subsample0_10000.csv', header_path='../data/trafficking/cluster_subsample_header_LM.csv', max_records=5000, snapshot_dir='../data/trafficking/snapshots')
+        database_validation = Database('../data/trafficking/cluster_subsample1_10000.csv', header_path='../data/trafficking/cluster_subsample_header_LM.csv', max_records=5000, snapshot_dir='../data/trafficking/snapshots')
+        database_test = Database('../data/trafficking/cluster_subsample2_10000.csv', header_path='../data/trafficking/cluster_subsample_header_LM.csv', max_records=1000, snapshot_dir='../data/trafficking/snapshots')
 
         labels_train = fast_strong_cluster(database_train)
         labels_validation = fast_strong_cluster(database_validation)
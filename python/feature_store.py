@@ -0,0 +1,249 @@
+"""
+Persistent store of weak pairwise features, so repeat runs and threshold sweeps never recompute a pair of ads.
+Used by Database(precomputed_x2=...): pairwise_features.get_pairwise_features and the match functions of
+EntityResolution (pairwise_features.get_match_features) read their features from the store and add the pairs they
+compute
+A store is a directory of two append-only binary files, which are memory-mapped for lookups, and their description:
+    keys.bin        int64 pair keys, id1*2**32 + id2 with id1 <= id2 (ad line indices)
+    features.bin    float32 weak feature vector of each pair, row-major (number of pairs x number of weak features)
+    metadata.csv    Store version, number of weak features and dataset key (e.g. snapshot.snapshot_key of the annotation
+                    file), checked whenever the store is opened, as line indices only identify ads within one dataset
+New pairs are appended as their features are computed. Feature rows are written before their keys, so a partially
+written pair is never looked up. Features of merged records are the minimum over the pairs of their ads (ICAR).
+"""
+import os
+import numpy as np
+__author__ = 'mbarnes1'
+
+STORE_VERSION = '1'
+SIDE_INDEX_SIZE = 4096  # minimum number of added pairs held in the side index before it is merged
+
+
+def pair_keys(first, second):
+    """
+    :param first: 1D int numpy array, line index of the first ad of each pair
+    :param second: 1D int numpy array, line index of the second ad of each pair
+    :return keys: 1D int64 numpy array, the order-independent key of each pair
+    """
+    first = np.asarray(first, dtype=np.int64)
+    second = np.asarray(second, dtype=np.int64)
+    return (np.minimum(first, second) << 32) | np.maximum(first, second)
+
+
+def _search(sorted_keys, keys):
+    """
+    :param sorted_keys: 1D int64 numpy array, sorted index keys
+    :param keys: 1D int64 numpy array, keys to search for
+    :return positions: 1D int numpy array, insertion position of each key in sorted_keys
+    :return found: 1D boolean numpy array, whether each key is in sorted_keys
+    """
+    positions = np.searchsorted(sorted_keys, keys)
+    found = positions < len(sorted_keys)
+    found[found] = sorted_keys[positions[found]] == keys[found]
+    return positions, found
+
+
+class PairwiseFeatureStore(object):
+    def __init__(self, path, number_features, key=''):
+        """
+        Opens the store at path, creating an empty one if it does not exist
+        :param path: String, store directory
+        :param number_features: Int, number of weak features of each pair
+        :param key: String, identifies the dataset whose ads are stored, e.g. snapshot.snapshot_key(annotation_path).
+                    Opening the store with a different key (or number of features) raises an exception
+        """
+        self.path = path
+        self.number_features = number_features
+        self.key = key
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self._keys_path = os.path.join(path, 'keys.bin')
+        self._features_path = os.path.join(path, 'features.bin')
+        self._check_metadata(os.path.join(path, 'metadata.csv'))
+        for file_path in (self._keys_path, self._features_path):
+            if not os.path.exists(file_path):
+                open(file_path, 'wb').close()
+        self._deferred = None
+        self._load()
+
+    def _check_metadata(self, metadata_path):
+        """
+        Writes the metadata of a new store, or checks that an existing store matches this one
+        :param metadata_path: String, path to the metadata file
+        """
+        metadata = [STORE_VERSION, str(self.number_features), self.key]
+        if os.path.exists(metadata_path):
+            ins = open(metadata_path, 'r')
+            stored = ins.readline().rstrip('\n').split(',', 2)
+            ins.close()
+            for name, value, stored_value in zip(['Version', 'Number of features', 'Dataset key'], metadata, stored):
+                if value != stored_value:
+                    raise Exception(name + ' ' + value + ' does not match the feature store at ' + self.path + ' (' +
+                                    stored_value + ')')
+        elif os.path.exists(self._keys_path) and os.path.getsize(self._keys_path):
+            raise Exception('Feature store at ' + self.path + ' has no metadata')
+        else:
+            outs = open(metadata_path, 'w')
+            outs.write(','.join(metadata) + '\n')
+            outs.close()
+
+    def _load(self):
+        """
+        Memory-maps the stored pairs and builds the sorted key index
+        """
+        number_pairs = min(os.path.getsize(self._keys_path)//8,
+                           os.path.getsize(self._features_path)//(4*max(self.number_features, 1)))
+        if number_pairs:
+            keys = np.memmap(self._keys_path, dtype=np.int64, mode='r', shape=(number_pairs,))
+        else:
+            keys = np.zeros(0, dtype=np.int64)
+        self._order = np.argsort(keys, kind='mergesort')
+        self._sorted_keys = np.asarray(keys[self._order])
+        self._map_features(number_pairs)
+        self._clear_side()
+
+    def _map_features(self, number_pairs):
+        """
+        Memory-maps the features of the first number_pairs stored pairs. Only maps the file, nothing is read
+        :param number_pairs: Int, number of stored pairs
+        """
+        if number_pairs:
+            self._features = np.memmap(self._features_path, dtype=np.float32, mode='r',
+                                       shape=(number_pairs, self.number_features))
+        else:
+            self._features = np.zeros((0, self.number_features), dtype=np.float32)
+
+    def _clear_side(self):
+        """
+        Empties the side index, which holds the pairs added since the key index was last merged. Its features are kept
+        in memory, in the order they were appended to the features file
+        """
+        self._side_keys = np.zeros(0, dtype=np.int64)
+        self._side_order = np.zeros(0, dtype=np.int64)
+        self._side_features = np.zeros((0, self.number_features), dtype=np.float32)
+
+    def _merge_side(self):
+        """
+        Merges the side index into the key index and maps the features of all stored pairs
+        """
+        number_pairs = len(self._sorted_keys)
+        positions = np.searchsorted(self._sorted_keys, self._side_keys)
+        self._sorted_keys = np.insert(self._sorted_keys, positions, self._side_keys)
+        self._order = np.insert(self._order, positions, number_pairs + self._side_order)
+        self._map_features(len(self._sorted_keys))
+        self._clear_side()
+
+    def __len__(self):
+        return len(self._sorted_keys) + len(self._side_keys)
+
+    def lookup(self, first, second):
+        """
+        :param first: 1D int numpy array, line index of the first ad of each pair
+        :param second: 1D int numpy array, line index of the second ad of each pair
+        :return features: 2D float32 numpy array, the stored features of each pair (NaN rows if not stored)
+        :return found: 1D boolean numpy array, whether each pair is stored
+        """
+        keys = pair_keys(first, second)
+        features = np.empty((len(keys), self.number_features), dtype=np.float32)
+        features[:] = np.nan
+        positions, found = _search(self._sorted_keys, keys)
+        features[found] = self._features[self._order[positions[found]]]
+        positions, found_side = _search(self._side_keys, keys)
+        features[found_side] = self._side_features[self._side_order[positions[found_side]]]
+        return features, found | found_side
+
+    def add(self, first, second, features):
+        """
+        Appends the features of pairs of ads. Pairs which are already stored are skipped. The new keys go to a small
+        side index, which is merged into the key index once it outgrows the square root of the store size, so repeated
+        small adds never copy the whole index. While deferring (see defer), the pairs are only kept in memory
+        :param first: 1D int numpy array, line index of the first ad of each pair
+        :param second: 1D int numpy array, line index of the second ad of each pair
+        :param features: 2D float numpy array, the weak features of each pair
+        """
+        if self._deferred is not None:
+            self._deferred.append((np.asarray(first, dtype=np.int64), np.asarray(second, dtype=np.int64),
+                                   np.asarray(features, dtype=np.float32).reshape(-1, self.number_features)))
+            return
+        keys = pair_keys(first, second)
+        keys, unique = np.unique(keys, return_index=True)
+        stored = _search(self._sorted_keys, keys)[1]
+        positions, stored_side = _search(self._side_keys, keys)
+        new = np.flatnonzero(~(stored | stored_side))
+        if not len(new):
+            return
+        rows = np.asarray(features, dtype=np.float32)[unique[new]]
+        outs = open(self._features_path, 'ab')
+        outs.write(rows.tobytes())
+        outs.close()
+        outs = open(self._keys_path, 'ab')
+        outs.write(keys[new].tobytes())
+        outs.close()
+        number_side = len(self._side_keys)
+        self._side_keys = np.insert(self._side_keys, positions[new], keys[new])
+        self._side_order = np.insert(self._side_order, positions[new], np.arange(number_side, number_side + len(new)))
+        self._side_features = np.concatenate((self._side_features, rows))
+        if len(self._side_keys) > max(SIDE_INDEX_SIZE, int(np.sqrt(len(self._sorted_keys)))):
+            self._merge_side()
+
+    def defer(self):
+        """
+        Keeps added pairs in memory instead of appending them, until they are taken with take_deferred. Used by worker
+        processes, which share the store files with their parent
+        """
+        self._deferred = []
+
+    def take_deferred(self):
+        """
+        :return first: 1D int64 numpy array, line index of the first ad of each pair added since the last call
+        :return second: 1D int64 numpy array, line index of the second ad of each pair
+        :return features: 2D float32 numpy array, the weak features of each pair
+        """
+        deferred = self._deferred or [(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64),
+                                       np.zeros((0, self.number_features), dtype=np.float32))]
+        self._deferred = []
+        return tuple(np.concatenate(columns) for columns in zip(*deferred))
+
+    def minimum_features(self, records_1, records_2):
+        """
+        Vectorised features of pairs of records, the minimum over all stored pairs of their ads
+        :param records_1: List of Record objects, the first record of each pair
+        :param records_2: List of Record objects, the second record of each pair
+        :return x2: 2D float64 numpy array, the features of each pair of records (NaN rows if not found)
+        :return found: 1D boolean numpy array, whether all pairs of ads of each pair of records are stored
+        """
+        lines_1 = [list(record.line_indices) for record in records_1]
+        lines_2 = [list(record.line_indices) for record in records_2]
+        counts_1 = np.array(map(len, lines_1), dtype=np.int64)
+        counts_2 = np.array(map(len, lines_2), dtype=np.int64)
+        values_1 = np.array([line for lines in lines_1 for line in lines], dtype=np.int64)
+        values_2 = np.array([line for lines in lines_2 for line in lines], dtype=np.int64)
+        counts = counts_1*counts_2
+        starts = np.cumsum(counts) - counts
+        offsets = np.arange(counts.sum()) - np.repeat(starts, counts)
+        repeated_2 = np.repeat(counts_2, counts)
+        ads_1 = values_1[np.repeat(np.cumsum(counts_1) - counts_1, counts) + offsets // np.maximum(repeated_2, 1)]
+        ads_2 = values_2[np.repeat(np.cumsum(counts_2) - counts_2, counts) + offsets % np.maximum(repeated_2, 1)]
+        features, found_ads = self.lookup(ads_1, ads_2)
+        pairs = np.repeat(np.arange(len(counts)), counts)
+        found = (counts > 0) & (np.bincount(pairs[~found_ads], minlength=len(counts)) == 0)
+        x2 = np.empty((len(counts), self.number_features))
+        x2[:] = np.nan
+        if found.any():
+            found_counts = counts[found]  # all positive
+            x2[found] = np.fmin.reduceat(features[np.repeat(found, counts)], np.cumsum(found_counts) - found_counts)
+        return x2, found
+
+    def add_records(self, records_1, records_2, x2):
+        """
+        Appends the features of the pairs of single-ad records. Features of merged records are not stored, as they are
+        derived from their ads
+        :param records_1: List of Record objects, the first record of each pair
+        :param records_2: List of Record objects, the second record of each pair
+        :param x2: 2D float numpy array, the weak features of each pair of records
+        """
+        single = [i for i, (r1, r2) in enumerate(zip(records_1, records_2))
+                  if len(r1.line_indices) == 1 and len(r2.line_indices) == 1]
+        if single:
+            self.add([next(iter(records_1[i].line_indices)) for i in single],
+                     [next(iter(records_2[i].line_indices)) for i in single], np.asarray(x2)[single])
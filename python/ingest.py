@@ -0,0 +1,231 @@
+"""
+Chunked, parallel parsing of annotation files into columnar stores. Used by Database.__init__
+The annotation file is split into byte ranges aligned to line starts, which are parsed independently (optionally in a
+process pool). Line indices are assigned from the per-chunk line counts, so they do not depend on the number of cores.
+A database can also be split across several annotation files (shards) sharing one header. The shards are read in sorted
+path order as if concatenated, so record identifiers are unique across the corpus and stable between runs.
+"""
+import os
+import glob
+import multiprocessing
+import numpy as np
+from record import FeatureDescriptor
+from columnar import ColumnarBuilder, concatenate_stores
+__author__ = 'mbarnes1'
+
+
+def read_header(annotation_path, header_path=None):
+    """
+    Reads the five header lines, either from the top of the annotation file or from a separate header file.
+    Columns of type 'ignore' are removed from the feature descriptor.
+    :param annotation_path: String, path to annotation file
+    :param header_path: String, path to header info (if not included in the annotations file)
+    :return feature_descriptor: FeatureDescriptor object
+    :return ignore_indices: List of annotation column indices to drop from every line
+    :return data_start: Int, byte offset of the first annotation line
+    """
+    ins = open(annotation_path, 'r')
+    if header_path:
+        header_ins = open(header_path, 'r')
+        header = [header_ins.readline().strip('\n').split(',') for _ in range(5)]
+        header_ins.close()
+        feature_names_check = ins.readline().strip('\n').split(',')
+        if header[0] != feature_names_check:
+            raise Exception('Header feature names and annotation feature names do not match')
+    else:
+        header = [ins.readline().strip('\n').split(',') for _ in range(5)]
+    data_start = ins.tell()
+    ins.close()
+    feature_names, feature_types, feature_strengths, blocking, pairwise_uses = header
+    ignore_indices = find_in_list(feature_types, 'ignore')
+    feature_descriptor = FeatureDescriptor(remove_indices(ignore_indices, feature_names),
+                                           remove_indices(ignore_indices, feature_types),
+                                           remove_indices(ignore_indices, feature_strengths),
+                                           remove_indices(ignore_indices, blocking),
+                                           remove_indices(ignore_indices, pairwise_uses))
+    return feature_descriptor, ignore_indices, data_start
+
+
+def annotation_paths(annotation_path):
+    """
+    Expands the annotation path argument of Database into a list of files
+    :param annotation_path: String path, glob pattern (e.g. 'part_*.csv'), or list of paths
+    :return paths: List of strings. Sorted if annotation_path is a pattern
+    """
+    if isinstance(annotation_path, (list, tuple)):
+        return list(annotation_path)
+    if glob.has_magic(annotation_path):
+        paths = sorted(glob.glob(annotation_path))
+        if not paths:
+            raise Exception('No annotation files match ' + annotation_path)
+        return paths
+    return [annotation_path]
+
+
+def read_headers(annotation_paths, header_path=None):
+    """
+    Reads the header of every shard, see read_header(). All the shards must have the same header
+    :param annotation_paths: List of strings, paths to annotation files
+    :param header_path: String, path to header info shared by all shards (if not included in the annotation files)
+    :return feature_descriptor: FeatureDescriptor object
+    :return ignore_indices: List of annotation column indices to drop from every line
+    :return data_starts: List of ints, byte offset of the first annotation line of each shard
+    """
+    if not annotation_paths:
+        raise Exception('No annotation files')
+    data_starts = list()
+    for annotation_path in annotation_paths:
+        shard_descriptor, ignore_indices, data_start = read_header(annotation_path, header_path)
+        if data_starts and shard_descriptor != feature_descriptor:
+            raise Exception('Header of ' + annotation_path + ' does not match the other annotation files')
+        feature_descriptor = shard_descriptor
+        data_starts.append(data_start)
+    return feature_descriptor, ignore_indices, data_starts
+
+
+def chunk_ranges(annotation_path, data_start, number_chunks):
+    """
+    Splits the annotation lines into byte ranges. Each range starts at the beginning of a line.
+    :param annotation_path: String, path to annotation file
+    :param data_start: Int, byte offset of the first annotation line
+    :param number_chunks: Int, requested number of ranges (fewer are returned for small files)
+    :return ranges: List of (begin, end) byte offsets
+    """
+    size = os.path.getsize(annotation_path)
+    boundaries = [data_start]
+    ins = open(annotation_path, 'r')
+    for k in range(1, number_chunks):
+        boundary = data_start + (size - data_start)*k//number_chunks
+        if boundary <= boundaries[-1]:
+            continue
+        ins.seek(boundary - 1)
+        ins.readline()  # advance to the start of the next line
+        boundary = ins.tell()
+        if boundaries[-1] < boundary < size:
+            boundaries.append(boundary)
+    ins.close()
+    boundaries.append(size)
+    return zip(boundaries[:-1], boundaries[1:])
+
+
+def load_annotations(annotation_path, feature_descriptor, ignore_indices, data_start, max_records=np.Inf, cores=1,
+                     progress=None, chunk_bytes=2**26):
+    """
+    Parses all the annotation lines of a file into a single ColumnarStore. The record identifier is the line index,
+    counted from the first annotation line.
+    :param annotation_path: String, path to annotation file
+    :param feature_descriptor: FeatureDescriptor object
+    :param ignore_indices: List of annotation column indices to drop from every line
+    :param data_start: Int, byte offset of the first annotation line
+    :param max_records: Int, number of records to load from annotation file
+    :param cores: Int, number of processes to parse with
+    :param progress: Function handle progress(number_lines, bytes_parsed, total_bytes), called after each chunk
+    :param chunk_bytes: Int, approximate size of each chunk in bytes
+    :return store: ColumnarStore object
+    """
+    return load_shards([annotation_path], feature_descriptor, ignore_indices, [data_start], max_records=max_records,
+                       cores=cores, progress=progress, chunk_bytes=chunk_bytes)
+
+
+def load_shards(annotation_paths, feature_descriptor, ignore_indices, data_starts, max_records=np.Inf, cores=1,
+                progress=None, chunk_bytes=2**26):
+    """
+    Parses the annotation lines of several files into a single ColumnarStore, as if the files were concatenated. The
+    chunks of all files share one process pool. The record identifier is the line index in the concatenated files.
+    :param annotation_paths: List of strings, paths to annotation files
+    :param feature_descriptor: FeatureDescriptor object
+    :param ignore_indices: List of annotation column indices to drop from every line
+    :param data_starts: List of ints, byte offset of the first annotation line of each file
+    :param max_records: Int, total number of records to load
+    :param cores: Int, number of processes to parse with
+    :param progress: Function handle progress(number_lines, bytes_parsed, total_bytes), called after each chunk
+    :param chunk_bytes: Int, approximate size of each chunk in bytes
+    :return store: ColumnarStore object
+    """
+    sizes = [os.path.getsize(path) - data_start for path, data_start in zip(annotation_paths, data_starts)]
+    total_bytes = sum(sizes)
+    jobs = list()
+    for annotation_path, data_start, size in zip(annotation_paths, data_starts, sizes):
+        number_chunks = max(int(np.ceil(float(cores)*size/total_bytes)) if total_bytes else 1,
+                            int(np.ceil(float(size)/chunk_bytes)), 1)
+        for begin, end in chunk_ranges(annotation_path, data_start, number_chunks):
+            jobs.append((annotation_path, begin, end, feature_descriptor, ignore_indices, max_records))
+    if cores > 1:
+        pool = multiprocessing.Pool(cores)
+        results = pool.imap(_parse_chunk, jobs)
+    else:
+        pool = None
+        results = (_parse_chunk(job) for job in jobs)
+    stores = list()
+    number_lines = 0
+    bytes_parsed = 0
+    for job, (store, failed) in zip(jobs, results):
+        for local_index, sample in failed:
+            if number_lines + local_index < max_records:
+                print 'Unable to parse:', sample
+        store.ids += number_lines
+        stores.append(store)
+        number_lines += len(store)
+        bytes_parsed += job[2] - job[1]
+        if progress:
+            progress(number_lines, bytes_parsed, total_bytes)
+        if number_lines >= max_records:
+            break
+    if pool:
+        pool.terminate()
+        pool.join()
+    store = concatenate_stores(feature_descriptor, stores)
+    if len(store) > max_records:
+        store = store.take(np.arange(int(max_records)))
+    return store
+
+
+def _parse_chunk(job):
+    """
+    Parses the annotation lines in a single byte range. Module level, so it can be used in a process pool.
+    :param job: Tuple (annotation_path, begin, end, feature_descriptor, ignore_indices, max_records)
+    :return store: ColumnarStore object, with record identifiers local to the chunk (starting at 0)
+    :return failed: List of (local line index, line) of lines which could not be fully parsed
+    """
+    annotation_path, begin, end, feature_descriptor, ignore_indices, max_records = job
+    builder = ColumnarBuilder(feature_descriptor)
+    line_starts = list()
+    ins = open(annotation_path, 'r')
+    ins.seek(begin)
+    line_index = 0
+    while ins.tell() < end and line_index < max_records:
+        line_starts.append(ins.tell())
+        sample = ins.readline()
+        if not sample:
+            break
+        features = remove_indices(ignore_indices, sample.rstrip('\n').split(','))
+        builder.add(line_index, features)
+        line_index += 1
+    store = builder.build()
+    failed = list()
+    for line_index in builder.failed_rows:
+        ins.seek(line_starts[line_index])
+        failed.append((line_index, ins.readline()))
+    ins.close()
+    return store, failed
+
+
+def remove_indices(remove, lst):
+    """
+    Removes indices from a list
+    :param remove: A list of indices to remove from lst
+    :param lst: List to remove entries from
+    :return new_lst: A new list with entries from lst removed
+    """
+    new_lst = [item for i, item in enumerate(lst) if i not in remove]
+    return new_lst
+
+
+def find_in_list(lst, field):
+    """
+    Finds all occurences of field in list and returns their indicies
+    :param field: The entry to find in list
+    :param lst: List to search
+    :return i: Indices of entries in lst
+    """
+    return [i for i, x in enumerate(lst) if x == field]
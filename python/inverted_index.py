@@ -0,0 +1,216 @@
+"""
+Inverted index from blocking keys to record identifiers, in CSR form. Used by BlockingScheme
+Records are sharded across processes, and each shard emits integer (key code, record id) pairs with its own key
+dictionary. The shards are merged by translating their key codes, and sorting the pairs by key.
+Columnar records are indexed directly from their feature arrays.
+"""
+import multiprocessing
+import numpy as np
+from itertools import izip
+from columnar import ColumnarRecords
+from blocking_keys import key_function
+__author__ = 'mbarnes1'
+
+
+class InvertedIndex(object):
+    """
+    Record identifiers of each blocking key. The records of key k are record_ids[offsets[k]:offsets[k+1]], ascending
+    """
+    def __init__(self, keys, offsets, record_ids):
+        """
+        :param keys: List of hashable blocking keys (feature index, label, key), see build_inverted_index
+        :param offsets: 1D int64 numpy array of length len(keys) + 1
+        :param record_ids: 1D int64 numpy array of record identifiers, grouped by key
+        """
+        self.keys = keys
+        self.offsets = offsets
+        self.record_ids = record_ids
+
+    @staticmethod
+    def from_pairs(keys, key_codes, record_ids):
+        """
+        Builds the index from (key code, record id) pairs. Duplicate pairs are removed
+        :param keys: List of blocking keys, indexed by key code
+        :param key_codes: 1D int numpy array, the key code of each pair
+        :param record_ids: 1D int numpy array, the record identifier of each pair
+        :return index: InvertedIndex object
+        """
+        key_codes = np.asarray(key_codes, dtype=np.int64)
+        record_ids = np.asarray(record_ids, dtype=np.int64)
+        order = np.lexsort((record_ids, key_codes))
+        key_codes = key_codes[order]
+        record_ids = record_ids[order]
+        if len(key_codes):
+            keep = np.ones(len(key_codes), dtype=bool)
+            keep[1:] = (key_codes[1:] != key_codes[:-1]) | (record_ids[1:] != record_ids[:-1])
+            key_codes = key_codes[keep]
+            record_ids = record_ids[keep]
+        offsets = np.zeros(len(keys)+1, dtype=np.int64)
+        np.cumsum(np.bincount(key_codes, minlength=len(keys)), out=offsets[1:])
+        return InvertedIndex(keys, offsets, record_ids)
+
+    def block(self, k):
+        """
+        :param k: Int, key code
+        :return record_ids: 1D int64 numpy array, the records with this key
+        """
+        return self.record_ids[self.offsets[k]:self.offsets[k+1]]
+
+    def sizes(self):
+        """
+        :return sizes: 1D int64 numpy array, the number of records of each key
+        """
+        return np.diff(self.offsets)
+
+    def uncovered(self, record_ids, keep):
+        """
+        Finds the records which are not in any kept block
+        :param record_ids: 1D numpy array of all record identifiers
+        :param keep: 1D boolean numpy array, which keys are kept
+        :return record_ids: 1D int64 numpy array of the uncovered record identifiers, ascending
+        """
+        covered = self.record_ids[np.repeat(keep, self.sizes())]
+        return np.setdiff1d(np.asarray(record_ids, dtype=np.int64), covered)
+
+    def __len__(self):
+        return len(self.keys)
+
+
+def build_inverted_index(records, to_block, cores=1, shard_size=100000):
+    """
+    Indexes records by the blocking keys of their subfeatures. The index keys are (feature index, label, key) tuples,
+    where key is an output of the blocking key function of the directive (see blocking_keys.py)
+    :param records: Dictionary-like [record id, Record object], e.g. Database.records
+    :param to_block: List of (feature index, label, directive) tuples, see blocking_keys.parse_blocking
+    :param cores: Int, number of processes indexing Record objects
+    :param shard_size: Int, number of Record objects per shard
+    :return index: InvertedIndex object
+    """
+    key_to_code = dict()
+    keys = list()
+    key_codes = list()
+    record_ids = list()
+
+    def translate(local_keys):
+        codes = np.empty(len(local_keys), dtype=np.int64)
+        for position, key in enumerate(local_keys):
+            code = key_to_code.get(key)
+            if code is None:
+                code = len(keys)
+                key_to_code[key] = code
+                keys.append(key)
+            codes[position] = code
+        return codes
+
+    if isinstance(records, ColumnarRecords):
+        for local_keys, codes, ids in _index_columns(records, to_block):
+            key_codes.append(translate(local_keys)[codes])
+            record_ids.append(ids)
+        items = [(record_id, records[record_id]) for record_id in records.modified_keys()]
+    else:
+        items = records.iteritems()
+    shards = _shards(items, to_block, shard_size)
+    if cores > 1:
+        pool = multiprocessing.Pool(cores)
+        results = pool.imap(_index_shard, shards)
+    else:
+        pool = None
+        results = (_index_shard(shard) for shard in shards)
+    for local_keys, codes, ids in results:
+        key_codes.append(translate(local_keys)[codes])
+        record_ids.append(ids)
+    if pool:
+        pool.close()
+        pool.join()
+    empty = np.zeros(0, dtype=np.int64)
+    return InvertedIndex.from_pairs(keys, np.concatenate(key_codes + [empty]), np.concatenate(record_ids + [empty]))
+
+
+def _shards(items, to_block, shard_size):
+    """
+    Splits records into shards, keeping only the blocked features
+    :param items: Iterable of (record id, Record object)
+    :param to_block: List of (feature index, label, directive) tuples
+    :param shard_size: Int, number of records per shard
+    :return shards: Generator of (to_block, list of (record id, list of feature sets, one per entry of to_block))
+    """
+    shard = list()
+    for record_id, record in items:
+        shard.append((record_id, [record.features[index] for index, _, _ in to_block]))
+        if len(shard) == shard_size:
+            yield (to_block, shard)
+            shard = list()
+    if shard:
+        yield (to_block, shard)
+
+
+def _index_shard(job):
+    """
+    Emits the (key, record id) pairs of a shard of records. Module level, so it can be used in a process pool
+    :param job: Tuple (to_block, list of (record id, list of feature sets)), see _shards
+    :return local_keys: List of the distinct keys of this shard
+    :return codes: 1D int64 numpy array, the code (into local_keys) of each pair
+    :return ids: 1D int64 numpy array, the record identifier of each pair
+    """
+    to_block, shard = job
+    functions = [key_function(directive) for _, _, directive in to_block]
+    caches = [dict() for _ in to_block]  # [subfeature, list of key codes], per entry of to_block
+    key_to_code = dict()
+    codes = list()
+    ids = list()
+    for record_id, features in shard:
+        for (index, label, _), function, cache, feature in izip(to_block, functions, caches, features):
+            for subfeature in feature:
+                subfeature_codes = cache.get(subfeature)
+                if subfeature_codes is None:
+                    subfeature_codes = list()
+                    for key in function(subfeature):
+                        key = (index, label, key)
+                        code = key_to_code.get(key)
+                        if code is None:
+                            code = len(key_to_code)
+                            key_to_code[key] = code
+                        subfeature_codes.append(code)
+                    cache[subfeature] = subfeature_codes
+                codes.extend(subfeature_codes)
+                ids.extend([record_id]*len(subfeature_codes))
+    local_keys = [None]*len(key_to_code)
+    for key, code in key_to_code.iteritems():
+        local_keys[code] = key
+    return local_keys, np.array(codes, dtype=np.int64), np.array(ids, dtype=np.int64)
+
+
+def _index_columns(records, to_block):
+    """
+    Emits the (key, record id) pairs of the unmodified records of a ColumnarRecords object, one directive at a time.
+    Key functions are only evaluated once per distinct value
+    :param records: ColumnarRecords object
+    :param to_block: List of (feature index, label, directive) tuples
+    :return pairs: Generator of (local_keys, codes, ids), see _index_shard
+    """
+    rows = records.alive_rows()
+    rows = rows[~np.in1d(records.store.ids[rows], records.modified_keys())]
+    row_ids = records.store.ids[rows].astype(np.int64)
+    for index, label, directive in to_block:
+        column = records.column(index).take(rows)
+        distinct, inverse = np.unique(column.values, return_inverse=True)
+        if column.vocabulary is not None:
+            distinct = column.vocabulary[distinct]
+        ids = np.repeat(row_ids, column.counts())
+        function = key_function(directive)
+        key_to_code = dict()
+        value_codes = list()  # key codes of each distinct value, flattened
+        value_counts = np.empty(len(distinct), dtype=np.int64)
+        for position, value in enumerate(distinct.tolist()):
+            keys = function(value)
+            for key in keys:
+                value_codes.append(key_to_code.setdefault((index, label, key), len(key_to_code)))
+            value_counts[position] = len(keys)
+        value_starts = np.cumsum(value_counts) - value_counts
+        counts = value_counts[inverse]
+        starts = np.cumsum(counts) - counts
+        positions = np.repeat(value_starts[inverse] - starts, counts) + np.arange(counts.sum())
+        local_keys = [None]*len(key_to_code)
+        for key, code in key_to_code.iteritems():
+            local_keys[code] = key
+        yield local_keys, np.array(value_codes, dtype=np.int64)[positions], np.repeat(ids, counts)
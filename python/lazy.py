@@ -0,0 +1,176 @@
+"""
+Lazy storage over a memory-mapped annotation file. Used by Database when storage='lazy'
+A line-offset index is built once. Records are only parsed when accessed, and feature columns are only decoded when a
+consumer asks for them (e.g. blocking on a single feature). LazyStore has the same interface as ColumnarStore, so it is
+wrapped in ColumnarRecords to provide the dictionary-like Database.records API.
+"""
+import mmap
+import os
+import numpy as np
+from record import Record, split_subfeatures
+from columnar import build_column
+from ingest import read_header, remove_indices
+__author__ = 'mbarnes1'
+
+
+def line_offsets(annotation_path, data_start, max_records=np.Inf, block_bytes=2**26):
+    """
+    Builds the line-offset index of an annotation file
+    :param annotation_path: String, path to annotation file
+    :param data_start: Int, byte offset of the first annotation line
+    :param max_records: Int, maximum number of lines to index
+    :param block_bytes: Int, number of bytes to scan at a time
+    :return starts: 1D int64 numpy array, byte offset of the start of each line
+    :return ends: 1D int64 numpy array, byte offset of the end of each line (including the line break)
+    """
+    size = os.path.getsize(annotation_path)
+    breaks = list()
+    number_breaks = 0
+    ins = open(annotation_path, 'rb')
+    ins.seek(data_start)
+    position = data_start
+    while position < size and number_breaks < max_records:
+        block = ins.read(block_bytes)
+        block_breaks = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == ord('\n')) + position
+        breaks.append(block_breaks)
+        number_breaks += len(block_breaks)
+        position += len(block)
+    ins.close()
+    ends = np.concatenate(breaks + [np.zeros(0, dtype=np.int64)]).astype(np.int64) + 1
+    last_end = ends[-1] if len(ends) else data_start
+    if last_end < size and number_breaks < max_records:
+        ends = np.append(ends, size)  # final line without a line break
+    if len(ends) > max_records:
+        ends = ends[:int(max_records)]
+    starts = np.concatenate([[data_start], ends[:-1]]).astype(np.int64) if len(ends) else ends
+    return starts, ends
+
+
+class _LazyColumns(object):
+    """
+    List-like access to the feature columns of a LazyStore, decoding each column on first access
+    """
+    def __init__(self, store):
+        self._store = store
+        self._decoded = dict()
+
+    def __getitem__(self, index):
+        if index not in self._decoded:
+            self._decoded[index] = self._store.decode_column(index)
+        return self._decoded[index]
+
+    def __len__(self):
+        return self._store.feature_descriptor.number
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+
+class LazyStore(object):
+    """
+    Read-only records of an annotation file, parsed on demand from a memory map
+    """
+    def __init__(self, annotation_path, header_path=None, max_records=np.Inf):
+        """
+        :param annotation_path: String, path to annotation file
+        :param header_path: String, path to header info (if not included in the annotations file)
+        :param max_records: Int, number of records to index from the annotation file
+        """
+        self._annotation_path = annotation_path
+        self.feature_descriptor, self._ignore_indices, data_start = read_header(annotation_path, header_path)
+        self._starts, self._ends = line_offsets(annotation_path, data_start, max_records)
+        self.ids = np.arange(len(self._starts), dtype=np.int32)
+        self.columns = _LazyColumns(self)
+        self._map = None
+        self._open()
+
+    def _open(self):
+        ins = open(self._annotation_path, 'rb')
+        if os.path.getsize(self._annotation_path):
+            self._map = mmap.mmap(ins.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._map = ''
+        ins.close()
+
+    def line(self, row):
+        """
+        :param row: Int, row number
+        :return features: List of strings, the annotation fields of this row (without ignored columns)
+        """
+        sample = self._map[self._starts[row]:self._ends[row]]
+        return remove_indices(self._ignore_indices, sample.rstrip('\n').split(','))
+
+    def row_of(self, record_id):
+        """
+        Finds the row of a record identifier
+        :param record_id: Int, the record identifier
+        :return row: Int row number, or None if record_id is not in the store
+        """
+        row = np.searchsorted(self.ids, record_id)
+        if row < len(self.ids) and self.ids[row] == record_id:
+            return int(row)
+        return None
+
+    def build_record(self, row):
+        """
+        Parses a single row as a Record object
+        :param row: Int, row number
+        :return r: Record object
+        """
+        r = Record(int(self.ids[row]), self.feature_descriptor)
+        features = self.line(row)
+        try:
+            r.initialize_from_annotation(features)
+        except Exception:
+            print 'Unable to parse:', ','.join(features)
+        return r
+
+    def decode_column(self, index):
+        """
+        Parses a single feature of every row
+        :param index: Int, feature index
+        :return column: FeatureColumn object
+        """
+        feature_type = self.feature_descriptor.types[index]
+        subfeatures = list()
+        counts = list()
+        for row in xrange(len(self.ids)):
+            features = self.line(row)
+            split = list()
+            if len(features) == self.feature_descriptor.number and self.feature_descriptor.converters[index]:
+                split = split_subfeatures(features[index])
+                if feature_type == 'string':
+                    split = sorted(set(split))
+            subfeatures.extend(split)
+            counts.append(len(split))
+        column, _ = build_column(feature_type, subfeatures, counts)
+        return column
+
+    def take(self, rows):
+        """
+        Creates a new store from a subset of rows, sharing the memory map
+        :param rows: 1D numpy array of row numbers, ascending
+        :return store: LazyStore object
+        """
+        store = LazyStore.__new__(LazyStore)
+        store.__dict__.update(self.__dict__)
+        store._starts = self._starts[rows]
+        store._ends = self._ends[rows]
+        store.ids = self.ids[rows]
+        store.columns = _LazyColumns(store)
+        return store
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_map'] = None  # memory maps can not be pickled, reopened on unpickling
+        state['columns'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.columns = _LazyColumns(self)
+        self._open()
@@ -0,0 +1,117 @@
+"""
+Meta-blocking: restructures overlapping blocks into a pruned set of record pairs. Used by BlockingScheme
+The blocking graph has a node per record, and an edge between records sharing at least one block. Each edge is weighted
+by how strongly the blocks suggest a match, and only the best edges of each node are kept (Papadakis et al. 2014):
+Weighting schemes:
+    CBS     Common blocks scheme, the number of blocks shared by the two records
+    JS      Jaccard scheme, Jaccard similarity of the two records' sets of blocks
+    ECBS    Enhanced common blocks scheme, CBS * log(|B|/|B_i|) * log(|B|/|B_j|), discounting records in many blocks
+Pruning schemes:
+    WNP     Weighted node pruning, each node keeps the edges weighing at least its mean edge weight
+    CNP     Cardinality node pruning, each node keeps its top k edges
+An edge is kept if either of its nodes keeps it.
+"""
+import numpy as np
+__author__ = 'mbarnes1'
+
+
+WEIGHTING_SCHEMES = ('CBS', 'JS', 'ECBS')
+PRUNING_SCHEMES = ('WNP', 'CNP')
+
+
+def blocking_graph(index, keep):
+    """
+    Builds the edges of the blocking graph, with the number of blocks each pair of records shares
+    :param index: InvertedIndex object
+    :param keep: 1D boolean numpy array, which keys of the index are blocks
+    :return nodes: 1D int64 numpy array of the record identifiers in any kept block, ascending
+    :return first: 1D int64 numpy array, node position of the first record of each edge
+    :return second: 1D int64 numpy array, node position of the second record of each edge (first < second)
+    :return common: 1D int64 numpy array, the number of blocks shared by each edge (CBS)
+    :return node_blocks: 1D int64 numpy array, the number of kept blocks of each node
+    """
+    sizes = index.sizes()
+    entries = np.repeat(keep, sizes)
+    nodes, positions = np.unique(index.record_ids[entries], return_inverse=True)
+    node_blocks = np.bincount(positions, minlength=len(nodes)).astype(np.int64)
+    number_nodes = len(nodes)
+    pair_keys = list()
+    start = 0
+    for size in sizes[keep]:
+        if size > 1:
+            block = positions[start:start+size]  # ascending, as record ids in the index are sorted within each key
+            i, j = np.triu_indices(size, 1)
+            pair_keys.append(block[i]*number_nodes + block[j])
+        start += size
+    pair_keys, common = np.unique(np.concatenate(pair_keys + [np.zeros(0, dtype=np.int64)]), return_counts=True)
+    return nodes, pair_keys // number_nodes, pair_keys % number_nodes, common.astype(np.int64), node_blocks
+
+
+def edge_weights(first, second, common, node_blocks, number_blocks, weighting='CBS'):
+    """
+    :param first: 1D int numpy array, node position of the first record of each edge
+    :param second: 1D int numpy array, node position of the second record of each edge
+    :param common: 1D int numpy array, the number of blocks shared by each edge
+    :param node_blocks: 1D int numpy array, the number of blocks of each node
+    :param number_blocks: Int, the total number of blocks
+    :param weighting: String, 'CBS', 'JS' or 'ECBS'
+    :return weights: 1D float64 numpy array, the weight of each edge (larger is more likely a match)
+    """
+    common = common.astype(np.float64)
+    if weighting == 'CBS':
+        return common
+    if weighting == 'JS':
+        return common/(node_blocks[first] + node_blocks[second] - common)
+    if weighting == 'ECBS':
+        return common*np.log(float(number_blocks)/node_blocks[first])*np.log(float(number_blocks)/node_blocks[second])
+    raise Exception('Invalid weighting scheme: ' + weighting)
+
+
+def prune_edges(first, second, weights, number_nodes, pruning='WNP', k=None):
+    """
+    Node-centric pruning of the blocking graph
+    :param first: 1D int numpy array, node position of the first record of each edge
+    :param second: 1D int numpy array, node position of the second record of each edge
+    :param weights: 1D float numpy array, the weight of each edge
+    :param number_nodes: Int
+    :param pruning: String, 'WNP' or 'CNP'
+    :param k: Int, number of edges kept by each node for CNP. If None, the average number of edges per node
+    :return keep: 1D boolean numpy array, which edges are kept
+    """
+    nodes = np.concatenate([first, second])
+    node_weights = np.concatenate([weights, weights])
+    if pruning == 'WNP':
+        degrees = np.bincount(nodes, minlength=number_nodes)
+        means = np.bincount(nodes, node_weights, minlength=number_nodes)/np.maximum(degrees, 1)
+        return (weights >= means[first]) | (weights >= means[second])
+    if pruning == 'CNP':
+        if k is None:
+            k = max(int(len(nodes)//max(number_nodes, 1)), 1)
+        order = np.lexsort((-node_weights, nodes))  # by node, heaviest edges first
+        sorted_nodes = nodes[order]
+        group_starts = np.concatenate([[0], np.flatnonzero(sorted_nodes[1:] != sorted_nodes[:-1]) + 1]) \
+            if len(nodes) else np.zeros(0, dtype=int)
+        group_lengths = np.diff(np.concatenate([group_starts, [len(nodes)]]))
+        ranks = np.arange(len(nodes)) - np.repeat(group_starts, group_lengths)
+        kept = np.zeros(len(nodes), dtype=bool)
+        kept[order] = ranks < k
+        return kept[:len(first)] | kept[len(first):]
+    raise Exception('Invalid pruning scheme: ' + pruning)
+
+
+def meta_block(index, keep, weighting='CBS', pruning='WNP', k=None):
+    """
+    Restructures the kept blocks of an index into record pairs
+    :param index: InvertedIndex object
+    :param keep: 1D boolean numpy array, which keys of the index are blocks
+    :param weighting: String, weighting scheme, see WEIGHTING_SCHEMES
+    :param pruning: String, pruning scheme, see PRUNING_SCHEMES
+    :param k: Int, number of edges kept by each node for CNP
+    :return pairs: 2D int64 numpy array of shape (number of pairs, 2), record identifiers of the kept pairs
+    :return weights: 1D float64 numpy array, the weight of each kept pair
+    """
+    nodes, first, second, common, node_blocks = blocking_graph(index, keep)
+    weights = edge_weights(first, second, common, node_blocks, int(np.count_nonzero(keep)), weighting)
+    kept = prune_edges(first, second, weights, len(nodes), pruning, k)
+    pairs = np.column_stack([nodes[first[kept]], nodes[second[kept]]]).astype(np.int64)
+    return pairs, weights[kept]
@@ -0,0 +1,160 @@
+"""
+Copy-on-write views of Database records. Used by Database.fork()
+An OverlayRecords object shares a frozen base of records with other views. Removals and modified records are kept in a
+per-view overlay, so many variants of one database can be forked without deep copying every record.
+Forking a view does not stack another view on top of it: the view's overlay is frozen into a layer shared by both
+views, over the same root base, so reads never go through more than one view.
+"""
+from record import same_record_features
+__author__ = 'mbarnes1'
+
+
+class OverlayRecords(object):
+    """
+    Dictionary-like [record id, Record object] copy-on-write view over a base of records.
+    Indexing copies a shared record into the overlay, so in-place modification (e.g. Record.merge) only affects this
+    view. Records yielded while iterating and records returned by pop() may be shared with other views, and should be
+    treated as read-only.
+    """
+    def __init__(self, base, frozen=None, removed=None, number_shared=None):
+        """
+        :param base: Dictionary-like [record id, Record object]. Must not be modified after creating views of it
+        :param frozen: Dictionary [record id, Record object] of records changed before a fork, shared with other views
+                       and never modified. See fork()
+        :param removed: Set of shared record ids removed from this view
+        :param number_shared: Int, number of distinct record ids in base and frozen
+        """
+        self._base = base
+        self._frozen = frozen if frozen is not None else dict()
+        self._overlay = dict()  # [record id, Record object], copied or added records
+        self._removed = set(removed) if removed else set()  # shared record ids removed from this view
+        if number_shared is None:
+            number_shared = len(base) + sum(1 for record_id in self._frozen if record_id not in base)
+        self._number_shared = number_shared
+        self._number_added = 0  # records in overlay which are not shared
+
+    def _is_shared(self, record_id):
+        return record_id in self._frozen or record_id in self._base
+
+    def _in_shared(self, record_id):
+        return self._is_shared(record_id) and record_id not in self._removed
+
+    def _shared(self, record_id):
+        """
+        Reads a shared record without copying it, or caching it in any view
+        """
+        if record_id in self._frozen:
+            return self._frozen[record_id]
+        if isinstance(self._base, OverlayRecords):
+            return self._base._peek(record_id)
+        return self._base[record_id]
+
+    def _peek(self, record_id):
+        """
+        :param record_id: Int, record identifier
+        :return record: Record object of this view, not copied. Must be treated as read-only
+        """
+        if record_id in self._overlay:
+            return self._overlay[record_id]
+        if not self._in_shared(record_id):
+            raise KeyError(record_id)
+        return self._shared(record_id)
+
+    def __getitem__(self, record_id):
+        if record_id in self._overlay:
+            return self._overlay[record_id]
+        record = self._peek(record_id).copy()
+        self._overlay[record_id] = record
+        return record
+
+    def __setitem__(self, record_id, record):
+        if record_id not in self:
+            if self._is_shared(record_id):
+                self._removed.discard(record_id)
+            else:
+                self._number_added += 1
+        self._overlay[record_id] = record
+
+    def __delitem__(self, record_id):
+        self.pop(record_id)
+
+    def pop(self, record_id, *default):
+        if record_id in self._overlay:
+            record = self._overlay.pop(record_id)
+        elif self._in_shared(record_id):
+            record = self._shared(record_id)
+        elif default:
+            return default[0]
+        else:
+            raise KeyError(record_id)
+        if self._is_shared(record_id):
+            self._removed.add(record_id)
+        else:
+            self._number_added -= 1
+        return record
+
+    def __contains__(self, record_id):
+        return record_id in self._overlay or self._in_shared(record_id)
+
+    has_key = __contains__
+
+    def __len__(self):
+        return self._number_shared - len(self._removed) + self._number_added
+
+    def iteritems(self):
+        for record_id, record in self._base.iteritems():
+            if record_id in self._overlay:
+                yield record_id, self._overlay[record_id]
+            elif record_id not in self._removed:
+                yield record_id, self._frozen.get(record_id, record)
+        for record_id, record in self._frozen.iteritems():
+            if record_id not in self._base and record_id not in self._removed:
+                yield record_id, self._overlay.get(record_id, record)
+        for record_id, record in self._overlay.iteritems():
+            if not self._is_shared(record_id):
+                yield record_id, record
+
+    def iterkeys(self):
+        for record_id, _ in self.iteritems():
+            yield record_id
+
+    __iter__ = iterkeys
+
+    def itervalues(self):
+        for _, record in self.iteritems():
+            yield record
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def values(self):
+        return list(self.itervalues())
+
+    def items(self):
+        return list(self.iteritems())
+
+    def __eq__(self, other):
+        return same_record_features(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def fork(self):
+        """
+        Copy-on-write copy of this view, over the same root base. The records this view changed are frozen into a new
+        shared layer, so later changes of either view are only recorded in that view
+        :return records: OverlayRecords object
+        """
+        frozen = dict(self._frozen)
+        frozen.update(self._overlay)
+        self._frozen = frozen
+        self._overlay = dict()
+        self._number_shared += self._number_added
+        self._number_added = 0
+        return OverlayRecords(self._base, frozen, self._removed, self._number_shared)
+
+    def materialized(self):
+        """
+        :return number: Int, number of records copied into or added to this view
+        """
+        return len(self._overlay)
@@ -2,8 +2,10 @@
 All pairwise features and functions
 """
 import numpy as np
-from math import e
-from itertools import izip
+from math import e, exp, log, isnan
+from itertools import izip, chain
+from bisect import bisect_left
+import heapq
 import Levenshtein
 
 
@@ -144,7 +146,8 @@ def get_pairwise_features(database, labels_train, pair_seed, impute=True):
     """
     pairs = pair_seed  # use all of the pair seed
     y = list()
-    x = list()
+    records_1 = list()
+    records_2 = list()
     for pair in pairs:
         r1 = database.records[pair[0]]
         r2 = database.records[pair[1]]
@@ -152,13 +155,13 @@ def get_pairwise_features(database, labels_train, pair_seed, impute=True):
         c2 = labels_train[next(iter(r2.line_indices))]  # cluster r2 belongs to
         _x1 = int(c1 == c2)
         y.append(_x1)
-        if database._precomputed_x2:
-            _x2 = get_precomputed_x2(database._precomputed_x2, r1, r2)
-        else:
-            _x2 = get_weak_pairwise_features(r1, r2)
-        x.append(_x2)
+        records_1.append(r1)
+        records_2.append(r2)
     y = np.asarray(y)
-    x = np.asarray(x)
+    if database._precomputed_x2 is not None:
+        x = get_precomputed_feature_matrix(database._precomputed_x2, records_1, records_2)
+    else:
+        x = get_weak_pairwise_feature_matrix(records_1, records_2)
     if impute:
         m = mean_imputation(x)
     else:
@@ -174,30 +177,195 @@ def get_weak_pairwise_features(r1, r2):
     :return x2: 1-D vector with m entries, where m is number of weak features.
     """
     x = list()
-    for index, (f1, f2, pairwise_use, strength) in enumerate(izip(r1.features, r2.features,
-                                                                  r1.feature_descriptor.pairwise_uses,
-                                                                  r1.feature_descriptor.strengths)):
-        if strength == 'weak':
-            if pairwise_use == 'binary_match':
-                match = binary_match(f1, f2)
-                if not np.isnan(match):
-                    match = not match  # Inverting sign, want smaller feature = better match
-                                       # (restricting all log reg weights negative)
-                x.append(match)
-            elif pairwise_use == 'numerical_difference':
-                x.append(numerical_difference(f1, f2))  # smaller feature = better, OK
-            elif pairwise_use == 'number_matches':
-                x.append(np.exp(-number_matches(f1, f2)))  # Using exp(-x) to get smaller feature = better match
-            elif pairwise_use == 'special_date_difference':
-                x.append(date_difference(f1, f2))  # smaller feature = better, OK
-            elif pairwise_use == 'levenshtein':
-                x.append(np.log(e + levenshtein(f1, f2)))  # smaller feature = better, OK. Using log to decrease weight of large mismatches
-            else:
-                raise Exception('Invalid pairwise use: ' + pairwise_use)
+    for index, _, comparator, transform, _, _ in r1.feature_descriptor.weak_plan:
+        feature = comparator(r1.features[index], r2.features[index])
+        x.append(feature if transform is None else transform(feature))
     x = np.asarray(x)
     return x
 
 
+def get_weak_pairwise_feature_matrix(records_1, records_2, out=None):
+    """
+    Batch version of get_weak_pairwise_features. Each weak feature is computed for all pairs at once, column by column
+    :param records_1: List of Record objects, the first record of each pair
+    :param records_2: List of Record objects, the second record of each pair
+    :param out: Preallocated n x m float matrix to write into, or None
+    :return x2: n x m matrix, where n is the number of pairs and m is number of weak features. Row i equals
+                get_weak_pairwise_features(records_1[i], records_2[i])
+    """
+    if not len(records_1):
+        return out if out is not None else np.empty([0, 0])
+    feature_descriptor = records_1[0].feature_descriptor
+    if out is None:
+        out = np.empty([len(records_1), feature_descriptor.number_weak])
+    records, positions_1, positions_2 = _distinct_records(records_1, records_2)
+    for index, column, _, _, column_comparator, column_transform in feature_descriptor.weak_plan:
+        out[:, column] = column_comparator(records, index, positions_1, positions_2)
+        if column_transform is not None:
+            out[:, column] = column_transform(out[:, column])
+    return out
+
+
+def get_strong_matches(records_1, records_2):
+    """
+    Batch version of strong_match, computed column by column
+    :param records_1: List of Record objects, the first record of each pair
+    :param records_2: List of Record objects, the second record of each pair
+    :return x1: 1-D vector with an entry per pair, 1 (match), 0 (mismatch), or NaN (not enough info)
+    """
+    x1 = np.zeros(len(records_1))
+    if not len(records_1):
+        return x1
+    informative = np.zeros(len(records_1), dtype=bool)
+    feature_descriptor = records_1[0].feature_descriptor
+    records, positions_1, positions_2 = _distinct_records(records_1, records_2)
+    for index, _, column_comparator in feature_descriptor.strong_plan:
+        matches = column_comparator(records, index, positions_1, positions_2)
+        informative |= ~np.isnan(matches)
+        x1[np.nan_to_num(matches) > 0] = 1
+    x1[~informative] = np.nan
+    return x1
+
+
+def _distinct_records(records_1, records_2):
+    """
+    Records are usually in many pairs, so their features are only gathered once
+    :param records_1: List of Record objects
+    :param records_2: List of Record objects
+    :return records: List of the distinct Record objects (by identity)
+    :return positions_1: 1D int numpy array, the position (into records) of each record of records_1
+    :return positions_2: 1D int numpy array, the position (into records) of each record of records_2
+    """
+    records = list()
+    record_positions = dict()  # [id(record), position]
+    positions = np.empty(len(records_1) + len(records_2), dtype=int)
+    for i, record in enumerate(chain(records_1, records_2)):
+        position = record_positions.get(id(record))
+        if position is None:
+            position = len(records)
+            record_positions[id(record)] = position
+            records.append(record)
+        positions[i] = position
+    return records, positions[:len(records_1)], positions[len(records_1):]
+
+
+def _column_subfeatures(records, index, dtype):
+    """
+    :param records: List of Record objects
+    :param index: Int, feature index
+    :param dtype: Numpy dtype of the subfeatures, e.g. float or object
+    :return starts: 1D int numpy array, the position of the first subfeature of each record in values
+    :return counts: 1D int numpy array, the number of subfeatures of each record
+    :return values: 1D numpy array, the subfeatures of all records, concatenated
+    """
+    features = [record.features[index] for record in records]
+    counts = np.array(map(len, features), dtype=int)
+    values = np.empty(counts.sum(), dtype=dtype)
+    values[:] = [subfeature for feature in features for subfeature in feature]
+    return np.cumsum(counts) - counts, counts, values
+
+
+def _pair_subfeatures(starts, counts, positions):
+    """
+    The subfeatures of one record of every pair, for a single feature
+    :param starts: 1D int numpy array, see _column_subfeatures
+    :param counts: 1D int numpy array, see _column_subfeatures
+    :param positions: 1D int numpy array, the position (into records) of the record of each pair
+    :return pairs: 1D int numpy array, the pair of each subfeature, ascending
+    :return subfeatures: 1D int numpy array, the position of each subfeature in the values of _column_subfeatures
+    """
+    pair_counts = counts[positions]
+    pairs = np.repeat(np.arange(len(positions)), pair_counts)
+    subfeatures = np.repeat(starts[positions] - np.cumsum(pair_counts) + pair_counts, pair_counts) + \
+        np.arange(pair_counts.sum())
+    return pairs, subfeatures
+
+
+def _column_matches(records, index, positions_1, positions_2):
+    """
+    The subfeatures are dictionary encoded once per distinct record. The codes of both records of every pair are then
+    sorted by (pair, code), and a match is a code which appears twice in a row (each feature set has distinct codes).
+    O((m+n) log) per pair, instead of every pair of subfeatures
+    :return matches: 1D float numpy array, the intersection size of the feature sets of each pair, or NaN if either set
+                     is empty
+    """
+    starts, counts, values = _column_subfeatures(records, index, object)
+    codes = np.unique(values, return_inverse=True)[1] if len(values) else np.zeros(0, dtype=int)
+    pairs_1, subfeatures_1 = _pair_subfeatures(starts, counts, positions_1)
+    pairs_2, subfeatures_2 = _pair_subfeatures(starts, counts, positions_2)
+    pairs = np.concatenate([pairs_1, pairs_2])
+    pair_codes = np.concatenate([codes[subfeatures_1], codes[subfeatures_2]])
+    order = np.lexsort((pair_codes, pairs))
+    pairs = pairs[order]
+    pair_codes = pair_codes[order]
+    repeated = (pairs[1:] == pairs[:-1]) & (pair_codes[1:] == pair_codes[:-1])
+    matches = np.bincount(pairs[1:][repeated], minlength=len(positions_1)).astype(float)
+    matches[(counts[positions_1] == 0) | (counts[positions_2] == 0)] = np.nan
+    return matches
+
+
+def _column_binary_match(records, index, positions_1, positions_2):
+    """
+    :return match: 1D float numpy array, 1 if the feature sets of each pair intersect, 0 if not, or NaN if either set is
+                   empty
+    """
+    matches = _column_matches(records, index, positions_1, positions_2)
+    match = (np.nan_to_num(matches) > 0).astype(float)
+    match[np.isnan(matches)] = np.nan
+    return match
+
+
+def _column_numerical_difference(records, index, positions_1, positions_2):
+    """
+    Batch version of numerical_difference. The values of each distinct record are sorted once. Each value of the first
+    record of a pair is then binary searched among the values of the second record, as keys (pair, value rank) of the
+    second records are sorted across all pairs. O((m+n) log) per pair, instead of every pair of values
+    :return minimum: 1D float numpy array, the minimum distance between the feature sets of each pair, or NaN if either
+                     set is empty
+    """
+    starts, counts, values = _column_subfeatures(records, index, float)
+    distinct, ranks = np.unique(values, return_inverse=True)
+    ranks = ranks[np.lexsort((ranks, np.repeat(np.arange(len(counts)), counts)))]  # ascending within each record
+    pairs = list()
+    pair_ranks = list()
+    for positions in (positions_1, positions_2):
+        pairs_, subfeatures = _pair_subfeatures(starts, counts, positions)
+        pairs.append(pairs_)
+        pair_ranks.append(ranks[subfeatures])
+    keys_2 = pairs[1]*len(distinct) + pair_ranks[1]  # ascending
+    above = np.searchsorted(keys_2, pairs[0]*len(distinct) + pair_ranks[0])
+    gaps = np.empty(len(pairs[0]))
+    gaps[:] = np.Inf
+    for neighbors in (above - 1, above):
+        valid = np.flatnonzero((neighbors >= 0) & (neighbors < len(keys_2)))
+        valid = valid[pairs[1][neighbors[valid]] == pairs[0][valid]]
+        gaps[valid] = np.minimum(gaps[valid], np.abs(distinct[pair_ranks[0][valid]] -
+                                                     distinct[pair_ranks[1][neighbors[valid]]]))
+    minimum = np.empty(len(positions_1))
+    minimum[:] = np.nan
+    if len(gaps):
+        group_starts = np.flatnonzero(np.concatenate([[True], pairs[0][1:] != pairs[0][:-1]]))
+        minimum[pairs[0][group_starts]] = np.minimum.reduceat(gaps, group_starts)
+    minimum[np.isinf(minimum)] = np.nan  # the second set is empty
+    return minimum
+
+
+def _column_levenshtein(records, index, positions_1, positions_2, cap=None):
+    """
+    :param cap: Int, see levenshtein
+    :return minimum: 1D float numpy array, the minimum Levenshtein distance between the feature sets of each pair, or
+                     NaN if either set is empty. Pairs whose sets intersect are 0, found for all pairs at once by
+                     _column_matches. The others are computed per pair, as the bounded search skips most string pairs
+    """
+    minimum = _column_matches(records, index, positions_1, positions_2)
+    disjoint = np.flatnonzero(minimum == 0)
+    minimum[np.nan_to_num(minimum) > 0] = 0
+    features = [record.features[index] for record in records]
+    minimum[disjoint] = [levenshtein(features[p1], features[p2], cap)
+                         for p1, p2 in izip(positions_1[disjoint].tolist(), positions_2[disjoint].tolist())]
+    return minimum
+
+
 def strong_match(r1, r2):
     """
     Calculates the strong feature value based on differences between two records
@@ -206,15 +374,8 @@ def strong_match(r1, r2):
     :param r2: Record object
     :return x1: 1 (match), 0 (mismatch), or NaN (at least one record has no strong features, not enough info)
     """
-    x1 = list()
-    for f1, f2, pairwise_use, strength in izip(r1.features, r2.features,
-                                               r1.feature_descriptor.pairwise_uses,
-                                               r1.feature_descriptor.strengths):
-        if strength == 'strong':
-            if (pairwise_use == 'binary_match') | (pairwise_use == 'number_matches'):
-                x1.append(binary_match(f1, f2))
-            else:
-                raise Exception('Invalid pairwise use for strong features: ' + pairwise_use)
+    x1 = [comparator(r1.features[index], r2.features[index])
+          for index, comparator, _ in r1.feature_descriptor.strong_plan]
     x1 = np.asarray(x1)
     if np.isnan(x1).all():  # if all nan, return nan
         x1 = np.nan
@@ -269,73 +430,296 @@ def number_matches(feat1, feat2):
 def numerical_difference(feat1, feat2):
     """
     Minimum pairwise distance between two numerical feature sets
+    Small sets are compared directly. Larger sets are sorted, and each value of one set is compared with its nearest
+    values in the other, O((m+n) log n) instead of O(m*n)
     Satisfies ICAR properties
     :param feat1: Set of features
     :param feat2: Set of features
     :return: Float or NaN (not enough info to make decision, if either set is empty)
     """
     if bool(feat1) & bool(feat2):
-        x = np.Inf
-        for f1 in feat1:
-            for f2 in feat2:
-                if abs(f1 - f2) < x:
-                    x = abs(f1 - f2)
+        if len(feat1)*len(feat2) <= DIRECT_COMPARISONS:
+            x = np.Inf
+            for f1 in feat1:
+                for f2 in feat2:
+                    if abs(f1 - f2) < x:
+                        x = abs(f1 - f2)
+        else:
+            x = minimum_gap(np.fromiter(feat1, dtype=float, count=len(feat1)),
+                            np.sort(np.fromiter(feat2, dtype=float, count=len(feat2))))
     else:
         x = np.nan
     return x
 
 
+DIRECT_COMPARISONS = 128  # up to this many pairs of values, comparing all of them is faster than sorting
+
+
+def minimum_gap(values_1, sorted_values_2):
+    """
+    :param values_1: 1D numpy array, not empty
+    :param sorted_values_2: 1D numpy array, ascending, not empty
+    :return gap: Float, the minimum absolute difference between any value of values_1 and any value of sorted_values_2
+    """
+    positions = np.searchsorted(sorted_values_2, values_1)
+    below = sorted_values_2[np.maximum(positions - 1, 0)]
+    above = sorted_values_2[np.minimum(positions, len(sorted_values_2) - 1)]
+    return float(min(np.abs(values_1 - below).min(), np.abs(values_1 - above).min()))
+
+
 def date_difference(feat1, feat2):
     """
-    Minimum pairwise distance between two date feature sets, in seconds
+    Minimum pairwise distance between two date feature sets, in seconds (total seconds, including days)
     Satisfies ICAR properties
-    :param feat1: Set of date features
-    :param feat2: Set of date features
+    :param feat1: Set of date features, as seconds since the epoch
+    :param feat2: Set of date features, as seconds since the epoch
     :return: Float or NaN (not enough info to make decision, if either set is empty)
     """
-    if bool(feat1) & bool(feat2):
-        x = np.Inf
-        for date1 in feat1:  # recall dates in a set, don't need to use iteritemes()
-            for date2 in feat2:
-                x = min(x, abs((date1-date2).seconds))
-    else:
-        x = np.nan
-    return x
+    return numerical_difference(feat1, feat2)
 
 
-def levenshtein(feat1, feat2):
+def levenshtein(feat1, feat2, cap=None):
     """
     Minimum Levenshtein distance between two sets of strings
+    String pairs are compared in increasing order of their length difference, a lower bound of their distance, so the
+    search stops as soon as the bound reaches the running minimum. Both sets are sorted by length, and the pairs are
+    taken from the frontier of each string of feat1 in the lengths of feat2, so pairs beyond the stopping point are
+    never built. Long strings are also skipped if their q-gram count bound reaches it (Ukkonen 1992), see qgram_bound
     Satisfies ICAR properties
     :param feat1: Set of string features
     :param feat2: Set of string features
+    :param cap: Int, distances of at least cap are returned as cap, so the search stops once cap is reached. None for
+                the exact distance. Set with 'levenshtein:<cap>' in the pairwise uses row of the header
     :return: Int or NaN (not enough info to make decision, if either set is empty)
     """
     if bool(feat1) & bool(feat2):
-        x = np.Inf
+        if feat1 & feat2:
+            return 0
+        x = np.Inf if cap is None else cap
+        strings_2 = sorted(feat2, key=len)
+        lengths_2 = [len(s2) for s2 in strings_2]
+        frontier = list()  # heap of (length difference, string of feat1, position in strings_2, step)
         for s1 in feat1:
-            for s2 in feat2:
-                x = min(x, Levenshtein.distance(s1, s2))
+            above = bisect_left(lengths_2, len(s1))
+            if above < len(strings_2):
+                frontier.append((lengths_2[above] - len(s1), s1, above, 1))
+            if above > 0:
+                frontier.append((len(s1) - lengths_2[above - 1], s1, above - 1, -1))
+        heapq.heapify(frontier)
+        profiles = dict()  # [string, q-gram profile], computed on first use
+        while frontier:
+            difference, s1, position, step = heapq.heappop(frontier)
+            if difference >= x:
+                break
+            if 0 <= position + step < len(strings_2):
+                heapq.heappush(frontier, (abs(lengths_2[position + step] - len(s1)), s1, position + step, step))
+            s2 = strings_2[position]
+            if (x < np.Inf) and (min(len(s1), len(s2)) >= QGRAM_FILTER_LENGTH) and \
+                    (qgram_bound(s1, s2, profiles) >= x):
+                continue
+            x = min(x, Levenshtein.distance(s1, s2))
+            if x == 1:  # the sets do not intersect, so no distance is 0
+                break
     else:
         x = np.nan
     return x
 
 
+QGRAM = 2
+QGRAM_FILTER_LENGTH = 64  # shorter strings are compared directly, the filter costs more than the distance
+
+
+def qgram_bound(s1, s2, profiles):
+    """
+    Lower bound of the Levenshtein distance of two byte strings from their q-grams. An edit changes at most q q-grams,
+    so d(s1, s2) >= (max(|s1|, |s2|) - q + 1 - number of common q-grams)/q
+    :param s1: String
+    :param s2: String
+    :param profiles: Dictionary [string, q-gram profile], a cache of the profiles of the strings
+    :return bound: Int
+    """
+    for string in (s1, s2):
+        if string not in profiles:
+            profiles[string] = _qgram_profile(string)
+    common = len(np.intersect1d(profiles[s1], profiles[s2], assume_unique=True))
+    return -(-(max(len(s1), len(s2)) - QGRAM + 1 - common)//QGRAM)
+
+
+def _qgram_profile(string):
+    """
+    :param string: Byte string
+    :return profile: 1D int64 numpy array, the q-grams of the string. Repeated q-grams are numbered by occurrence, so
+                     the intersection of two profiles is the intersection of the q-gram multisets
+    """
+    characters = np.frombuffer(string, dtype=np.uint8).astype(np.int64)
+    number = max(len(characters) - QGRAM + 1, 0)
+    codes = characters[:number].copy()
+    for offset in range(1, QGRAM):
+        codes = codes*256 + characters[offset:number + offset]
+    codes.sort()
+    starts = np.flatnonzero(np.concatenate([[True], codes[1:] != codes[:-1]])) if number else codes
+    occurrences = np.arange(number) - np.repeat(starts, np.diff(np.append(starts, number)))
+    return (codes << 32) + occurrences
+
+
 def get_precomputed_x2(precomputed_x2, r1, r2):
     """
     Minimum precomputed feature vector
-    :param precomputed_x2: Precomputed weak features (smaller valued feature is better)
-                           A dict[(id1, id2)] = 1D vector, where id2 >= id1
+    :param precomputed_x2: PairwiseFeatureStore object of precomputed weak features (smaller valued feature is better)
     :param r1: Record
     :param r2: Record
-    :return min_features: 1-D vector with m entries, where m is number of weak features.
-    """
-    min_features = None
-    for line1 in r1.line_indices:
-        for line2 in r2.line_indices:
-            line_tuple = [line1, line2]
-            line_tuple.sort()
-            line_tuple = tuple(line_tuple)
-            features = precomputed_x2(line_tuple)
-            min_features = np.minimum(min_features, features)
-    return min_features
+    :return min_features: 1-D vector with m entries, where m is number of weak features, the minimum over all pairs of
+                          ads of the two records. None if any pair of ads is not stored
+    """
+    x2, found = precomputed_x2.minimum_features([r1], [r2])
+    return x2[0] if found[0] else None
+
+
+def get_precomputed_feature_matrix(precomputed_x2, records_1, records_2, add=True):
+    """
+    Batch mode of get_precomputed_x2. Features of pairs which are not stored are computed
+    :param precomputed_x2: PairwiseFeatureStore object of precomputed weak features (smaller valued feature is better)
+    :param records_1: List of Record objects, the first record of each pair
+    :param records_2: List of Record objects, the second record of each pair
+    :param add: Boolean, if True the computed features of pairs of single ads are added to the store
+    :return x2: n x m matrix, where n is the number of pairs and m is number of weak features
+    """
+    x, found = precomputed_x2.minimum_features(records_1, records_2)
+    missing = np.flatnonzero(~found)
+    if len(missing):
+        missing_1 = [records_1[i] for i in missing]
+        missing_2 = [records_2[i] for i in missing]
+        x[missing] = get_weak_pairwise_feature_matrix(missing_1, missing_2).astype(np.float32)  # as stored
+        if add:
+            precomputed_x2.add_records(missing_1, missing_2, x[missing])
+    return x
+
+
+def get_match_features(records_1, records_2, precomputed_x2=None):
+    """
+    Weak features of pairs of records compared by a match function. Read from the store of precomputed features if
+    given. Missing pairs are computed and added to the store (the workers of EntityResolution.run defer their adds to
+    the parent process, see PairwiseFeatureStore.defer)
+    :param records_1: List of Record objects, the first record of each pair
+    :param records_2: List of Record objects, the second record of each pair
+    :param precomputed_x2: PairwiseFeatureStore object, or None
+    :return x2: n x m matrix, where n is the number of pairs and m is number of weak features
+    """
+    if precomputed_x2 is None:
+        return get_weak_pairwise_feature_matrix(records_1, records_2)
+    return get_precomputed_feature_matrix(precomputed_x2, records_1, records_2)
+
+
+def _invert(x):
+    """
+    Inverting sign, want smaller feature = better match (restricting all log reg weights negative). NaN stays NaN
+    """
+    return x if isnan(x) else float(not x)
+
+
+def _invert_column(x):
+    return np.where(np.isnan(x), np.nan, np.equal(x, 0))
+
+
+def _exp_negative(x):
+    """
+    Using exp(-x) to get smaller feature = better match
+    """
+    return exp(-x)
+
+
+def _exp_negative_column(x):
+    return np.exp(-x)
+
+
+def _log_e(x):
+    """
+    Using log to decrease weight of large mismatches
+    """
+    return log(e + x)
+
+
+def _log_e_column(x):
+    return np.log(e + x)
+
+
+# [pairwise use, (comparator, transform, column comparator, column transform)]. Smaller transformed feature = better
+# match. The column versions compute the feature for many pairs at once, see get_weak_pairwise_feature_matrix
+WEAK_COMPARATORS = {
+    'binary_match': (binary_match, _invert, _column_binary_match, _invert_column),
+    'numerical_difference': (numerical_difference, None, _column_numerical_difference, None),
+    'number_matches': (number_matches, _exp_negative, _column_matches, _exp_negative_column),
+    'special_date_difference': (date_difference, None, _column_numerical_difference, None),
+    'levenshtein': (levenshtein, _log_e, _column_levenshtein, _log_e_column),
+}
+
+# [pairwise use, (comparator, column comparator)]. Any strong feature match is a match
+STRONG_COMPARATORS = {
+    'binary_match': (binary_match, _column_binary_match),
+    'number_matches': (binary_match, _column_binary_match),
+}
+
+
+# Weak pairwise uses which take a cap, e.g. 'levenshtein:10'. See CappedComparator
+CAPPED_COMPARATORS = ('levenshtein',)
+
+
+class CappedComparator(object):
+    """
+    Comparator called with a cap on the distance, for pairwise uses of the form '<pairwise use>:<cap>'. Comparable, so
+    feature descriptors of the same header are equal
+    """
+    def __init__(self, comparator, cap):
+        """
+        :param comparator: Function handle comparator(..., cap), e.g. levenshtein or _column_levenshtein
+        :param cap: Int
+        """
+        self.comparator = comparator
+        self.cap = cap
+
+    def __call__(self, *args):
+        return self.comparator(*(args + (self.cap,)))
+
+    def __eq__(self, other):
+        return isinstance(other, CappedComparator) and self.__dict__ == other.__dict__
+
+    def __ne__(self, other):
+        return not self == other
+
+
+def _weak_comparators(pairwise_use):
+    """
+    :param pairwise_use: String, a key of WEAK_COMPARATORS, or '<key>:<cap>' for the keys in CAPPED_COMPARATORS
+    :return comparators: Tuple (comparator, transform, column comparator, column transform)
+    """
+    name, _, cap = pairwise_use.partition(':')
+    if name not in WEAK_COMPARATORS or (cap and name not in CAPPED_COMPARATORS):
+        raise Exception('Invalid pairwise use: ' + pairwise_use)
+    comparator, transform, column_comparator, column_transform = WEAK_COMPARATORS[name]
+    if cap:
+        if not cap.isdigit() or not int(cap):
+            raise Exception('Invalid pairwise use: ' + pairwise_use)
+        comparator = CappedComparator(comparator, int(cap))
+        column_comparator = CappedComparator(column_comparator, int(cap))
+    return comparator, transform, column_comparator, column_transform
+
+
+def compile_comparison_plan(strengths, pairwise_uses):
+    """
+    Resolves the comparator of every strong and weak feature once, instead of for every pair. Used by FeatureDescriptor
+    :param strengths: List of feature strengths, 'strong', 'weak' or anything else (unused)
+    :param pairwise_uses: List of pairwise uses, see WEAK_COMPARATORS (and CAPPED_COMPARATORS) and STRONG_COMPARATORS
+    :return weak_plan: List of (feature index, output column, comparator, transform, column comparator, column transform),
+                       in feature order. Transforms may be None
+    :return strong_plan: List of (feature index, comparator, column comparator), in feature order
+    """
+    weak_plan = list()
+    strong_plan = list()
+    for index, (strength, pairwise_use) in enumerate(izip(strengths, pairwise_uses)):
+        if strength == 'weak':
+            weak_plan.append((index, len(weak_plan)) + _weak_comparators(pairwise_use))
+        elif strength == 'strong':
+            if pairwise_use not in STRONG_COMPARATORS:
+                raise Exception('Invalid pairwise use for strong features: ' + pairwise_use)
+            strong_plan.append((index,) + STRONG_COMPARATORS[pairwise_use])
+    return weak_plan, strong_plan
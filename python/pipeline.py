@@ -7,7 +7,6 @@ from blocking import BlockingScheme
 from pairwise_features import generate_pair_seed
 from metrics import Metrics
 from new_metrics import NewMetrics, count_pairwise_class_balance
-from copy import deepcopy
 import numpy as np
 import cProfile
 import matplotlib.pyplot as plt
@@ -23,6 +22,7 @@ def main():
     decision_threshold = 0.7
     train_class_balance = 0.5
     max_block_size = 1000
+    comparison_budget = None  # if set, overrides max_block_size with the largest cutoff fitting this many comparisons
     cores = 2
     if data_type == 'synthetic':
         database_train = SyntheticDatabase(100, 10, 10)
@@ -59,9 +59,12 @@ def main():
         #database_test = Database('../data/trafficking/cluster_subsample2_10000.csv', header_path='../data/trafficking/cluster_subsample_header_annotations.csv')
 
         # Uncomment to only use LM features
-        database_train = Database('../data/trafficking/cluster_subsample0_10000.csv', header_path='../data/trafficking/cluster_subsample_header_LM.csv')
-        database_validation = Database('../data/trafficking/cluster_subsample1_10000.csv', header_path='../data/trafficking/cluster_subsample_header_LM.csv')
-        database_test = Database('../data/trafficking/cluster_subsample2_10000.csv', header_path='../data/trafficking/cluster_subsample_header_LM.csv')
+        database_train = Database('../data/trafficking/cluster_subsample0_10000.csv', header_path='../data/trafficking/cluster_subsample_header_LM.csv',
+                                  snapshot_dir='../data/trafficking/snapshots')
+        database_validation = Database('../data/trafficking/cluster_subsample1_10000.csv', header_path='../data/trafficking/cluster_subsample_header_LM.csv',
+                                       snapshot_dir='../data/trafficking/snapshots')
+        database_test = Database('../data/trafficking/cluster_subsample2_10000.csv', header_path='../data/trafficking/cluster_subsample_header_LM.csv',
+                                 snapshot_dir='../data/trafficking/snapshots')
 
         labels_train = fast_strong_cluster(database_train)
         labels_validation = fast_strong_cluster(database_validation)
@@ -70,8 +73,10 @@ def main():
     else:
         Exception('Invalid experiment type'+data_type)
 
-    entities = deepcopy(database_test)
-    blocking_scheme = BlockingScheme(entities, max_block_size, single_block=single_block)
+    entities = database_test.fork()
+    blocking_scheme = BlockingScheme(entities, max_block_size, single_block=single_block,
+                                     comparison_budget=comparison_budget)
+    blocking_scheme.statistics(labels_test).display()
 
     train_seed = generate_pair_seed(database_train, labels_train, train_class_balance, require_direct_match=True, max_minor_class=5000)
     validation_seed = generate_pair_seed(database_validation, labels_validation, 0.5, require_direct_match=True, max_minor_class=5000)
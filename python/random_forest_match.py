@@ -4,8 +4,9 @@ Satisfies ICAR properties
 """
 from sklearn.ensemble import RandomForestClassifier
 import numpy as np
+from itertools import izip
 from roc import RocCurve
-from pairwise_features import get_weak_pairwise_features, get_pairwise_features, generate_pair_seed
+from pairwise_features import get_match_features, get_pairwise_features, generate_pair_seed
 __author__ = 'mbarnes1'
 
 
@@ -97,18 +98,19 @@ class ForestMatchFunction(object):
             #database_test.records[pair[1]].display(indent='     ')
         return roc
 
-    def match(self, r1, r2):
+    def match(self, r1, r2, precomputed_x2=None):
         """
         Determines if two records match
         :param r1: Record object
         :param r2: Record object
+        :param precomputed_x2: PairwiseFeatureStore object of precomputed weak features, or None
         :return x1_hat: False or True, whether r1 and r2 match
         :return p_x1: Probability of weak match
         """
         # x1 = get_x1(r1, r2)
         # if np.isnan(x1):
         #     x1 = False
-        x = get_weak_pairwise_features(r1, r2)
+        x = get_match_features([r1], [r2], precomputed_x2)[0]
         np.copyto(x, self._x_mean, where=np.isnan(x))  # mean imputation
         prob = self._classifier.predict_proba(x)[0, 1]
         match = prob >= self._decision_threshold
@@ -116,24 +118,21 @@ class ForestMatchFunction(object):
             match = True  # if records are the same, to satisfy Idempotence property
         return match, prob
 
-    def batch_match(self, records):
+    def batch_match(self, records, precomputed_x2=None):
         """
         Batch mode of match
         :param records: List of pairs of records
+        :param precomputed_x2: PairwiseFeatureStore object of precomputed weak features, or None
         :return match: List of booleans, whether the corresponding record tuple matches
         :return prob: Probability of weak match
         """
         n = len(records)
         if n == 0:
             return [], []
-        m = records[0][0].feature_descriptor.number_weak
-        X = np.empty([n, m])
-        idempotence = list()
-        for i, pair in enumerate(records):
-            r1 = pair[0]
-            r2 = pair[1]
-            idempotence.append(r1 == r2)
-            X[i, :] = get_weak_pairwise_features(r1, r2)
+        records_1 = [pair[0] for pair in records]
+        records_2 = [pair[1] for pair in records]
+        idempotence = [r1 == r2 for r1, r2 in izip(records_1, records_2)]
+        X = get_match_features(records_1, records_2, precomputed_x2)
         np.copyto(X, self._x_mean, where=np.isnan(X))
         prob = self._classifier.predict_proba(X)[:, 1]
         match = list(prob >= self._decision_threshold) or idempotence
@@ -1,12 +1,19 @@
 # This is the main utilities file for Traffic Jam
 import datetime
+import numpy as np
 from itertools import izip  # Uses iterator instead of list (less memory)
+from pairwise_features import compile_comparison_plan
 
 
 class Record(object):
     """
     This object represents a single ad or entity.
+    Records are identified by their line indices: two records are equal if they contain the same ads, and the hash is
+    the hash of the line indices. Merging changes both, so records must not be merged while in a set or dictionary.
+    Equality does not compare features, use same_features (or same_record_features for whole databases) for that.
     """
+    __slots__ = ('feature_descriptor', 'features', 'line_indices')  # no per-instance __dict__
+
     def __init__(self, line_index=0, feature_descriptor=None):
         """
         :param line_index: Unique ad number for identification
@@ -27,6 +34,25 @@ class Record(object):
             feature1.update(feature2)
         self.line_indices.update(r2.line_indices)
 
+    def copy(self):
+        """
+        Copies the record, with new feature and line index sets (the feature descriptor is shared)
+        :return r: Record object
+        """
+        r = Record.__new__(Record)
+        r.feature_descriptor = self.feature_descriptor
+        r.features = [set(feature) for feature in self.features]
+        r.line_indices = set(self.line_indices)
+        return r
+
+    def same_features(self, other):
+        """
+        Whether the two records contain the same ads, with the same features. Stricter than ==, which only compares ads
+        :param other: Record object
+        :return same: Boolean
+        """
+        return self.line_indices == other.line_indices and self.features == other.features
+
     def initialize_from_annotation(self, features):
         """
         Populates record fields from a single line in a csv file, where commas are used to separate different types of
@@ -38,33 +64,27 @@ class Record(object):
             raise Exception('Feature dimension mismatch')
         if len(self.features) != len(self.feature_descriptor.types):
             raise Exception('Feature dimension mismatch')
-        index = 0
-        for feature, feature_type in izip(features, self.feature_descriptor.types):
-            sub_features = feature.split(';')
-            for f in sub_features:
-                if (f != '') & (f != 'none') & (f != 'NULL'):
-                    if feature_type == 'string':
-                        self.features[index].add(f)
-                    elif feature_type == 'int':
-                        self.features[index].add(int(float(f)))
-                    elif feature_type == 'float':
-                        self.features[index].add(float(f))
-                    elif feature_type == 'date':
-                        self.features[index].add(get_date(f))
-            index += 1
+        error = None
+        for feature_set, feature, converter in izip(self.features, features, self.feature_descriptor.converters):
+            try:
+                feature_set.update(convert_subfeatures(feature, converter))
+            except ValueError as e:  # leave this feature empty, but still parse the others
+                error = e
+        if error:
+            raise error
 
     def get_features(self, filter_strength):
         """
         Returns all the features from a record of specified strength
         :param record: Record object
         :param filter_strength: Strength of feature to return, either 'weak' or 'strong'
-        :return features: Set of all the requested features as strings of form 'feature_name + _ + feature'
+        :return features: Set of all the requested features as tuples (feature index, subfeature). Cheaper to build and
+                          hash than concatenated name strings
         """
         features = set()
-        for feature, name, strength in izip(self.features, self.feature_descriptor.names, self.feature_descriptor.strengths):
+        for index, (feature, strength) in enumerate(izip(self.features, self.feature_descriptor.strengths)):
             if strength == filter_strength:
-                for subfeature in feature:
-                    features.add(name + '_' + str(subfeature))
+                features.update((index, subfeature) for subfeature in feature)
         return features
 
     def display(self, indent=''):
@@ -80,12 +100,45 @@ class Record(object):
                 print indent, feature
 
     def __eq__(self, other):
-        return self.__dict__ == other.__dict__
+        if not isinstance(other, Record):
+            return NotImplemented
+        return self is other or self.line_indices == other.line_indices
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __hash__(self):
+        return hash(frozenset(self.line_indices))
+
+    def __getstate__(self):
+        return self.feature_descriptor, self.features, self.line_indices
+
+    def __setstate__(self, state):
+        self.feature_descriptor, self.features, self.line_indices = state
+
+
+def same_record_features(records_1, records_2):
+    """
+    Feature level comparison of two sets of records, see Record.same_features
+    :param records_1: Dictionary-like [record id, Record object]
+    :param records_2: Dictionary-like [record id, Record object]
+    :return same: Boolean, whether both have the same record ids, and each record has the same ads and features
+    """
+    if len(records_1) != len(records_2):
+        return False
+    records_2 = dict(records_2.iteritems())  # read without copying (see OverlayRecords)
+    for record_id, record in records_1.iteritems():
+        if record_id not in records_2 or not record.same_features(records_2[record_id]):
+            return False
+    return True
 
 
 class FeatureDescriptor(object):
     """
     This object contains descriptions of features
+    The comparators of the strong and weak features are resolved once, when the header is loaded, into weak_plan and
+    strong_plan (see pairwise_features.compile_comparison_plan). Invalid pairwise uses raise an exception here
     """
     def __init__(self, names, types, strengths, blocking, pairwise_uses):
         self.names = names
@@ -96,10 +149,116 @@ class FeatureDescriptor(object):
         self.number_weak = sum([x == 'weak' for x in strengths])
         self.number_strong = sum([x == 'strong' for x in strengths])
         self.number = len(names)
+        self.converters = [CONVERTERS.get(feature_type) for feature_type in types]
+        self.weak_plan, self.strong_plan = compile_comparison_plan(strengths, pairwise_uses)
 
     def __eq__(self, other):
         return self.__dict__ == other.__dict__
 
+    def __ne__(self, other):
+        return not self == other
+
+
+def convert_subfeatures(feature, converter):
+    """
+    Splits a single annotation field into its subfeatures (separated by semicolons) and converts each one
+    Empty, 'none' and 'NULL' subfeatures are skipped, as are all subfeatures without a converter (unknown type)
+    :param feature: String, a single comma separated field from the annotation file
+    :param converter: Function handle from CONVERTERS, or None
+    :return subfeatures: List of converted subfeatures
+    """
+    if converter is None:
+        return []
+    return [converter(f) for f in split_subfeatures(feature)]
+
+
+def split_subfeatures(feature):
+    """
+    Splits a single annotation field into its non-empty subfeature strings
+    :param feature: String, a single comma separated field from the annotation file
+    :return subfeatures: List of strings
+    """
+    return [f for f in feature.split(';') if (f != '') & (f != 'none') & (f != 'NULL')]
+
+
+def convert_column(subfeatures, feature_type):
+    """
+    Batch mode of convert_subfeatures. Converts the subfeature strings of a whole column at once
+    :param subfeatures: List of subfeature strings
+    :param feature_type: String, 'string', 'int', 'float' or 'date'
+    :return values: 1D numpy array. int64 for 'int' and 'date' (seconds since the epoch), float64 for 'float', object
+                    otherwise
+    """
+    if feature_type == 'int':
+        return np.array(subfeatures, dtype=np.float64).astype(np.int64)
+    elif feature_type == 'float':
+        return np.array(subfeatures, dtype=np.float64)
+    elif feature_type == 'date':
+        return convert_dates(subfeatures)
+    elif feature_type == 'string':
+        values = np.empty(len(subfeatures), dtype=object)
+        values[:] = subfeatures
+        return values
+    return np.empty(0, dtype=object)
+
+
+def convert_dates(dates):
+    """
+    Batch mode of get_epoch_seconds. Parses all the digits at once, without creating a datetime object per date
+    :param dates: List of strings in format '2014-01-30 02:41:11'
+    :return seconds: 1D int64 numpy array, seconds since the epoch
+    """
+    if not len(dates):
+        return np.zeros(0, dtype=np.int64)
+    digits = np.array(dates, dtype='S19').view(np.uint8).reshape(-1, 19).astype(np.int64) - ord('0')
+    digits = digits[:, [0, 1, 2, 3, 5, 6, 8, 9, 11, 12, 14, 15, 17, 18]]
+    if (digits < 0).any() or (digits > 9).any():
+        raise ValueError('Invalid date')
+    fields = digits[:, 0::2]*10 + digits[:, 1::2]
+    y = fields[:, 0]*100 + fields[:, 1]
+    mo, d, h, mi, s = fields[:, 2], fields[:, 3], fields[:, 4], fields[:, 5], fields[:, 6]
+    if ((mo < 1) | (mo > 12) | (d < 1) | (d > 31) | (h > 23) | (mi > 59) | (s > 60)).any():
+        raise ValueError('Invalid date')
+    return _days_from_civil(y, mo, d)*86400 + h*3600 + mi*60 + s
+
+
+def get_epoch_seconds(date):
+    """
+    Gets seconds since the epoch from string annotation
+    :param date: String in format '2014-01-30 02:41:11'
+    :return seconds: Int, seconds since 1970-01-01 00:00:00, with no timezone conversion
+    """
+    y = int(date[0:4])
+    mo = int(date[5:7])
+    d = int(date[8:10])
+    h = int(date[11:13])
+    mi = int(date[14:16])
+    s = int(date[17:19])
+    if not (1 <= mo <= 12 and 1 <= d <= 31 and 0 <= h <= 23 and 0 <= mi <= 59 and 0 <= s <= 60):
+        raise ValueError('Invalid date: ' + date)
+    return int(_days_from_civil(y, mo, d))*86400 + h*3600 + mi*60 + s
+
+
+def format_epoch_seconds(seconds):
+    """
+    Inverse of get_epoch_seconds
+    :param seconds: Int, seconds since the epoch
+    :return date: String in format '2014-01-30 02:41:11'
+    """
+    return (_EPOCH + datetime.timedelta(seconds=int(seconds))).isoformat(' ')
+
+
+def _days_from_civil(y, m, d):
+    """
+    Days since 1970-01-01 of a proleptic Gregorian date (H. Hinnant). Works on ints and on numpy int arrays
+    """
+    y = y - (m <= 2)
+    era = y // 400
+    yoe = y - era*400
+    doy = (153*(m + 12*(m <= 2) - 3) + 2)//5 + d - 1
+    doe = yoe*365 + yoe//4 - yoe//100 + doy
+    return era*146097 + doe - 719468
+
 
 def get_date(date):
     """
@@ -116,3 +275,17 @@ def get_date(date):
     time = datetime.datetime(y, mo, d, h, mi, s)
     return time
 
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def _to_int(f):
+    return int(float(f))
+
+
+CONVERTERS = {
+    'string': str,
+    'int': _to_int,
+    'float': float,
+    'date': get_epoch_seconds,
+}
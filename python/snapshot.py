@@ -0,0 +1,104 @@
+"""
+Binary snapshots of parsed databases, so unchanged annotation files are not reparsed on every run.
+A snapshot is a directory of .npy files, which are memory-mapped on load:
+    header.csv                        The five header rows (names, types, strengths, blocking, pairwise uses)
+    ids.npy                           int32 record identifiers
+    offsets_<i>.npy                   int64 CSR offsets of feature i
+    values_<i>.npy                    Values of feature i. String features are int32 codes into their vocabulary
+    strings.npy, string_offsets.npy   The vocabularies of all string features, as one uint8 byte buffer with int64
+                                      offsets
+    vocabulary_offsets.npy            int64 range of each feature's vocabulary in the string table (empty if numeric)
+"""
+import os
+import hashlib
+import numpy as np
+from record import FeatureDescriptor
+from columnar import FeatureColumn, ColumnarStore
+from ingest import annotation_paths
+__author__ = 'mbarnes1'
+
+SNAPSHOT_VERSION = '3'
+
+
+def snapshot_key(annotation_path, header_path=None, max_records=np.Inf):
+    """
+    Content hash identifying a parsed database, used as the snapshot directory name
+    :param annotation_path: String, path to annotation file, or list of paths or glob pattern of annotation files
+    :param header_path: String, path to header info (if not included in the annotations file)
+    :param max_records: Int, number of records loaded from the annotation file(s)
+    :return key: String, hex digest
+    """
+    sha = hashlib.sha1()
+    sha.update(SNAPSHOT_VERSION + ',' + str(max_records))
+    for path in annotation_paths(annotation_path) + [header_path]:
+        sha.update('|')
+        if path:
+            ins = open(path, 'rb')
+            for block in iter(lambda: ins.read(2**20), ''):
+                sha.update(block)
+            ins.close()
+    return sha.hexdigest()
+
+
+def save_store(store, path):
+    """
+    Writes a ColumnarStore to a snapshot directory. Writes to a temporary directory first, so a partially written
+    snapshot is never loaded.
+    :param store: ColumnarStore object
+    :param path: String, snapshot directory to create
+    """
+    temporary_path = path + '.tmp' + str(os.getpid())
+    os.makedirs(temporary_path)
+    feature_descriptor = store.feature_descriptor
+    header = open(os.path.join(temporary_path, 'header.csv'), 'w')
+    header.write(','.join(feature_descriptor.names)+'\n')
+    header.write(','.join(feature_descriptor.types)+'\n')
+    header.write(','.join(feature_descriptor.strengths)+'\n')
+    header.write(','.join(feature_descriptor.blocking)+'\n')
+    header.write(','.join(feature_descriptor.pairwise_uses)+'\n')
+    header.close()
+    np.save(os.path.join(temporary_path, 'ids.npy'), store.ids)
+    strings = list()
+    vocabulary_offsets = [0]
+    for index, column in enumerate(store.columns):
+        if column.vocabulary is not None:
+            strings.extend(column.vocabulary)
+        vocabulary_offsets.append(len(strings))
+        np.save(os.path.join(temporary_path, 'offsets_' + str(index) + '.npy'), column.offsets)
+        np.save(os.path.join(temporary_path, 'values_' + str(index) + '.npy'), column.values)
+    np.save(os.path.join(temporary_path, 'vocabulary_offsets.npy'), np.array(vocabulary_offsets, dtype=np.int64))
+    string_offsets = np.zeros(len(strings)+1, dtype=np.int64)
+    np.cumsum([len(s) for s in strings], out=string_offsets[1:])
+    np.save(os.path.join(temporary_path, 'strings.npy'), np.frombuffer(''.join(strings), dtype=np.uint8))
+    np.save(os.path.join(temporary_path, 'string_offsets.npy'), string_offsets)
+    os.rename(temporary_path, path)
+
+
+def load_store(path, mmap=True):
+    """
+    Reads a ColumnarStore from a snapshot directory
+    :param path: String, snapshot directory
+    :param mmap: Boolean, whether to memory-map the numeric arrays instead of reading them into memory
+    :return store: ColumnarStore object
+    """
+    mmap_mode = 'r' if mmap else None
+    header = open(os.path.join(path, 'header.csv'), 'r')
+    names, types, strengths, blocking, pairwise_uses = [header.readline().strip('\n').split(',') for _ in range(5)]
+    header.close()
+    feature_descriptor = FeatureDescriptor(names, types, strengths, blocking, pairwise_uses)
+    ids = np.load(os.path.join(path, 'ids.npy'), mmap_mode=mmap_mode)
+    buffer_ = np.load(os.path.join(path, 'strings.npy')).tostring()
+    string_offsets = np.load(os.path.join(path, 'string_offsets.npy'))
+    vocabulary_offsets = np.load(os.path.join(path, 'vocabulary_offsets.npy'))
+    strings = np.empty(len(string_offsets)-1, dtype=object)
+    for code, (begin, end) in enumerate(zip(string_offsets[:-1], string_offsets[1:])):
+        strings[code] = buffer_[begin:end]
+    columns = list()
+    for index, feature_type in enumerate(types):
+        offsets = np.load(os.path.join(path, 'offsets_' + str(index) + '.npy'), mmap_mode=mmap_mode)
+        values = np.load(os.path.join(path, 'values_' + str(index) + '.npy'), mmap_mode=mmap_mode)
+        vocabulary = None
+        if feature_type not in ('int', 'float', 'date'):
+            vocabulary = strings[vocabulary_offsets[index]:vocabulary_offsets[index+1]]
+        columns.append(FeatureColumn(feature_type, values, offsets, vocabulary))
+    return ColumnarStore(feature_descriptor, ids, columns)
@@ -1,5 +1,7 @@
 import unittest
-from blocking import BlockingScheme
+from blocking import BlockingScheme, distinct_pairs
+from itertools import combinations
+from inverted_index import build_inverted_index
 from database import Database
 import numpy as np
 __author__ = 'mbarnes1'
@@ -29,12 +31,205 @@ class MyTestCase(unittest.TestCase):
         used_ads = get_records(blocks)
         self.assertEqual(used_ads, range(0, len(database.records)))
 
+    def test_columnar(self):
+        database = Database('test_annotations_10000_cleaned.csv', max_records=1000,
+                            header_path='test_annotations_10000_cleaned_header.csv')
+        columnar = Database('test_annotations_10000_cleaned.csv', max_records=1000,
+                            header_path='test_annotations_10000_cleaned_header.csv', storage='columnar')
+        blocks = BlockingScheme(database, max_block_size=200)
+        columnar_blocks = BlockingScheme(columnar, max_block_size=200)
+        self.assertEqual(blocks.strong_blocks, columnar_blocks.strong_blocks)
+        self.assertEqual(blocks.weak_blocks, columnar_blocks.weak_blocks)
+        labels = dict((record_id, record_id % 300) for record_id in range(1000))
+        database.merge(labels)
+        columnar.merge(labels)
+        blocks = BlockingScheme(database, max_block_size=200)
+        columnar_blocks = BlockingScheme(columnar, max_block_size=200)
+        self.assertEqual(blocks.strong_blocks, columnar_blocks.strong_blocks)
+        self.assertEqual(blocks.weak_blocks, columnar_blocks.weak_blocks)
+
     def test_single_block(self):
         blocks = BlockingScheme(self._database, single_block=True)
         self.assertEqual(len(blocks.strong_blocks), 0)
         self.assertEqual(len(blocks.weak_blocks), 1)
         self.assertEqual(blocks.weak_blocks['All'], {0, 1, 2, 3})
 
+    def test_parallel_index(self):
+        database = Database('test_annotations_10000_cleaned.csv', max_records=2000,
+                            header_path='test_annotations_10000_cleaned_header.csv')
+        to_block = [(0, 'block', 'block'), (1, 'block', 'block'), (4, 'token', 'token'), (8, 'block', 'block+1')]
+        index = build_inverted_index(database.records, to_block)
+        parallel_index = build_inverted_index(database.records, to_block, cores=3, shard_size=300)
+        self.assertEqual(sorted(index.keys), sorted(parallel_index.keys))
+        for k, key in enumerate(index.keys):
+            np.testing.assert_array_equal(index.block(k), parallel_index.block(parallel_index.keys.index(key)))
+        blocks = BlockingScheme(database, max_block_size=5)
+        parallel_blocks = BlockingScheme(database, max_block_size=5, cores=3)
+        self.assertEqual(blocks.strong_blocks, parallel_blocks.strong_blocks)
+        self.assertEqual(blocks.weak_blocks, parallel_blocks.weak_blocks)
+        singletons = [ads for name, ads in blocks.weak_blocks.iteritems() if name.startswith('singular_ad_')]
+        self.assertTrue(singletons)
+        sizes = blocks.index.sizes()
+        for ads in singletons:
+            (ad,) = ads
+            self.assertTrue(all(sizes[k] > 5 for k in range(len(blocks.index)) if ad in blocks.index.block(k)))
+
+    def test_key_transforms(self):
+        database = Database('test_annotations_10000_cleaned.csv', max_records=2000,
+                            header_path='test_annotations_10000_cleaned_header.csv')
+        columnar = Database('test_annotations_10000_cleaned.csv', max_records=2000,
+                            header_path='test_annotations_10000_cleaned_header.csv', storage='columnar')
+        for db in [database, columnar]:
+            db.feature_descriptor.blocking[4] = 'prefix:3;soundex'  # City
+            db.feature_descriptor.blocking[7] = 'noblock'  # Name
+        blocks = BlockingScheme(database, offset_blocking=True)
+        columnar_blocks = BlockingScheme(columnar, offset_blocking=True)
+        self.assertEqual(blocks.weak_blocks, columnar_blocks.weak_blocks)
+        city_ads = set(record_id for record_id, record in database.records.iteritems()
+                       if any(city.lower().startswith('new') for city in record.features[4]))
+        self.assertEqual(blocks.weak_blocks['City_prefix:3_new'], city_ads)
+        self.assertTrue(any(name.startswith('City_soundex_') for name in blocks.weak_blocks))
+        self.assertFalse(any(name.startswith('Name_') for name in blocks.weak_blocks))
+        ages = [(record_id, age) for record_id, record in database.records.iteritems() for age in record.features[8]]
+        self.assertEqual(blocks.weak_blocks['Age_23'], set(record_id for record_id, age in ages if age in (22, 23)))
+        database.feature_descriptor.blocking[4] = 'prefix:x'
+        self.assertRaises(Exception, BlockingScheme, database)
+
+    def test_offset_blocking(self):
+        database = Database('test_annotations_10000_cleaned.csv', max_records=2000,
+                            header_path='test_annotations_10000_cleaned_header.csv')
+        blocks = BlockingScheme(database, max_block_size=200)  # 'block;block+1' cells of Age and Height are not blocked
+        offset_blocks = BlockingScheme(database, max_block_size=200, offset_blocking=True)
+        self.assertEqual(blocks.strong_blocks, offset_blocks.strong_blocks)
+        self.assertEqual((len(blocks.weak_blocks), len(offset_blocks.weak_blocks)), (11734, 11798))
+        for blocking_scheme, number_blocks in [(blocks, (0, 0)), (offset_blocks, (43, 21))]:
+            self.assertEqual((sum(name.startswith('Age_') for name in blocking_scheme.weak_blocks),
+                              sum(name.startswith('Height_total_in_') for name in blocking_scheme.weak_blocks)),
+                             number_blocks)
+
+    def test_sorted_neighborhood(self):
+        database = Database('test_annotations_10000_cleaned.csv', max_records=2000,
+                            header_path='test_annotations_10000_cleaned_header.csv', storage='columnar')
+        database.feature_descriptor.blocking = ['noblock']*database.feature_descriptor.number
+        database.feature_descriptor.blocking[7] = 'sorted:normalize'  # Name
+        database.feature_descriptor.blocking[8] = 'sorted'  # Age, second pass
+        blocks = BlockingScheme(database, max_block_size=10, window=4)
+        windows = [(name, ads) for name, ads in blocks.weak_blocks.iteritems() if not name.startswith('singular_ad_')]
+        self.assertTrue(all(name.startswith('Name_sorted:normalize_') or name.startswith('Age_sorted_')
+                            for name, _ in windows))
+        self.assertTrue(all(len(ads) == 2 for _, ads in windows))
+        ages = sorted((age, record_id) for record_id, record in database.records.iteritems()
+                      for age in record.features[8])
+        age_pairs = set(frozenset(ads) for name, ads in windows if name.startswith('Age_sorted_'))
+        expected = set(frozenset((ad1, ad2)) for offset in range(1, 4)  # less than 4 positions apart
+                       for (_, ad1), (_, ad2) in zip(ages[:-offset], ages[offset:]) if ad1 != ad2)
+        self.assertEqual(age_pairs, expected)
+        self.assertEqual(get_records(blocks), range(0, 2000))
+        self.assertRaises(Exception, BlockingScheme, database, window=1)
+
+    def test_minhash(self):
+        database = Database('test_annotations_10000_cleaned.csv', max_records=2000,
+                            header_path='test_annotations_10000_cleaned_header.csv')
+        columnar = Database('test_annotations_10000_cleaned.csv', max_records=2000,
+                            header_path='test_annotations_10000_cleaned_header.csv', storage='columnar')
+        for db in [database, columnar]:
+            db.feature_descriptor.blocking = ['noblock']*db.feature_descriptor.number
+            db.feature_descriptor.blocking[4] = 'minhash:0.5:2'  # City
+        blocks = BlockingScheme(database)
+        self.assertEqual(blocks.weak_blocks, BlockingScheme(columnar).weak_blocks)
+        cities = dict()
+        for record_id, record in database.records.iteritems():
+            for city in record.features[4]:
+                cities.setdefault(city, set()).add(record_id)
+        for ads in cities.values():  # records with the same city share all 25 bands
+            self.assertTrue(sum(ads <= block for block in blocks.weak_blocks.values()) >= 25)
+
+    def test_canopy(self):
+        database = Database('test_annotations_10000_cleaned.csv', max_records=2000,
+                            header_path='test_annotations_10000_cleaned_header.csv', storage='columnar')
+        database.feature_descriptor.blocking = ['noblock']*database.feature_descriptor.number
+        database.feature_descriptor.blocking[4] = 'canopy:0.5:0.2'  # City
+        database.feature_descriptor.blocking[8] = 'canopy:3:1'  # Age
+        blocks = BlockingScheme(database, max_block_size=10)
+        canopies = [(name, ads) for name, ads in blocks.weak_blocks.iteritems() if not name.startswith('singular_ad_')]
+        self.assertTrue(all(name.startswith('City_canopy:0.5:0.2_') or name.startswith('Age_canopy:3:1_')
+                            for name, _ in canopies))
+        self.assertTrue(any(len(ads) > 10 for _, ads in canopies))  # not cut by max_block_size
+        ages = dict((record_id, record.features[8]) for record_id, record in database.records.iteritems())
+        for name, ads in canopies:  # every record has an age within 3 of the canopy center
+            if name.startswith('Age_'):
+                values = set.union(*[set(ages[ad]) for ad in ads])
+                self.assertTrue(any(all(any(abs(age - center) <= 3 for age in ages[ad]) for ad in ads)
+                                    for center in values))
+        for record_id, age in ages.iteritems():  # records with the same age share a canopy
+            for other_id, other_age in ages.items()[:50]:
+                if age & other_age:
+                    self.assertTrue(any(record_id in ads and other_id in ads for _, ads in canopies))
+        self.assertEqual(get_records(blocks), range(0, 2000))
+        database.feature_descriptor.blocking[8] = 'canopy:1:3'
+        self.assertRaises(Exception, BlockingScheme, database)
+
+    def test_split_oversized(self):
+        database = Database('test_annotations_10000_cleaned.csv', max_records=2000,
+                            header_path='test_annotations_10000_cleaned_header.csv')
+        blocks = BlockingScheme(database, max_block_size=20)
+        split = BlockingScheme(database, max_block_size=20, split_oversized=True)
+        self.assertTrue(all(len(ads) <= 20 for ads in split.blocks()))
+        sub_blocks = [name for name in split.weak_blocks.keys() + split.strong_blocks.keys() if '&' in name]
+        self.assertTrue(sub_blocks)
+        pairs = set(map(tuple, blocks.candidate_pairs().tolist()))
+        split_pairs = set(map(tuple, split.candidate_pairs().tolist()))
+        self.assertTrue(pairs < split_pairs)
+        self.assertEqual(get_records(split), range(0, 2000))
+        index = split.index
+        names = dict((split._block_name(database.feature_descriptor, k), k) for k in range(len(index)))
+        for name in sub_blocks[:100]:  # the records of a sub-block have all of its keys
+            ads = split.weak_blocks.get(name, split.strong_blocks.get(name))
+            key_name = ''
+            for part in name.split('&'):  # keys may contain '&' too
+                key_name = key_name + '&' + part if key_name else part
+                if key_name in names:
+                    self.assertTrue(ads <= set(index.block(names[key_name]).tolist()))
+                    key_name = ''
+            self.assertEqual(key_name, '')
+
+    def test_candidate_pairs(self):
+        database = Database('test_annotations_10000_cleaned.csv', max_records=1000,
+                            header_path='test_annotations_10000_cleaned_header.csv')
+        blocks = BlockingScheme(database, max_block_size=100)
+        pairs = blocks.candidate_pairs()
+        expected = set()
+        for ads in blocks.blocks():
+            expected.update(combinations(sorted(ads), 2))
+        self.assertEqual(pairs.dtype, np.int64)
+        self.assertEqual(len(pairs), len(expected))
+        self.assertEqual(set(map(tuple, pairs.tolist())), expected)
+        self.assertEqual(pairs.tolist(), sorted(pairs.tolist()))
+        self.assertEqual(distinct_pairs([{1}, set()]).shape, (0, 2))
+
+    def test_meta_blocking(self):
+        database = Database('test_annotations_10000_cleaned.csv', max_records=2000,
+                            header_path='test_annotations_10000_cleaned_header.csv')
+        blocks = BlockingScheme(database, max_block_size=200)
+        record_blocks = dict()  # [record id, set of weak block names]
+        for name, ads in blocks.weak_blocks.iteritems():
+            if not name.startswith('singular_ad_'):
+                for ad in ads:
+                    record_blocks.setdefault(ad, set()).add(name)
+        for pruning in ['WNP', 'CNP']:
+            for weighting in ['CBS', 'JS', 'ECBS']:
+                meta = BlockingScheme(database, max_block_size=200, meta_blocking=pruning, weighting=weighting)
+                self.assertEqual(meta.strong_blocks, blocks.strong_blocks)
+                self.assertEqual(get_records(meta), sorted(database.records.keys()))
+                pairs = [ads for name, ads in meta.weak_blocks.iteritems() if name.startswith('pair_')]
+                self.assertTrue(pairs)
+                self.assertTrue(all(len(ads) == 2 for ads in pairs))
+                for ads in pairs:  # every pair shares a weak block
+                    first, second = ads
+                    self.assertTrue(record_blocks[first] & record_blocks[second])
+        self.assertRaises(Exception, BlockingScheme, database, meta_blocking='XYZ')
+        self.assertRaises(Exception, BlockingScheme, database, meta_blocking='WNP', weighting='XYZ')
+
 
 def get_records(blocks):
     """
@@ -51,5 +246,6 @@ def get_records(blocks):
     used_records.sort()
     return used_records
 
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,73 @@
+import unittest
+import hashlib
+from blocking_keys import parse_blocking, key_function, soundex, metaphone, lsh_bandwidth, minhash_bands, \
+    minhash_signature, NUMBER_PERMUTATIONS
+__author__ = 'mbarnes1'
+
+
+class MyTestCase(unittest.TestCase):
+    def test_parse_blocking(self):
+        self.assertEqual(parse_blocking('block;block+1', 'int'), [('block', 'block'), ('block', 'block+1')])
+        self.assertEqual(parse_blocking('noblock', 'string'), [])
+        self.assertEqual(parse_blocking('', 'string'), [])
+        self.assertEqual(parse_blocking('prefix:4;soundex', 'string'),
+                         [('prefix:4', 'prefix:4'), ('soundex', 'soundex')])
+        self.assertRaises(Exception, parse_blocking, 'block+1', 'string')
+        self.assertRaises(Exception, parse_blocking, 'prefix', 'string')
+        self.assertRaises(Exception, parse_blocking, 'unknown', 'string')
+        self.assertEqual(parse_blocking('sorted;sorted:prefix:3', 'string'),
+                         [('sorted', 'sorted'), ('sorted:prefix:3', 'sorted:prefix:3')])
+        self.assertRaises(Exception, parse_blocking, 'sorted:unknown', 'string')
+
+    def test_key_functions(self):
+        self.assertEqual(key_function('block')('New Orleans'), ['New Orleans'])
+        self.assertEqual(key_function('block-2')(22), [20])
+        self.assertEqual(key_function('prefix:3')('  Hello, World'), ['hel'])
+        self.assertEqual(sorted(key_function('token')('The Grill-House, the')), ['grill', 'house', 'the'])
+        self.assertEqual(key_function('sorted_tokens')('house grill the'),
+                         key_function('sorted_tokens')('The Grill House'))
+        self.assertEqual(key_function('digits')('(800) 555-1111'), ['8005551111'])
+        self.assertEqual(key_function('digits')('none'), [])
+        self.assertEqual(key_function('normalize')('Art\'s  Deli'), ['art s deli'])
+        self.assertEqual(sorted(key_function('soundex')('Robert Ashcraft')), ['A261', 'R163'])
+        self.assertEqual(key_function('metaphone')('Knight'), ['NT'])
+        self.assertEqual(key_function('sorted')(22), [22])
+        self.assertEqual(key_function('sorted:digits')('(800) 555-1111'), ['8005551111'])
+
+    def test_minhash(self):
+        self.assertEqual(lsh_bandwidth(100, 0.5), 4)  # 25 bands, threshold (1/25)**(1/4) = 0.45
+        self.assertEqual(parse_blocking('minhash:0.5', 'string'), [('minhash:0.5', 'minhash:0.5')])
+        for directive in ['minhash', 'minhash:1.5', 'minhash:0.5:0', 'minhash:x']:
+            self.assertRaises(Exception, parse_blocking, directive, 'string')
+        minhash = key_function('minhash:0.5')
+        text = 'the quick brown fox jumps over the lazy dog today'
+        self.assertEqual(len(minhash(text)), 25)
+        self.assertEqual(minhash(text), minhash(text.upper()))
+        self.assertTrue(set(minhash(text)) & set(minhash(text.replace('today', 'yesterday'))))
+        self.assertFalse(set(minhash(text)) & set(minhash('completely different words here and there')))
+        self.assertEqual(minhash(''), [])
+        trigrams = key_function('minhash:0.5:3')
+        self.assertTrue(set(trigrams('New Orleans')) & set(trigrams('New Orlean')))
+        rows = lsh_bandwidth(NUMBER_PERMUTATIONS, 0.3)
+        self.assertEqual(rows, 3)  # 33 full bands, the last row of the signature is not used
+        signature = minhash_signature(text.split())
+        self.assertEqual(minhash_bands(text, rows), [str(band) + '_' + hashlib.sha1(
+            signature[band*rows:(band + 1)*rows].tostring()).hexdigest()[:16] for band in range(33)])
+        self.assertEqual(key_function('minhash:0.3')(text), minhash_bands(text, rows))
+        self.assertEqual(len(key_function('minhash:0.9')(text)), NUMBER_PERMUTATIONS // lsh_bandwidth(100, 0.9))
+
+    def test_soundex(self):
+        for word, code in [('Robert', 'R163'), ('Rupert', 'R163'), ('Ashcraft', 'A261'), ('Tymczak', 'T522'),
+                           ('Pfister', 'P236'), ('Lee', 'L000')]:
+            self.assertEqual(soundex(word), code)
+        self.assertEqual(soundex('123'), None)
+
+    def test_metaphone(self):
+        self.assertEqual(metaphone('Catherine'), metaphone('Kathryn'))
+        self.assertEqual(metaphone('Philip'), metaphone('Fillip'))
+        self.assertEqual(metaphone('Smith'), 'SM0')
+        self.assertEqual(metaphone('judge'), 'JJ')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+from itertools import combinations
+import numpy as np
+from blocking import BlockingScheme
+from blocking_statistics import max_block_size_for_budget
+from database import Database
+__author__ = 'mbarnes1'
+
+
+class MyTestCase(unittest.TestCase):
+    def setUp(self):
+        self._database = Database('test_annotations_10000_cleaned.csv', max_records=500,
+                                  header_path='test_annotations_10000_cleaned_header.csv')
+
+    def test_statistics(self):
+        blocks = BlockingScheme(self._database, max_block_size=50)
+        statistics = blocks.statistics()
+        all_blocks = blocks.strong_blocks.values() + blocks.weak_blocks.values()
+        pairs = set()
+        for ads in all_blocks:
+            pairs.update(combinations(sorted(ads), 2))
+        self.assertEqual(statistics.number_blocks, len(all_blocks))
+        self.assertEqual(statistics.number_records, len(self._database.records))
+        self.assertEqual(statistics.comparisons, sum(len(ads)*(len(ads)-1)/2 for ads in all_blocks))
+        self.assertEqual(statistics.distinct_comparisons, len(pairs))
+        self.assertEqual(sum(statistics.size_histogram.values()), len(all_blocks))
+        self.assertEqual(statistics.largest_blocks[0][1], max(len(ads) for ads in all_blocks))
+        self.assertTrue(all(size > 50 for size in [len(blocks.index.block(blocks.index.keys.index(key)))
+                                                   for key in statistics.dropped_keys]))
+        self.assertIsNone(statistics.pair_completeness)
+
+    def test_quality(self):
+        blocks = BlockingScheme(self._database, max_block_size=50)
+        labels = dict((ad, ad % 7) for ad in self._database.records.keys())
+        statistics = blocks.statistics(labels)
+        true_pairs = set(pair for pair in combinations(sorted(labels), 2) if labels[pair[0]] == labels[pair[1]])
+        found = set()
+        for ads in blocks.strong_blocks.values() + blocks.weak_blocks.values():
+            found.update(pair for pair in combinations(sorted(ads), 2) if pair in true_pairs)
+        self.assertAlmostEqual(statistics.pair_completeness, float(len(found))/len(true_pairs))
+        total = len(labels)*(len(labels)-1)/2.0
+        self.assertAlmostEqual(statistics.reduction_ratio, 1 - statistics.distinct_comparisons/total)
+
+    def test_budget(self):
+        self.assertEqual(max_block_size_for_budget(np.array([1, 2, 2, 3, 10]), 0), 1)
+        self.assertEqual(max_block_size_for_budget(np.array([1, 2, 2, 3, 10]), 4), 2)
+        self.assertEqual(max_block_size_for_budget(np.array([1, 2, 2, 3, 10]), 5), 3)
+        self.assertEqual(max_block_size_for_budget(np.array([1, 2, 2, 3, 10]), 50), 10)
+        for budget in [0, 1000, 10000]:
+            blocks = BlockingScheme(self._database, comparison_budget=budget)
+            statistics = blocks.statistics()
+            self.assertTrue(statistics.comparisons <= budget)
+            self.assertEqual(statistics.number_records, len(self._database.records))
+        unlimited = BlockingScheme(self._database, comparison_budget=10**12)
+        self.assertEqual(unlimited.dropped_keys(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
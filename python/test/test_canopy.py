@@ -0,0 +1,36 @@
+import unittest
+import numpy as np
+from canopy import canopies, tfidf_vectors
+__author__ = 'mbarnes1'
+
+
+class MyTestCase(unittest.TestCase):
+    def test_numeric(self):
+        values = [1, 2, 3, 10, 11, 30]
+        members = canopies(values, 2, 1, True)
+        self.assertEqual(sorted(tuple(canopy.tolist()) for canopy in members if len(canopy) > 1)[-1], (3, 4))
+        for canopy in members:
+            self.assertTrue(max(values[m] for m in canopy) - min(values[m] for m in canopy) <= 4)
+        covered = set(np.concatenate(members).tolist())
+        self.assertEqual(covered, set(range(len(values))))
+        self.assertEqual(len(canopies(values, 100, 100, True)), 1)
+        self.assertEqual(len(canopies(values, 0, 0, True)), len(values))
+
+    def test_text(self):
+        values = ['red shoes', 'Red Shoes!', 'blue shoes', 'green hat', 'the green hat', '']
+        members = [set(canopy.tolist()) for canopy in canopies(values, 0.6, 0.3, False)]
+        self.assertTrue(any({0, 1} <= canopy for canopy in members))
+        self.assertTrue(any({3, 4} <= canopy for canopy in members))
+        self.assertFalse(any({0, 3} <= canopy for canopy in members))
+        self.assertEqual(set.union(*members), set(range(len(values))))
+
+    def test_tfidf(self):
+        indptr, words, weights = tfidf_vectors(['a b', 'b c', ''])
+        self.assertEqual(indptr.tolist(), [0, 2, 4, 4])
+        norms = np.sqrt(np.add.reduceat(weights**2, indptr[:2]))
+        self.assertTrue(np.allclose(norms, 1))
+        self.assertTrue(weights[0] > weights[1])  # 'a' is rarer than 'b'
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,11 @@
 import unittest
 from copy import deepcopy
-from database import SyntheticDatabase, Database, remove_indices, find_in_list
+from database import SyntheticDatabase, Database, zipf_cluster_sizes
+from ingest import remove_indices, find_in_list
 import os
 import numpy as np
+from overlay import OverlayRecords
+from record import same_record_features
 import matplotlib.pyplot as plt
 __author__ = 'mbarnes1'
 
@@ -73,6 +76,33 @@ class MyTestCase(unittest.TestCase):
         self.assertEqual(len(synthetic.database.records), 100)
         synthetic.add(5, 10)
         self.assertEqual(len(synthetic.database.records), 150)
+        self.assertEqual(synthetic.labels[149], 14)
+
+    def test_synthetic_columnar(self):
+        sizes = zipf_cluster_sizes(1000, max_size=50)
+        self.assertTrue(sizes.max() <= 50)
+        synthetic = SyntheticDatabase(1000, sizes, number_features=3, storage='columnar')
+        self.assertEqual(len(synthetic.database.records), sizes.sum())
+        self.assertEqual(sorted(synthetic.labels.values()), list(np.repeat(np.arange(1000), sizes)))
+        sample = synthetic.sample_and_remove(100)
+        synthetic.add(10, [1, 2]*5)
+        self.assertEqual(len(synthetic.database.records), sizes.sum() - 100 + 15)
+        self.assertEqual(len(set(synthetic.labels.keys()) & set(sample.labels.keys())), 0)
+        self.assertEqual(set(synthetic.database.records.keys()), set(synthetic.labels.keys()))
+        self.assertEqual(set(sample.database.records.keys()), set(sample.labels.keys()))
+        self.assertEqual(max(synthetic.labels.values()), 1009)
+
+    def test_synthetic_corrupt(self):
+        for storage in ['dict', 'columnar']:
+            synthetic = SyntheticDatabase(5, 2, storage=storage)
+            original = dict((record_id, record.features)
+                            for record_id, record in synthetic.database.records.iteritems())
+            corruption = np.random.normal(size=[8, 2])
+            synthetic.corrupt(corruption)
+            for corrupt, record_id in zip(corruption, synthetic.database.records.keys()):
+                features = [feature.pop() for feature in synthetic.database.records[record_id].features]
+                np.testing.assert_allclose(features, [feature.pop() for feature in original[record_id]] + corrupt)
+            self.assertEqual(synthetic.database.records[9].features, original[9])
 
     def test_dump(self):
         database = Database(self._test_path)
@@ -115,6 +145,109 @@ class MyTestCase(unittest.TestCase):
         self.assertEqual(database.records[0].line_indices, {0, 2})
         self.assertEqual(database.records[1].line_indices, {1, 3})
 
+    def test_columnar(self):
+        database = Database('test_annotations_10000_cleaned.csv', max_records=1000,
+                            header_path='test_annotations_10000_cleaned_header.csv')
+        columnar = Database('test_annotations_10000_cleaned.csv', max_records=1000,
+                            header_path='test_annotations_10000_cleaned_header.csv', storage='columnar')
+        self.assertEqual(len(columnar.records), 1000)
+        self.assertEqual(sorted(columnar.records.keys()), range(0, 1000))
+        for record_id, record in database.records.iteritems():
+            self.assertEqual(record.features, columnar.records[record_id].features)
+        self.assertEqual(columnar.records.column(0).type, 'int')
+        self.assertEqual(columnar.records.store.ids.dtype, np.int32)
+        strings = columnar.records.column(1)  # dictionary encoded
+        self.assertEqual(strings.values.dtype, np.int32)
+        self.assertEqual(list(strings.vocabulary), sorted(set(strings.vocabulary)))
+        (city0,), (city1,) = columnar.records[0].features[1], columnar.records[1].features[1]
+        if city0 == city1:
+            self.assertTrue(city0 is city1)
+
+    def test_columnar_merge(self):
+        database = Database(self._test_path, storage='columnar')
+        database.merge({0: 'A', 1: 'B', 2: 'A', 3: 'B'})
+        self.assertEqual(len(database.records), 2)
+        self.assertEqual(database.records[0].line_indices, {0, 2})
+        self.assertEqual(database.records[1].line_indices, {1, 3})
+        self.assertFalse(2 in database.records)
+
+    def test_columnar_reads(self):
+        database = Database(self._test_path, storage='columnar')
+        for record_id in database.records.keys():
+            database.records[record_id].features[1].add('not kept')
+        self.assertTrue(database.records.pristine())
+        self.assertFalse('not kept' in database.records[0].features[1])
+        record = database.records[0]
+        record.features[1].add('kept')
+        database.records[0] = record
+        self.assertFalse(database.records.pristine())
+        self.assertTrue('kept' in database.records[0].features[1])
+
+    def test_columnar_sample_and_remove(self):
+        database = Database(self._test_path, storage='columnar')
+        record = database.records[0]
+        record.features[1].add('modified')
+        database.records[0] = record  # explicit write
+        new_database = database.sample_and_remove(2)
+        self.assertEqual(len(database.records), 2)
+        self.assertEqual(len(new_database.records), 2)
+        line_indices = set(database.records.keys()) | set(new_database.records.keys())
+        self.assertEqual(line_indices, {0, 1, 2, 3})
+        records = database.records if 0 in database.records else new_database.records
+        self.assertTrue('modified' in records[0].features[1])
+
+    def test_fork(self):
+        for storage in ['dict', 'columnar']:
+            database = Database(self._test_path, storage=storage)
+            original = deepcopy(database.records)
+            fork = database.fork()
+            self.assertTrue(same_record_features(database.records, original))
+            self.assertTrue(same_record_features(fork.records, original))
+            self.assertEqual(database, fork)
+            fork.merge({0: 0, 1: 0, 2: 2, 3: 2})
+            self.assertEqual(len(fork.records), 2)
+            self.assertEqual(fork.records[0].line_indices, {0, 1})
+            self.assertEqual(database.records[1].features, original[1].features)
+            database.records.pop(3)
+            record = database.records[0]
+            record.features[1].add('modified')
+            database.records[0] = record
+            self.assertEqual(len(database.records), 3)
+            self.assertEqual(fork.records[2].line_indices, {2, 3})
+            self.assertNotEqual(database, fork)
+            self.assertFalse('modified' in fork.records[0].features[1])
+            self.assertEqual(fork.records[0].features, fork.fork().records[0].features)
+
+    def test_repeated_fork(self):
+        database = Database(self._test_path, max_records=4)
+        base = database.records
+        databases = [database]
+        for _ in range(20):
+            databases.append(databases[-1].fork())
+        for record_id in range(4):
+            databases[-1].records[record_id]
+        self.assertEqual([d.records.materialized() for d in databases], [0]*20 + [4])
+        databases[-1].merge({0: 0, 1: 0, 2: 2, 3: 3})
+        forked = databases[-1].fork()
+        self.assertEqual(len(forked.records), 3)
+        self.assertEqual(forked.records.materialized(), 0)
+        self.assertEqual(forked.records[0].line_indices, {0, 1})
+        self.assertEqual(databases[0].records[0].line_indices, {0})
+        self.assertEqual(base[0].line_indices, {0})
+        nested = OverlayRecords(OverlayRecords(base))
+        nested[1]
+        self.assertEqual(nested._base.materialized(), 0)
+
+    def test_synthetic_fork(self):
+        synthetic = SyntheticDatabase(10, 5)
+        fork = synthetic.fork()
+        synthetic.add(5, 5)
+        self.assertEqual(len(fork.database.records), 50)
+        self.assertEqual(len(fork.labels), 50)
+        self.assertEqual(len(synthetic.database.records), 75)
+        fork.corrupt([np.ones(2)]*len(fork.database.records))
+        self.assertNotEqual(fork.database.records[0].features, synthetic.database.records[0].features)
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,60 @@
+import unittest
+import numpy as np
+from blocking import BlockingScheme
+from database import Database
+from dnf_blocking import learn_dnf_blocking, predicate_index, conjunction_index, covered_pairs, comparisons, \
+    candidate_predicates
+from entityresolution import fast_strong_cluster
+from inverted_index import InvertedIndex
+from pairwise_features import generate_pair_seed
+__author__ = 'mbarnes1'
+
+
+class MyTestCase(unittest.TestCase):
+    def setUp(self):
+        self._database = Database('test_annotations_10000_cleaned.csv', max_records=1000,
+                                  header_path='test_annotations_10000_cleaned_header.csv')
+
+    def test_conjunction_index(self):
+        # Predicate 0 keys a: {0, 1, 2}, b: {3}. Predicate 1 keys c: {0, 1}, d: {1, 2, 3}
+        keys = ['a', 'b', 'c', 'd']
+        index = InvertedIndex.from_pairs(keys, [0, 0, 0, 1, 2, 2, 3, 3, 3], [0, 1, 2, 3, 0, 1, 1, 2, 3])
+        key_predicates = np.array([0, 0, 1, 1])
+        conjunction = conjunction_index(index, key_predicates, [0, 1])
+        blocks = dict((tuple(keys[code] for code in key), conjunction.block(k).tolist())
+                      for k, key in enumerate(conjunction.keys))
+        self.assertEqual(blocks, {('a', 'c'): [0, 1], ('a', 'd'): [1, 2], ('b', 'd'): [3]})
+        self.assertEqual(comparisons(conjunction), 2)
+        covered = covered_pairs(conjunction, np.array([0, 0, 1, 2]), np.array([1, 2, 2, 3]))
+        self.assertEqual(covered.tolist(), [True, False, True, False])
+
+    def test_predicates(self):
+        predicates = candidate_predicates(self._database.feature_descriptor)
+        self.assertIn((4, 'soundex'), predicates)  # City
+        self.assertIn((8, 'block'), predicates)  # Age
+        self.assertNotIn((8, 'soundex'), predicates)
+        self.assertNotIn((5, 'block'), predicates)  # ignored feature
+        index, key_predicates = predicate_index(self._database.records, predicates)
+        self.assertEqual(len(key_predicates), len(index))
+        self.assertTrue(all(predicates[p][0] == key[0] for p, key in zip(key_predicates, index.keys)))
+
+    def test_learn(self):
+        labels = fast_strong_cluster(self._database)
+        pair_seed = generate_pair_seed(self._database, labels, 0.5)
+        budget = 5000
+        rules = learn_dnf_blocking(self._database, labels, pair_seed, budget)
+        self.assertTrue(rules)
+        self.assertTrue(all(1 <= len(conjunction) <= 2 for conjunction in rules))
+        self.assertFalse(any(set(a) < set(b) for a in rules for b in rules))
+        blocks = BlockingScheme(self._database, dnf=rules)
+        self.assertTrue(blocks.statistics().comparisons <= budget)
+        self.assertEqual(sorted(set().union(*blocks.blocks())), sorted(self._database.records.keys()))
+        positives = [(a, b) for a, b in pair_seed if labels[a] == labels[b]]
+        pairs = set(map(tuple, blocks.candidate_pairs().tolist()))
+        found = [(min(a, b), max(a, b)) in pairs for a, b in positives]
+        self.assertTrue(np.mean(found) > 0.5)
+        self.assertEqual(learn_dnf_blocking(self._database, labels, pair_seed, 0), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
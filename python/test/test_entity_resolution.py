@@ -1,7 +1,8 @@
 import unittest
 import sys
 print sys.path
-from entityresolution import EntityResolution, merge_duped_records
+from entityresolution import EntityResolution, merge_duped_records, weak_connected_components, candidate_graph, \
+    record_to_blocks
 from database import Database
 from pairwise_features import generate_pair_seed
 from blocking import BlockingScheme
@@ -9,6 +10,7 @@ from pipeline import fast_strong_cluster
 from logistic_match import LogisticMatchFunction
 __author__ = 'mbarnes1'
 from copy import deepcopy
+import numpy as np
 
 
 class MyTestCase(unittest.TestCase):
@@ -92,8 +94,9 @@ class MyTestCase(unittest.TestCase):
         records_copy = deepcopy(self._database.records)
         r1 = records_copy[0]
         self.assertEqual(r1, self._database.records[0])
+        self.assertEqual(r1.features, self._database.records[0].features)
         r1.features[0].add('Santa Clause')
-        self.assertNotEqual(r1, self._database.records[0])
+        self.assertNotEqual(r1.features, self._database.records[0].features)
 
     def test_completeness(self):
         database = Database('test_annotations_10000_cleaned.csv', max_records=1000, header_path='test_annotations_10000_cleaned_header.csv')
@@ -114,6 +117,39 @@ class MyTestCase(unittest.TestCase):
         self.assertEqual(get_ids(database_test.records), sorted(labels_test.keys()))
         self.assertEqual(get_ids(database_test.records), sorted(labels_pred.keys()))
 
+    def test_candidate_graph(self):
+        nodes = np.array([2, 5, 7, 9])
+        pairs = np.array([[2, 7], [5, 7], [7, 9]])
+        indptr, neighbors = candidate_graph(nodes, pairs)
+        self.assertEqual(indptr.tolist(), [0, 1, 2, 5, 6])
+        self.assertEqual(neighbors.tolist(), [2, 2, 0, 1, 3, 2])
+
+    def test_first_block(self):
+        blocks = [{0, 1}, {0, 1, 2}, {1, 2, 3}]
+        self._er._record_blocks = record_to_blocks(blocks)
+        self.assertEqual(self._er._record_blocks[1], {0, 1, 2})
+        records = self._database.records
+        self.assertTrue(self._er._first_block(records[0], records[1], 0))
+        self.assertFalse(self._er._first_block(records[0], records[1], 1))
+        self.assertTrue(self._er._first_block(records[1], records[2], 1))
+        self.assertFalse(self._er._first_block(records[1], records[2], 2))
+        self.assertTrue(self._er._first_block(records[2], records[3], 2))
+
+    def test_weak_connected_components(self):
+        database = Database('test_annotations_10000_cleaned.csv', max_records=1000, header_path='test_annotations_10000_cleaned_header.csv')
+        labels_train = fast_strong_cluster(database)
+        pair_seed = generate_pair_seed(database, labels_train, 0.5)
+        match_function = LogisticMatchFunction(database, labels_train, pair_seed, 0.99)
+        blocking_scheme = BlockingScheme(database, max_block_size=100)
+        labels_pred = weak_connected_components(database, match_function, blocking_scheme)
+        self.assertEqual(sorted(labels_pred.keys()), range(0, 1000))
+        clusters = dict()
+        for record_id, cluster in labels_pred.iteritems():
+            clusters.setdefault(cluster, set()).add(record_id)
+        for first, second in blocking_scheme.candidate_pairs().tolist():  # matching candidates share a cluster
+            if labels_pred[first] != labels_pred[second]:
+                self.assertFalse(match_function.match(database.records[first], database.records[second])[0])
+
     def test_fast_strong_cluster(self):
         labels_pred = fast_strong_cluster(self._database)
         labels_true = {
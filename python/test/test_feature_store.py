@@ -0,0 +1,149 @@
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+import feature_store
+from database import Database
+from feature_store import PairwiseFeatureStore
+from pairwise_features import get_pairwise_features, get_precomputed_x2, get_weak_pairwise_feature_matrix, \
+    get_match_features
+__author__ = 'mbarnes1'
+
+
+class MyTestCase(unittest.TestCase):
+    def setUp(self):
+        self._path = os.path.join(tempfile.mkdtemp(), 'features')
+
+    def tearDown(self):
+        shutil.rmtree(os.path.dirname(self._path))
+
+    def test_add_lookup(self):
+        store = PairwiseFeatureStore(self._path, 2)
+        self.assertEqual(len(store), 0)
+        store.add([0, 3], [1, 2], np.array([[1.0, 2.0], [3.0, np.nan]]))
+        store.add([1, 4], [0, 5], np.array([[9.0, 9.0], [5.0, 6.0]]))  # (1, 0) is already stored
+        self.assertEqual(len(store), 3)
+        features, found = store.lookup([1, 2, 0, 7], [0, 3, 5, 8])
+        self.assertEqual(found.tolist(), [True, True, False, False])
+        self.assertEqual(features[0].tolist(), [1.0, 2.0])
+        self.assertEqual(features[1][0], 3.0)
+        self.assertTrue(np.isnan(features[1][1]))
+        self.assertTrue(np.isnan(features[2:]).all())
+        reopened = PairwiseFeatureStore(self._path, 2)  # persistent
+        self.assertEqual(len(reopened), 3)
+        self.assertEqual(reopened.lookup([5], [4])[0].tolist(), [[5.0, 6.0]])
+        random = np.random.RandomState(0)
+        for _ in range(5):  # the merged key index matches the index of a reopened store
+            first, second = random.randint(0, 20, 30), random.randint(0, 20, 30)
+            store.add(first, second, random.rand(30, 2))
+            reopened = PairwiseFeatureStore(self._path, 2)
+            self.assertTrue(np.array_equal(store.lookup(first, second)[0], reopened.lookup(first, second)[0]))
+            self.assertTrue(np.array_equal(np.sort(np.concatenate((store._sorted_keys, store._side_keys))),
+                                           reopened._sorted_keys))
+
+    def test_merge_side(self):
+        side_index_size = feature_store.SIDE_INDEX_SIZE
+        feature_store.SIDE_INDEX_SIZE = 8
+        try:
+            store = PairwiseFeatureStore(self._path, 2)
+            random = np.random.RandomState(0)
+            first, second = random.randint(0, 50, 200), random.randint(0, 50, 200)
+            features = random.rand(200, 2)
+            for i in range(0, 200, 5):
+                store.add(first[i:i + 5], second[i:i + 5], features[i:i + 5])
+                self.assertLessEqual(len(store._side_keys), max(8, int(np.sqrt(len(store._sorted_keys)))))
+            reopened = PairwiseFeatureStore(self._path, 2)
+            self.assertEqual(len(store), len(reopened))
+            self.assertGreater(len(store._sorted_keys), 0)
+            self.assertTrue(np.array_equal(store.lookup(first, second)[0], reopened.lookup(first, second)[0]))
+            self.assertTrue(store.lookup(first, second)[1].all())
+        finally:
+            feature_store.SIDE_INDEX_SIZE = side_index_size
+
+    def test_metadata(self):
+        store = PairwiseFeatureStore(self._path, 2, key='abc')
+        store.add([0], [1], np.array([[1.0, 2.0]]))
+        self.assertEqual(len(PairwiseFeatureStore(self._path, 2, key='abc')), 1)
+        self.assertRaises(Exception, PairwiseFeatureStore, self._path, 3, key='abc')
+        self.assertRaises(Exception, PairwiseFeatureStore, self._path, 2, key='xyz')
+        self.assertRaises(Exception, PairwiseFeatureStore, self._path, 2)
+        os.remove(os.path.join(self._path, 'metadata.csv'))
+        self.assertRaises(Exception, PairwiseFeatureStore, self._path, 2, key='abc')
+        self.assertRaises(Exception, Database, 'test_annotations_10000_cleaned.csv', max_records=10,
+                          header_path='test_annotations_10000_cleaned_header.csv',
+                          precomputed_x2=PairwiseFeatureStore(self._path + '_other', 2))
+
+    def test_minimum_features(self):
+        database = Database('test_annotations_10000_cleaned.csv', max_records=10,
+                            header_path='test_annotations_10000_cleaned_header.csv')
+        records = [database.records[i] for i in range(4)]
+        store = PairwiseFeatureStore(self._path, database.feature_descriptor.number_weak)
+        store.add_records([records[0], records[0], records[1]], [records[2], records[3], records[3]],
+                          get_weak_pairwise_feature_matrix([records[0], records[0], records[1]],
+                                                           [records[2], records[3], records[3]]))
+        merged = records[0].copy()
+        merged.merge(records[1])
+        x2, found = store.minimum_features([merged, merged, records[0]], [records[3], records[2], records[2]])
+        self.assertEqual(found.tolist(), [True, False, True])
+        expected = np.fmin(store.lookup([0], [3])[0][0], store.lookup([1], [3])[0][0])
+        self.assertTrue(np.array_equal(np.isnan(x2[0]), np.isnan(expected)))
+        self.assertTrue(np.array_equal(np.nan_to_num(x2[0]), np.nan_to_num(expected)))
+        self.assertIsNone(get_precomputed_x2(store, merged, records[2]))
+        self.assertTrue(np.array_equal(np.nan_to_num(get_precomputed_x2(store, records[0], records[2])),
+                                       np.nan_to_num(x2[2])))
+
+    def test_get_pairwise_features(self):
+        store = PairwiseFeatureStore(self._path, 20)
+        database = Database('test_annotations_10000_cleaned.csv', max_records=100, precomputed_x2=store,
+                            header_path='test_annotations_10000_cleaned_header.csv')
+        labels = dict((i, i % 10) for i in range(100))
+        pair_seed = [(i, (i*7 + 3) % 100) for i in range(100) if i != (i*7 + 3) % 100]
+        number_pairs = len(set(tuple(sorted(pair)) for pair in pair_seed))
+        y, x, _ = get_pairwise_features(database, labels, pair_seed, impute=False)
+        self.assertEqual(len(store), number_pairs)
+        y_stored, x_stored, _ = get_pairwise_features(database, labels, pair_seed, impute=False)
+        self.assertTrue(np.array_equal(y, y_stored))
+        self.assertTrue(np.array_equal(np.isnan(x), np.isnan(x_stored)))
+        self.assertTrue(np.array_equal(np.nan_to_num(x), np.nan_to_num(x_stored)))
+        self.assertEqual(len(store), number_pairs)
+
+    def test_match_features(self):
+        database = Database('test_annotations_10000_cleaned.csv', max_records=10,
+                            header_path='test_annotations_10000_cleaned_header.csv')
+        records = [database.records[i] for i in range(4)]
+        store = PairwiseFeatureStore(self._path, database.feature_descriptor.number_weak)
+        store.add_records([records[0]], [records[2]], get_weak_pairwise_feature_matrix([records[0]], [records[2]]))
+        merged = records[1].copy()
+        merged.merge(records[3])
+        records_1, records_2 = [records[0], merged, records[1]], [records[2], records[2], records[2]]
+        x = get_match_features(records_1, records_2, store)
+        expected = get_weak_pairwise_feature_matrix(records_1, records_2)
+        self.assertTrue(np.array_equal(np.isnan(x), np.isnan(expected)))
+        self.assertTrue(np.allclose(np.nan_to_num(x), np.nan_to_num(expected), rtol=1e-6))
+        self.assertEqual(len(store), 2)  # the pair of single ads is added, the merged record is not
+        self.assertTrue(store.lookup([1], [2])[1].all())
+
+    def test_defer(self):
+        store = PairwiseFeatureStore(self._path, 2)
+        store.add([0], [1], np.array([[1.0, 2.0]]))
+        store.defer()
+        first, second, features = store.take_deferred()
+        self.assertEqual((len(first), len(second), features.shape), (0, 0, (0, 2)))
+        store.add([0, 2], [1, 3], np.array([[9.0, 9.0], [3.0, 4.0]]))
+        store.add([4], [5], np.array([[5.0, 6.0]]))
+        self.assertEqual(len(store), 1)  # only kept in memory
+        self.assertEqual(len(PairwiseFeatureStore(self._path, 2)), 1)
+        first, second, features = store.take_deferred()
+        self.assertEqual(first.tolist(), [0, 2, 4])
+        self.assertEqual(second.tolist(), [1, 3, 5])
+        self.assertEqual(features.tolist(), [[9.0, 9.0], [3.0, 4.0], [5.0, 6.0]])
+        self.assertEqual(len(store.take_deferred()[0]), 0)
+        parent = PairwiseFeatureStore(self._path, 2)
+        parent.add(first, second, features)
+        self.assertEqual(len(parent), 3)
+        self.assertEqual(parent.lookup([0], [1])[0].tolist(), [[1.0, 2.0]])  # stored pairs are kept
+
+
+if __name__ == '__main__':
+    unittest.main()
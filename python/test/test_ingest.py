@@ -0,0 +1,83 @@
+import unittest
+import os
+import shutil
+import tempfile
+from ingest import read_header, read_headers, chunk_ranges, load_annotations, annotation_paths
+from database import Database
+import numpy as np
+__author__ = 'mbarnes1'
+
+
+class MyTestCase(unittest.TestCase):
+    def setUp(self):
+        self._test_path = 'test_annotations_10000_cleaned.csv'
+        self._header_path = 'test_annotations_10000_cleaned_header.csv'
+
+    def test_read_header(self):
+        feature_descriptor, ignore_indices, data_start = read_header(self._test_path, self._header_path)
+        self.assertEqual(ignore_indices, [])
+        self.assertEqual(feature_descriptor.number, 30)
+        ins = open(self._test_path, 'r')
+        ins.readline()
+        self.assertEqual(ins.tell(), data_start)
+        ins.close()
+        self.assertRaises(Exception, read_headers, [], self._header_path)
+
+    def test_chunk_ranges(self):
+        _, _, data_start = read_header(self._test_path, self._header_path)
+        ranges = chunk_ranges(self._test_path, data_start, 7)
+        self.assertEqual(len(ranges), 7)
+        self.assertEqual(ranges[0][0], data_start)
+        ins = open(self._test_path, 'r')
+        for (_, end), (begin, _) in zip(ranges[:-1], ranges[1:]):
+            self.assertEqual(end, begin)
+            ins.seek(begin - 1)
+            self.assertEqual(ins.read(1), '\n')
+        ins.close()
+
+    def test_chunked_matches_serial(self):
+        feature_descriptor, ignore_indices, data_start = read_header(self._test_path, self._header_path)
+        serial = load_annotations(self._test_path, feature_descriptor, ignore_indices, data_start)
+        chunked = load_annotations(self._test_path, feature_descriptor, ignore_indices, data_start, cores=3,
+                                   chunk_bytes=100000)
+        np.testing.assert_array_equal(serial.ids, np.arange(len(serial)))
+        np.testing.assert_array_equal(serial.ids, chunked.ids)
+        for column, chunked_column in zip(serial.columns, chunked.columns):
+            self.assertEqual(column, chunked_column)
+
+    def test_max_records_progress(self):
+        updates = list()
+        database = Database(self._test_path, header_path=self._header_path, max_records=409, cores=2,
+                            progress=lambda lines, parsed, total: updates.append((lines, parsed, total)))
+        self.assertEqual(sorted(database.records.keys()), range(0, 409))
+        self.assertTrue(updates)
+        self.assertTrue(updates[-1][0] >= 409)
+        self.assertTrue(updates[-1][1] <= updates[-1][2])
+
+    def test_shards(self):
+        shard_dir = tempfile.mkdtemp()
+        ins = open(self._test_path, 'r')
+        names = ins.readline()
+        lines = ins.readlines()
+        ins.close()
+        for shard, (begin, end) in enumerate([(0, 3000), (3000, 3001), (3001, 10000)]):
+            out = open(os.path.join(shard_dir, 'part_' + str(shard) + '.csv'), 'w')
+            out.write(names)
+            out.writelines(lines[begin:end])
+            out.close()
+        pattern = os.path.join(shard_dir, 'part_*.csv')
+        self.assertEqual(len(annotation_paths(pattern)), 3)
+        database = Database(self._test_path, header_path=self._header_path, storage='columnar')
+        sharded = Database(pattern, header_path=self._header_path, storage='columnar', cores=2)
+        listed = Database(annotation_paths(pattern), header_path=self._header_path, max_records=3500)
+        shutil.rmtree(shard_dir)
+        np.testing.assert_array_equal(sharded.records.store.ids, np.arange(10000))
+        for column, sharded_column in zip(database.records.store.columns, sharded.records.store.columns):
+            self.assertEqual(column, sharded_column)
+        self.assertEqual(database, sharded)
+        self.assertEqual(sorted(listed.records.keys()), range(0, 3500))
+        self.assertEqual(listed.records[3000].features, database.records[3000].features)
+
+
+if __name__ == '__main__':
+    unittest.main()
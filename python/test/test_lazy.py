@@ -0,0 +1,60 @@
+import unittest
+from copy import deepcopy
+from lazy import line_offsets
+from ingest import read_header
+from database import Database
+from record import same_record_features
+from blocking import BlockingScheme
+import numpy as np
+__author__ = 'mbarnes1'
+
+
+class MyTestCase(unittest.TestCase):
+    def setUp(self):
+        self._test_path = 'test_annotations_10000_cleaned.csv'
+        self._header_path = 'test_annotations_10000_cleaned_header.csv'
+
+    def test_line_offsets(self):
+        _, _, data_start = read_header(self._test_path, self._header_path)
+        starts, ends = line_offsets(self._test_path, data_start, block_bytes=4096)
+        ins = open(self._test_path, 'r')
+        ins.seek(data_start)
+        lines = ins.readlines()
+        ins.close()
+        self.assertEqual(len(starts), len(lines))
+        self.assertEqual(starts[0], data_start)
+        np.testing.assert_array_equal(ends - starts, [len(line) for line in lines])
+        starts, _ = line_offsets(self._test_path, data_start, max_records=409, block_bytes=4096)
+        self.assertEqual(len(starts), 409)
+
+    def test_lazy_records(self):
+        database = Database(self._test_path, header_path=self._header_path, max_records=1000)
+        lazy = Database(self._test_path, header_path=self._header_path, max_records=1000, storage='lazy')
+        self.assertEqual(len(lazy.records), 1000)
+        self.assertEqual(database.records[512].features, lazy.records[512].features)
+        self.assertEqual(lazy.records.column(0).counts().sum(),
+                         sum(len(r.features[0]) for r in database.records.values()))
+        self.assertTrue(same_record_features(database.records, deepcopy(lazy.records)))
+        self.assertEqual(database, lazy)
+
+    def test_lazy_sample_and_remove(self):
+        lazy = Database(self._test_path, header_path=self._header_path, storage='lazy')
+        sample = lazy.sample_and_remove(100)
+        self.assertEqual(len(sample.records), 100)
+        self.assertEqual(len(lazy.records) + 100, 10000)
+        self.assertEqual(len(set(sample.records.keys()) & set(lazy.records.keys())), 0)
+        database = Database(self._test_path, header_path=self._header_path)
+        for record_id, record in sample.records.iteritems():
+            self.assertEqual(record.features, database.records[record_id].features)
+
+    def test_lazy_blocking(self):
+        database = Database(self._test_path, header_path=self._header_path, max_records=1000)
+        lazy = Database(self._test_path, header_path=self._header_path, max_records=1000, storage='lazy')
+        blocks = BlockingScheme(database, max_block_size=200)
+        lazy_blocks = BlockingScheme(lazy, max_block_size=200)
+        self.assertEqual(blocks.strong_blocks, lazy_blocks.strong_blocks)
+        self.assertEqual(blocks.weak_blocks, lazy_blocks.weak_blocks)
+
+
+if __name__ == '__main__':
+    unittest.main()
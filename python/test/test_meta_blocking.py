@@ -0,0 +1,58 @@
+import unittest
+import numpy as np
+from inverted_index import InvertedIndex
+from meta_blocking import blocking_graph, edge_weights, prune_edges, meta_block
+__author__ = 'mbarnes1'
+
+
+class MyTestCase(unittest.TestCase):
+    def setUp(self):
+        # Blocks {0, 1, 2}, {0, 1}, {1, 2, 3}, {4}
+        keys = ['a', 'b', 'c', 'd']
+        key_codes = np.array([0, 0, 0, 1, 1, 2, 2, 2, 3])
+        record_ids = np.array([0, 1, 2, 0, 1, 1, 2, 3, 4])
+        self._index = InvertedIndex.from_pairs(keys, key_codes, record_ids)
+        self._keep = np.ones(4, dtype=bool)
+
+    def test_blocking_graph(self):
+        nodes, first, second, common, node_blocks = blocking_graph(self._index, self._keep)
+        self.assertEqual(nodes.tolist(), [0, 1, 2, 3, 4])
+        edges = dict(zip(zip(nodes[first].tolist(), nodes[second].tolist()), common.tolist()))
+        self.assertEqual(edges, {(0, 1): 2, (0, 2): 1, (1, 2): 2, (1, 3): 1, (2, 3): 1})
+        self.assertEqual(node_blocks.tolist(), [2, 3, 2, 1, 1])
+        keep = np.array([True, False, True, True])
+        nodes, first, second, common, _ = blocking_graph(self._index, keep)
+        self.assertEqual(common.tolist(), [1, 1, 2, 1, 1])
+
+    def test_weights(self):
+        nodes, first, second, common, node_blocks = blocking_graph(self._index, self._keep)
+        self.assertEqual(edge_weights(first, second, common, node_blocks, 4, 'CBS').tolist(), common.tolist())
+        jaccard = edge_weights(first, second, common, node_blocks, 4, 'JS')
+        self.assertAlmostEqual(jaccard[0], 2.0/3)  # edge (0, 1)
+        ecbs = edge_weights(first, second, common, node_blocks, 4, 'ECBS')
+        self.assertAlmostEqual(ecbs[0], 2*np.log(2)*np.log(4.0/3))
+        self.assertRaises(Exception, edge_weights, first, second, common, node_blocks, 4, 'XYZ')
+
+    def test_pruning(self):
+        first = np.array([0, 0, 0, 1])
+        second = np.array([1, 2, 3, 2])
+        weights = np.array([3.0, 1.0, 1.0, 1.0])
+        # Means: node 0 5/3, node 1 2, node 2 1, node 3 1
+        self.assertEqual(prune_edges(first, second, weights, 4, 'WNP').tolist(), [True, True, True, True])
+        weights = np.array([3.0, 1.0, 1.0, 0.5])
+        # Means: node 0 5/3, node 1 1.75, node 2 0.75, node 3 1
+        self.assertEqual(prune_edges(first, second, weights, 4, 'WNP').tolist(), [True, True, True, False])
+        self.assertEqual(prune_edges(first, second, weights, 4, 'CNP', k=1).tolist(), [True, True, True, False])
+        self.assertEqual(prune_edges(first, second, weights, 4, 'CNP', k=3).tolist(), [True]*4)
+        self.assertRaises(Exception, prune_edges, first, second, weights, 4, 'XYZ')
+
+    def test_meta_block(self):
+        pairs, weights = meta_block(self._index, self._keep, 'JS', 'CNP', k=1)
+        self.assertEqual(pairs.tolist(), [[0, 1], [1, 2], [2, 3]])
+        self.assertTrue(np.allclose(weights, [2.0/3, 2.0/3, 0.5]))
+        pairs, weights = meta_block(self._index, np.zeros(4, dtype=bool))
+        self.assertEqual(pairs.shape, (0, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
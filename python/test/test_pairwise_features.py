@@ -1,7 +1,9 @@
 __author__ = 'mbarnes1'
 import unittest
-from pairwise_features import mean_imputation, number_matches, numerical_difference, \
-    binary_match, strong_match, get_weak_pairwise_features, get_pairwise_features, generate_pair_seed, levenshtein
+import Levenshtein
+from pairwise_features import mean_imputation, number_matches, numerical_difference, date_difference, \
+    binary_match, strong_match, get_weak_pairwise_features, get_pairwise_features, generate_pair_seed, levenshtein, \
+    get_weak_pairwise_feature_matrix, get_strong_matches, qgram_bound
 from logistic_match import LogisticMatchFunction
 from pipeline import fast_strong_cluster
 from database import Database
@@ -104,6 +106,32 @@ class MyTestCase(unittest.TestCase):
         self.assertTrue(isnan(x2[18]))  # [25] bin
         self.assertEqual(x2[19], np.exp(-3))  # [26] number matches
 
+    def test_feature_matrix(self):
+        database = Database('test_annotations_10000_cleaned.csv', max_records=500,
+                            header_path='test_annotations_10000_cleaned_header.csv')
+        random_state = np.random.RandomState(0)
+        records = [database.records[i] for i in range(500)]
+        for first in range(0, 500, 10):  # merged entities, with many variants of each feature
+            merged = records[first].copy()
+            for i in random_state.randint(0, 500, 20):
+                merged.merge(records[i])
+            records.append(merged)
+        records_1 = [records[i] for i in random_state.randint(0, len(records), 2000)]
+        records_2 = [records[i] for i in random_state.randint(0, len(records), 2000)]
+        x_batch = get_weak_pairwise_feature_matrix(records_1, records_2)
+        x_single = np.array([get_weak_pairwise_features(r1, r2) for r1, r2 in zip(records_1, records_2)])
+        self.assertTrue(np.array_equal(np.isnan(x_batch), np.isnan(x_single)))
+        self.assertTrue(np.allclose(np.nan_to_num(x_batch), np.nan_to_num(x_single)))
+        out = np.zeros(x_batch.shape)
+        self.assertIs(get_weak_pairwise_feature_matrix(records_1, records_2, out=out), out)
+        x1_batch = get_strong_matches(records_1, records_2)
+        x1_single = np.array([strong_match(r1, r2) for r1, r2 in zip(records_1, records_2)], dtype=float)
+        self.assertTrue(np.array_equal(np.isnan(x1_batch), np.isnan(x1_single)))
+        self.assertTrue(np.array_equal(np.nan_to_num(x1_batch), np.nan_to_num(x1_single)))
+        r0 = self._database.records[0]
+        self.assertTrue(np.array_equal(np.isnan(get_weak_pairwise_feature_matrix([r0], [r0])[0]),
+                                       np.isnan(get_weak_pairwise_features(r0, r0))))
+
     def test_number_matches(self):
         x_a = {1, 2, 3}
         x_b = {3, 4, 5}
@@ -119,6 +147,16 @@ class MyTestCase(unittest.TestCase):
         self.assertEqual(numerical_difference(x_a, x_a), 0)
         self.assertEqual(numerical_difference(x_a, x_b), 1)
         self.assertTrue(isnan(numerical_difference(x_a, x_c)))
+        x_d = set(range(0, 10000, 7))  # sorted search
+        x_e = set(range(3, 10000, 11))
+        self.assertEqual(numerical_difference(x_d, x_e), 0)
+        self.assertEqual(numerical_difference(x_d, {10004.5, -2}), 2)
+
+    def test_date_difference(self):
+        day = 86400
+        self.assertEqual(date_difference({0}, {3*day + 5}), 3*day + 5)  # total seconds, including days
+        self.assertEqual(date_difference(set(range(0, 1000*day, day)), {10*day - 1, 2000*day}), 1)
+        self.assertTrue(isnan(date_difference({0}, set())))
 
     def test_binary_match(self):
         x_a = {1, 2, 3}
@@ -141,6 +179,21 @@ class MyTestCase(unittest.TestCase):
         self.assertEqual(d, 2)
         d = levenshtein(r1, r1)
         self.assertEqual(d, 0)
+        self.assertEqual(levenshtein(r1, r2, cap=1), 1)
+        self.assertEqual(levenshtein(r1, r2, cap=5), 2)
+        self.assertTrue(isnan(levenshtein(r1, set())))
+        long_1 = {'a'*100 + 'b'*100, 'c'*150}
+        long_2 = {'a'*100 + 'b'*99 + 'c', 'd'*150}
+        self.assertEqual(levenshtein(long_1, long_2), 1)
+        variants_1 = set('variant ' + str(i)*(i % 7) for i in range(40))
+        variants_2 = set('other ' + str(i)*(i % 5) for i in range(40))
+        self.assertEqual(levenshtein(variants_1, variants_2),
+                         min(Levenshtein.distance(s1, s2) for s1 in variants_1 for s2 in variants_2))
+
+    def test_qgram_bound(self):
+        self.assertEqual(qgram_bound('abcdef', 'abcdef', dict()), 0)
+        self.assertEqual(qgram_bound('aaaa', 'bbbb', dict()), 2)  # 3 bigrams each, none shared
+        self.assertLessEqual(qgram_bound('abab', 'baba', dict()), 2)
 
 
 if __name__ == '__main__':
@@ -1,6 +1,10 @@
 import unittest
-import datetime
-from record import Record, FeatureDescriptor
+import calendar
+import pickle
+from copy import deepcopy
+import numpy as np
+from record import Record, FeatureDescriptor, get_date, get_epoch_seconds, convert_dates, convert_column, \
+    same_record_features
 __author__ = 'mbarnes1'
 
 
@@ -27,7 +31,7 @@ class MyTestCase(unittest.TestCase):
         self.assertSetEqual(self._r0.line_indices, {0})
         self.assertSetEqual(self._r0.features[0], {9552601})
         self.assertSetEqual(self._r0.features[1], {'neworleans'})
-        self.assertSetEqual(self._r0.features[2], {datetime.datetime(2014, 1, 30, 2, 41, 11)})
+        self.assertSetEqual(self._r0.features[2], {1391049671})  # 2014-01-30 02:41:11, in seconds since the epoch
         self.assertSetEqual(self._r0.features[3], {'Louisiana'})
         self.assertSetEqual(self._r0.features[4], {'New Orleans'})
         self.assertEqual(self._r0.features[5], {8})
@@ -56,26 +60,88 @@ class MyTestCase(unittest.TestCase):
                                                     'Louisiana_2014_1_30_1391067671000_6_4.jpg',
                                                     'Louisiana_2014_1_30_1391067671000_6_5.jpg'})
 
+    def test_dates(self):
+        dates = ['2014-01-30 02:41:11', '1970-01-01 00:00:00', '1969-12-31 23:59:59', '2000-02-29 12:00:00',
+                 '2100-03-01 00:00:01']
+        seconds = [calendar.timegm(get_date(date).timetuple()) for date in dates]
+        self.assertEqual([get_epoch_seconds(date) for date in dates], seconds)
+        np.testing.assert_array_equal(convert_dates(dates), seconds)
+        self.assertRaises(ValueError, convert_dates, ['2014-13-30 02:41:11'])
+        self.assertRaises(ValueError, convert_dates, ['2014-01-30'])
+
+    def test_convert_column(self):
+        np.testing.assert_array_equal(convert_column(['1', '2.7', '-3'], 'int'), [1, 2, -3])
+        np.testing.assert_array_equal(convert_column(['1', '2.5'], 'float'), [1.0, 2.5])
+        self.assertEqual(list(convert_column(['a', 'b'], 'string')), ['a', 'b'])
+        self.assertRaises(ValueError, convert_column, ['1', 'x'], 'int')
+
     def test_eq(self):
         self.assertEqual(self._r0, self._r1)
         self._r0.initialize_from_annotation(self._features_full)
-        self.assertNotEqual(self._r0, self._r1)
+        self.assertEqual(self._r0, self._r1)  # same ad
+        self.assertEqual(hash(self._r0), hash(self._r1))
+        self.assertNotEqual(self._r0, Record(1, self._r0.feature_descriptor))
+        self.assertFalse(self._r0.same_features(self._r1))  # same ad, different features
         self._r1.initialize_from_annotation(self._features_full)
-        self.assertEqual(self._r0, self._r1)
+        self.assertTrue(self._r0.same_features(self._r1))
+        self.assertNotEqual(self._r0, None)
+        self.assertFalse(self._r0 == 'record')
+        r2 = Record(2, self._r0.feature_descriptor)
+        merged_1, merged_2 = self._r0.copy(), r2.copy()
+        merged_1.merge(r2)
+        merged_2.merge(self._r0)  # same ads, merged in the other order
+        self.assertEqual(merged_1, merged_2)
+        self.assertEqual(hash(merged_1), hash(merged_2))
+        self.assertEqual(len({merged_1, merged_2}), 1)
+        self.assertTrue(same_record_features({0: self._r0}, {0: self._r0.copy()}))
+        self.assertFalse(same_record_features({0: self._r0}, {0: r2}))
 
     def test_initialize_from_empty_annotation(self):
         annotation_empty = ',,,,,,,,,,,,,,,,,,,,,,,,,,,,,'.split(',')
         self._r0.initialize_from_annotation(annotation_empty)
-        self.assertEqual(self._r0, self._r1)
+        self.assertEqual(self._r0.features, self._r1.features)
 
     def test_merge(self):
         self._r0.merge(self._r1)
         self.assertEqual(self._r0, self._r1)
-        self._r0.initialize_from_annotation(self._features_full)
-        self._r0.merge(self._r1)
+        r2 = Record(1, self._r0.feature_descriptor)
+        r2.initialize_from_annotation(self._features_full)
+        self._r0.merge(r2)
         self.assertNotEqual(self._r0, self._r1)
+        self.assertEqual(self._r0.features, r2.features)
         self._r1.merge(self._r0)
         self.assertEqual(self._r0, self._r1)
+        self.assertEqual(self._r0.features, self._r1.features)
+
+    def test_get_features(self):
+        self._r0.feature_descriptor.strengths = ['strong', 'weak'] + ['none']*28
+        self._r0.initialize_from_annotation(self._features_full)
+        self.assertEqual(self._r0.get_features('strong'), {(0, 9552601)})
+        self.assertEqual(self._r0.get_features('weak'), {(1, 'neworleans')})
+
+    def test_copy(self):
+        self._r0.initialize_from_annotation(self._features_full)
+        self.assertFalse(hasattr(self._r0, '__dict__'))
+        for r in [self._r0.copy(), deepcopy(self._r0), pickle.loads(pickle.dumps(self._r0, 2))]:
+            self.assertEqual(r, self._r0)
+            self.assertTrue(r.same_features(self._r0))
+            self.assertEqual(hash(r), hash(self._r0))
+            r.features[0].add(1)
+            self.assertNotEqual(r.features, self._r0.features)
+
+    def test_comparison_plan(self):
+        feature_descriptor = FeatureDescriptor(['a', 'b', 'c', 'd'], ['int', 'string', 'string', 'date'],
+                                               ['strong', 'ignore', 'weak', 'weak'], ['', '', '', ''],
+                                               ['binary_match', '', 'levenshtein', 'special_date_difference'])
+        self.assertEqual([entry[0] for entry in feature_descriptor.strong_plan], [0])
+        self.assertEqual([entry[:2] for entry in feature_descriptor.weak_plan], [(2, 0), (3, 1)])
+        self.assertRaises(Exception, FeatureDescriptor, ['a'], ['int'], ['weak'], [''], ['soundex'])
+        self.assertRaises(Exception, FeatureDescriptor, ['a'], ['string'], ['strong'], [''], ['levenshtein'])
+        capped = FeatureDescriptor(['a'], ['string'], ['weak'], [''], ['levenshtein:2'])
+        self.assertEqual(capped, FeatureDescriptor(['a'], ['string'], ['weak'], [''], ['levenshtein:2']))
+        self.assertEqual(capped.weak_plan[0][2]({'abcdef'}, {'uvwxyz'}), 2)
+        for pairwise_use in ['levenshtein:x', 'levenshtein:0', 'binary_match:2']:
+            self.assertRaises(Exception, FeatureDescriptor, ['a'], ['string'], ['weak'], [''], [pairwise_use])
 
 
 if __name__ == '__main__':
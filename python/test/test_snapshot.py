@@ -0,0 +1,52 @@
+import unittest
+import os
+import shutil
+import tempfile
+from database import Database
+from snapshot import snapshot_key
+from record import same_record_features
+import numpy as np
+__author__ = 'mbarnes1'
+
+
+class MyTestCase(unittest.TestCase):
+    def setUp(self):
+        self._test_path = 'test_annotations_10000_cleaned.csv'
+        self._header_path = 'test_annotations_10000_cleaned_header.csv'
+        self._snapshot_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._snapshot_dir)
+
+    def test_save_load(self):
+        database = Database(self._test_path, header_path=self._header_path, max_records=500)
+        path = os.path.join(self._snapshot_dir, 'snapshot')
+        database.save_snapshot(path)
+        loaded = Database.load_snapshot(path, storage='dict')
+        self.assertEqual(database.feature_descriptor, loaded.feature_descriptor)
+        self.assertEqual(sorted(loaded.records.keys()), range(0, 500))
+        for record_id, record in database.records.iteritems():
+            self.assertEqual(record.features, loaded.records[record_id].features)
+        columnar = Database.load_snapshot(path)
+        self.assertTrue(isinstance(columnar.records.column(0).values, np.memmap))
+        self.assertEqual(columnar.records[7].features, database.records[7].features)
+
+    def test_automatic_reuse(self):
+        key = snapshot_key(self._test_path, self._header_path, 300)
+        self.assertNotEqual(key, snapshot_key(self._test_path, self._header_path, 301))
+        database = Database(self._test_path, header_path=self._header_path, max_records=300,
+                            snapshot_dir=self._snapshot_dir)
+        self.assertEqual(os.listdir(self._snapshot_dir), [key])
+        reused = Database(self._test_path, header_path=self._header_path, max_records=300,
+                          snapshot_dir=self._snapshot_dir)
+        self.assertTrue(same_record_features(database.records, reused.records))
+        self.assertEqual(database, reused)
+
+    def test_merged(self):
+        database = Database('test_annotations_cleaned.csv')
+        database.merge({0: 'A', 1: 'B', 2: 'A', 3: 'B'})
+        self.assertRaises(Exception, database.save_snapshot, os.path.join(self._snapshot_dir, 'merged'))
+
+
+if __name__ == '__main__':
+    unittest.main()
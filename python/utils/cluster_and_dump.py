@@ -15,7 +15,8 @@ def main():
     header_path = '/home/scratch/trafficjam/entity_resolution_inputs/rebuild_annotations_header.csv'
     out = open('/home/scratch/trafficjam/entity_resolution_inputs/rebuild_phone_clusters_faster.csv', 'w')
     out.write('annotations_line (0 indexed), text_line (1 indexed), cluster_id\n')
-    database = Database(path, header_path=header_path)
+    snapshot_dir = '/home/scratch/trafficjam/entity_resolution_inputs/snapshots'
+    database = Database(path, header_path=header_path, snapshot_dir=snapshot_dir)
     strong_clusters = fast_strong_cluster(database)
     line_indices = strong_clusters.keys()
     line_indices.sort()